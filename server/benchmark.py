@@ -0,0 +1,612 @@
+"""
+Benchmark suite for the redaction pipeline
+Generates synthetic PDFs and scanned images, times every pipeline stage
+separately and emits JSON with percentiles so runs can be compared against
+a stored baseline.
+
+Runs fully offline: Hugging Face downloads are disabled (the GLiNER weights
+must already be cached, or pass --skip-gliner) and LLM calls are stubbed,
+except in --compare-llm-backends. The entity cache is off unless
+--entity-cache is given, so the gliner stage always times the model.
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --pages 1 10 --density 5 40 --resolution 1240 2480 --repeat 5
+    python benchmark.py --baseline bench_baseline.json --tolerance 0.25
+    python benchmark.py --compare-ocr-backends --resolution 600 1240
+    python benchmark.py --concurrency 1 4 16 --resolution 1240 --density 10
+    python benchmark.py --compare-llm-backends gemini local --llm-cases 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import cv2
+import fitz
+import numpy as np
+
+import entity_cache
+import llm_backends
+import main
+import metrics
+import normalization
+import ocr
+import prompt_redaction
+
+PERCENTILES = [50, 90, 95, 99]
+LLM_BENCH_INTENT = "Remove all personal, contact and financial information"
+
+FIRST_NAMES = ["Ramesh", "Priya", "Arjun", "Sneha", "Rahul", "Kavya", "Sandeep", "Ananya"]
+LAST_NAMES = ["Kumar", "Sharma", "Rao", "Verma", "Reddy", "Iyer", "Gupta", "Nair"]
+CITIES = ["Hyderabad", "Bengaluru", "Chennai", "Mumbai", "Pune", "Delhi"]
+FILLER = [
+    "The applicant submitted the required documents for verification.",
+    "This statement is generated for internal record keeping only.",
+    "Please contact the branch office for any discrepancies.",
+    "All figures are subject to final audit and reconciliation.",
+    "The undersigned confirms the information provided is accurate.",
+    "Processing of the request will take three to five working days.",
+]
+
+
+# ==================== SYNTHETIC DATA ====================
+
+def _make_entity(rng: random.Random) -> Dict:
+    """Create one synthetic sensitive entity with its label"""
+    kind = rng.choice(["name", "email", "phone", "pan", "amount", "city"])
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    if kind == "name":
+        return {"text": f"{first} {last}", "label": "PERSON_NAME"}
+    if kind == "email":
+        return {"text": f"{first.lower()}.{last.lower()}{rng.randint(1, 99)}@example.com", "label": "EMAIL_ADDRESS"}
+    if kind == "phone":
+        return {"text": f"+91 {rng.randint(70000, 99999)} {rng.randint(10000, 99999)}", "label": "PHONE_NUMBER"}
+    if kind == "pan":
+        letters = "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(5))
+        return {"text": f"{letters}{rng.randint(1000, 9999)}{rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')}", "label": "PAN_NUMBER"}
+    if kind == "amount":
+        return {"text": f"Rs. {rng.randint(1000, 999999):,}", "label": "AMOUNT"}
+    return {"text": rng.choice(CITIES), "label": "CITY"}
+
+
+def generate_page_lines(rng: random.Random, density: int, lines_per_page: int):
+    """
+    Generate the text lines of one page with a fixed number of entities
+
+    Args:
+        rng: Seeded random generator
+        density: Number of entities placed on the page
+        lines_per_page: Total number of lines on the page
+
+    Returns:
+        Tuple of (lines, entities)
+    """
+    lines = [rng.choice(FILLER) for _ in range(lines_per_page)]
+    entities = []
+    for _ in range(density):
+        entity = _make_entity(rng)
+        idx = rng.randrange(lines_per_page)
+        lines[idx] = f"{lines[idx]} Ref: {entity['text']}."
+        entities.append(entity)
+    return lines, entities
+
+
+def generate_pdf(rng: random.Random, pages: int, density: int) -> tuple:
+    """Build a synthetic text-layer PDF and return (pdf_bytes, entities)"""
+    entities = []
+    doc = fitz.open()
+    for _ in range(pages):
+        lines, page_entities = generate_page_lines(rng, density, lines_per_page=45)
+        entities.extend(page_entities)
+        page = doc.new_page(width=595, height=842)
+        y = 50
+        for line in lines:
+            page.insert_text((40, y), line, fontsize=9)
+            y += 16
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes, entities
+
+
+def generate_scanned_image(rng: random.Random, width: int, density: int) -> tuple:
+    """
+    Render a synthetic scanned page with cv2.putText plus sensor noise
+
+    Args:
+        rng: Seeded random generator
+        width: Image width in pixels (height follows A4 aspect ratio)
+        density: Number of entities placed on the page
+
+    Returns:
+        Tuple of (BGR image, entities)
+    """
+    height = int(width * 1.414)
+    line_height = max(12, width // 45)
+    font_scale = line_height / 32
+    lines, entities = generate_page_lines(rng, density, lines_per_page=max(1, (height - 2 * line_height) // line_height))
+
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    y = line_height * 2
+    for line in lines:
+        cv2.putText(image, line, (line_height, y), cv2.FONT_HERSHEY_SIMPLEX,
+                    font_scale, (0, 0, 0), max(1, int(font_scale * 1.5)), cv2.LINE_AA)
+        y += line_height
+
+    noise = np.random.default_rng(rng.randint(0, 2 ** 31)).normal(0, 12, image.shape)
+    image = np.clip(image.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+    image = cv2.GaussianBlur(image, (3, 3), 0)
+    return image, entities
+
+
+# ==================== STUBBED LLM ====================
+
+def install_llm_stub(entities: List[Dict]):
+    """Replace the Gemini client with a canned RedactionPlan so no network is used"""
+    from langchain_core.runnables import RunnableLambda
+
+    canned = json.dumps({
+        "entities": [
+            {"text": e["text"], "entity_type": e["label"], "reason": "benchmark", "confidence": 0.9}
+            for e in entities
+        ],
+        "redaction_strategy": "BlackOut",
+        "summary": "Synthetic benchmark plan",
+    })
+    prompt_redaction.get_llm = lambda: RunnableLambda(lambda _prompt: canned)
+
+
+# ==================== TIMING ====================
+
+class StageTimer:
+    """Collects wall-clock samples per stage across repeats"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+
+    @contextmanager
+    def pipeline(self):
+        """
+        Record the stages the pipeline code times itself (metrics.stage)
+
+        Stages that run several times in one pass, such as the per-page
+        search, are summed into one sample per pass.
+        """
+        totals: Dict[str, float] = {}
+
+        def hook(name: str, elapsed: float):
+            totals[name] = totals.get(name, 0.0) + elapsed * 1000
+
+        try:
+            with metrics.stage_hook(hook):
+                yield
+        finally:
+            for name, value in totals.items():
+                self.samples.setdefault(name, []).append(value)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {name: summarize(values) for name, values in self.samples.items()}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of an unsorted list"""
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """Summary statistics (milliseconds) for one stage"""
+    result = {f"p{p}": round(percentile(values, p), 3) for p in PERCENTILES}
+    result.update({
+        "mean": round(statistics.fmean(values), 3),
+        "min": round(min(values), 3),
+        "max": round(max(values), 3),
+        "n": len(values),
+    })
+    return result
+
+
+# ==================== SCENARIOS ====================
+
+def run_pdf_scenario(pdf_bytes: bytes, entities: List[Dict], timer: StageTimer, skip_gliner: bool):
+    """
+    Run one pass of the PDF pipeline, timing each stage
+
+    Redaction goes through main.process_pdf_redaction, so the pdf_search,
+    pdf_apply_redactions, pdf_ocr_fallback and pdf_save stages are the ones
+    the server records, and the output profile is applied as in production.
+    """
+    with timer.stage("text_extraction"):
+        text = main.extract_text_from_pdf(pdf_bytes)
+    normalized = normalization.preprocess(text)
+    cleaned_text = normalized.text
+
+    if not skip_gliner:
+        with timer.stage("gliner"):
+            main.predict_entities(cleaned_text, normalized=normalized)
+
+    with timer.stage("intent_analysis_stubbed"):
+        prompt_redaction.analyze_intent("Remove all personal information", cleaned_text)
+
+    with timer.pipeline(), timer.stage("pdf_redaction_total"):
+        asyncio.run(main.process_pdf_redaction(pdf_bytes, entities, "BlackOut", in_memory=True))
+
+
+def run_image_scenario(image: np.ndarray, entities: List[Dict], timer: StageTimer,
+                       workdir: str, skip_gliner: bool):
+    """Run one pass of the image pipeline, timing each stage"""
+    image_path = os.path.join(workdir, "bench_scan.png")
+    cv2.imwrite(image_path, image)
+
+    with timer.stage("ocr_text"):
+        text = main.extract_text_from_image(image_path)
+    normalized = normalization.preprocess(text)
+    cleaned_text = normalized.text
+
+    with timer.stage("ocr_boxes"):
+        text_boxes = main.get_text_boxes(image)
+
+    if not skip_gliner and cleaned_text:
+        with timer.stage("gliner"):
+            main.predict_entities(cleaned_text, normalized=normalized)
+
+    with timer.stage("matching"):
+        layout = normalization.WordLayout([box["text"] for box in text_boxes])
+        for entity in entities:
+            normalization.find_spans(layout, entity["text"])
+
+    with timer.stage("redaction_rendering"):
+        redacted = main.redact_matching_text(image, text_boxes, entities, "BlackOut")
+
+    with timer.stage("save"):
+        cv2.imwrite(os.path.join(workdir, "bench_redacted.jpg"), redacted)
+
+
+def run_suite(args) -> Dict:
+    """Run every configured scenario and return the JSON report"""
+    scenarios = {}
+    with tempfile.TemporaryDirectory(prefix="secureflow-bench-") as workdir:
+        for pages in args.pages:
+            for density in args.density:
+                rng = random.Random(f"{args.seed}-pdf-{pages}-{density}")
+                pdf_bytes, entities = generate_pdf(rng, pages, density)
+                install_llm_stub(entities)
+                timer = StageTimer()
+                for _ in range(args.warmup + args.repeat):
+                    run_pdf_scenario(pdf_bytes, entities, timer, args.skip_gliner)
+                _drop_warmup(timer, args.warmup)
+                name = f"pdf_pages{pages}_density{density}"
+                scenarios[name] = {
+                    "kind": "pdf",
+                    "pages": pages,
+                    "density": density,
+                    "input_bytes": len(pdf_bytes),
+                    "stages": timer.summary(),
+                }
+                print(f"[bench] {name} done", file=sys.stderr)
+
+        for width in args.resolution:
+            for density in args.density:
+                rng = random.Random(f"{args.seed}-img-{width}-{density}")
+                image, entities = generate_scanned_image(rng, width, density)
+                timer = StageTimer()
+                for _ in range(args.warmup + args.repeat):
+                    run_image_scenario(image, entities, timer, workdir, args.skip_gliner)
+                _drop_warmup(timer, args.warmup)
+                name = f"image_width{width}_density{density}"
+                scenarios[name] = {
+                    "kind": "image",
+                    "width": width,
+                    "height": image.shape[0],
+                    "density": density,
+                    "stages": timer.summary(),
+                }
+                print(f"[bench] {name} done", file=sys.stderr)
+
+    return {"meta": run_metadata(args), "scenarios": scenarios}
+
+
+def run_metadata(args) -> Dict:
+    return {
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pymupdf": fitz.VersionBind,
+        "opencv": cv2.__version__,
+        "gliner_model": None if args.skip_gliner else main.GLINER_MODEL_NAME,
+        "entity_cache": entity_cache.enabled(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "warmup": args.warmup,
+    }
+
+
+def run_ocr_backend_comparison(args) -> Dict:
+    """Per-image OCR latency for every available Tesseract backend"""
+    backends = ["pytesseract"] + (["tesserocr"] if ocr.tesserocr is not None else [])
+    original_backend = ocr.OCR_BACKEND
+    results = {}
+    try:
+        for width in args.resolution:
+            rng = random.Random(f"{args.seed}-ocr-{width}")
+            image, _ = generate_scanned_image(rng, width, density=5)
+            processed, _ = ocr.preprocess_for_ocr(image)
+            for backend in backends:
+                ocr.OCR_BACKEND = backend
+                timer = StageTimer()
+                for _ in range(args.warmup + args.repeat):
+                    with timer.stage("ocr_words"):
+                        ocr.image_to_words_single(processed)
+                _drop_warmup(timer, args.warmup)
+                results[f"width{width}_{backend}"] = {
+                    "backend": backend,
+                    "width": width,
+                    "stages": timer.summary(),
+                }
+                print(f"[bench] ocr backend {backend} at {width}px done", file=sys.stderr)
+    finally:
+        ocr.OCR_BACKEND = original_backend
+    return results
+
+
+def run_llm_backend_comparison(args) -> Dict:
+    """
+    Latency and plan quality of each LLM backend on synthetic documents
+
+    Quality is scored against the generated entities: precision, recall and
+    F1 of the planned texts, the share of calls that parsed as a
+    RedactionPlan, and the share of planned texts found verbatim in the
+    document (only those can be redacted).
+    """
+    cases = []
+    for i in range(args.llm_cases):
+        rng = random.Random(f"{args.seed}-llm-{i}")
+        lines, entities = generate_page_lines(rng, args.density[0], lines_per_page=12)
+        cases.append(("\n".join(lines), {e["text"].lower() for e in entities}))
+
+    original_get_llm = prompt_redaction.get_llm
+    results = {}
+    try:
+        for name in args.compare_llm_backends:
+            try:
+                backend = llm_backends.create_backend(name)
+            except ValueError as e:
+                results[name] = {"skipped": str(e)}
+                print(f"[bench] llm backend {name} skipped: {e}", file=sys.stderr)
+                continue
+            prompt_redaction.get_llm = lambda: backend.runnable(prompt_redaction.RedactionPlan)
+
+            for text, _ in cases[:args.warmup]:
+                try:
+                    prompt_redaction.analyze_intent(LLM_BENCH_INTENT, text)
+                except Exception:
+                    pass
+
+            latencies, valid, true_pos, planned, expected, grounded = [], 0, 0, 0, 0, 0
+            for text, gold in cases:
+                start = time.perf_counter()
+                try:
+                    plan = prompt_redaction.analyze_intent(LLM_BENCH_INTENT, text)
+                except Exception:
+                    plan = None
+                latencies.append((time.perf_counter() - start) * 1000)
+                expected += len(gold)
+                if plan is None:
+                    continue
+                valid += 1
+                texts = {e.text.strip().lower() for e in plan.entities}
+                planned += len(texts)
+                true_pos += len(texts & gold)
+                grounded += sum(1 for t in texts if t and t in text.lower())
+
+            precision = true_pos / planned if planned else 0.0
+            recall = true_pos / expected if expected else 0.0
+            results[name] = {
+                "backend": name,
+                "cases": len(cases),
+                "latency_ms": summarize(latencies),
+                "valid_plan_rate": round(valid / len(cases), 3),
+                "precision": round(precision, 3),
+                "recall": round(recall, 3),
+                "f1": round(2 * precision * recall / (precision + recall), 3) if precision + recall else 0.0,
+                "grounded_rate": round(grounded / planned, 3) if planned else 0.0,
+            }
+            print(f"[bench] llm backend {name} done", file=sys.stderr)
+    finally:
+        prompt_redaction.get_llm = original_get_llm
+    return results
+
+
+def run_concurrency_level(args, level: int) -> Dict:
+    """
+    Throughput of the image pipeline with `level` requests in flight
+
+    Runs in a fresh process (see run_concurrency_sweep) because the thread
+    budget is applied when the libraries load.
+    """
+    rng = random.Random(f"{args.seed}-concurrency")
+    image, entities = generate_scanned_image(rng, args.resolution[0], args.density[0])
+    requests_total = max(args.concurrency_requests, level * 2)
+
+    with tempfile.TemporaryDirectory(prefix="secureflow-bench-") as workdir:
+        def one_request(_):
+            request_dir = tempfile.mkdtemp(dir=workdir)
+            start = time.perf_counter()
+            run_image_scenario(image, entities, StageTimer(), request_dir, args.skip_gliner)
+            return (time.perf_counter() - start) * 1000
+
+        for _ in range(args.warmup):
+            one_request(None)
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            start = time.perf_counter()
+            latencies = list(pool.map(one_request, range(requests_total)))
+            wall = time.perf_counter() - start
+
+    return {
+        "concurrency": level,
+        "requests": requests_total,
+        "throughput_rps": round(requests_total / wall, 3),
+        "latency_ms": summarize(latencies),
+        "cpu_budget": main.cpu_budget.describe(),
+    }
+
+
+def run_concurrency_sweep(args) -> Dict:
+    """Throughput at each concurrency level with the CPU thread budget off and on"""
+    results = {}
+    for level in args.concurrency:
+        for budget in ("off", "on"):
+            env = dict(os.environ, CPU_BUDGET="1" if budget == "on" else "0",
+                       CPU_WORKERS="1", CPU_REQUEST_CONCURRENCY=str(level))
+            command = [
+                sys.executable, os.path.abspath(__file__), "--concurrency-worker", str(level),
+                "--resolution", str(args.resolution[0]), "--density", str(args.density[0]),
+                "--seed", str(args.seed), "--warmup", str(args.warmup),
+                "--concurrency-requests", str(args.concurrency_requests),
+            ] + (["--skip-gliner"] if args.skip_gliner else []) + (["--entity-cache"] if args.entity_cache else [])
+            completed = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+            results[f"c{level}_budget_{budget}"] = {"budget": budget, **json.loads(completed.stdout)}
+            print(f"[bench] concurrency {level} budget {budget} done", file=sys.stderr)
+        off, on = results[f"c{level}_budget_off"], results[f"c{level}_budget_on"]
+        on["speedup_vs_off"] = round(on["throughput_rps"] / off["throughput_rps"], 3)
+    return results
+
+
+def _drop_warmup(timer: StageTimer, warmup: int):
+    for name in timer.samples:
+        timer.samples[name] = timer.samples[name][warmup:]
+
+
+# ==================== BASELINE COMPARISON ====================
+
+def compare_to_baseline(report: Dict, baseline: Dict, tolerance: float, metric: str = "p50") -> List[Dict]:
+    """
+    Compare a report against a stored baseline
+
+    Args:
+        report: Current benchmark report
+        baseline: Previously stored report
+        tolerance: Allowed relative slowdown (0.2 = 20%)
+        metric: Summary statistic to compare
+
+    Returns:
+        List of per-stage comparisons, each flagged as a regression or not
+    """
+    rows = []
+    for name, scenario in report.get("scenarios", {}).items():
+        base_scenario = baseline.get("scenarios", {}).get(name)
+        if not base_scenario:
+            continue
+        for stage, stats in scenario["stages"].items():
+            base_stats = base_scenario["stages"].get(stage)
+            if not base_stats or not base_stats.get(metric):
+                continue
+            ratio = stats[metric] / base_stats[metric]
+            rows.append({
+                "scenario": name,
+                "stage": stage,
+                "baseline_ms": base_stats[metric],
+                "current_ms": stats[metric],
+                "ratio": round(ratio, 3),
+                "regression": ratio > 1 + tolerance,
+            })
+    return rows
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the SecureFlow redaction pipeline")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10], help="PDF page counts")
+    parser.add_argument("--density", type=int, nargs="+", default=[5, 25], help="Entities per page")
+    parser.add_argument("--resolution", type=int, nargs="+", default=[1240, 2480], help="Scanned image widths in px")
+    parser.add_argument("--repeat", type=int, default=5, help="Measured iterations per scenario")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured iterations per scenario")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--skip-gliner", action="store_true", help="Skip the GLiNER stage (no model weights needed)")
+    parser.add_argument("--entity-cache", action="store_true",
+                        help="Keep the entity cache on (the gliner stage then measures cache hits after warmup)")
+    parser.add_argument("--compare-ocr-backends", action="store_true",
+                        help="Also compare per-image latency of the pytesseract and tesserocr backends")
+    parser.add_argument("--concurrency", type=int, nargs="+",
+                        help="Instead of the suite, measure image pipeline throughput at these numbers of "
+                             "concurrent requests, with and without the CPU thread budget")
+    parser.add_argument("--concurrency-requests", type=int, default=16,
+                        help="Requests per concurrency level (at least twice the level)")
+    parser.add_argument("--compare-llm-backends", nargs="+", choices=sorted(llm_backends.BACKENDS),
+                        help="Instead of the suite, compare intent-analysis latency and plan quality of these "
+                             "LLM backends (uses the network for remote backends)")
+    parser.add_argument("--llm-cases", type=int, default=10, help="Synthetic documents per LLM backend")
+    parser.add_argument("--concurrency-worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="Write the JSON report to this path instead of stdout")
+    parser.add_argument("--baseline", help="Compare against a stored JSON report")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown vs baseline")
+    return parser.parse_args(argv)
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    # Every iteration sends the same text; with the cache on, the "gliner"
+    # stage would time LRU hits after the first one
+    entity_cache.set_enabled(args.entity_cache)
+    if args.concurrency_worker:
+        print(json.dumps(run_concurrency_level(args, args.concurrency_worker)))
+        return 0
+    if args.concurrency:
+        report = {"meta": run_metadata(args), "concurrency": run_concurrency_sweep(args)}
+    elif args.compare_llm_backends:
+        report = {"meta": run_metadata(args), "llm_backends": run_llm_backend_comparison(args)}
+    else:
+        report = run_suite(args)
+    if args.compare_ocr_backends:
+        report["ocr_backends"] = run_ocr_backend_comparison(args)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        comparison = compare_to_baseline(report, baseline, args.tolerance)
+        report["comparison"] = {"baseline": args.baseline, "tolerance": args.tolerance, "stages": comparison}
+        regressions = [row for row in comparison if row["regression"]]
+        for row in regressions:
+            print(f"[bench] REGRESSION {row['scenario']}/{row['stage']}: "
+                  f"{row['baseline_ms']}ms -> {row['current_ms']}ms (x{row['ratio']})", file=sys.stderr)
+        exit_code = 1 if regressions else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,143 @@
+"""
+CPU thread budget for PyTorch, Tesseract and OpenCV
+Each library defaults to one thread per core, so a few overlapping requests
+in several workers multiply into far more runnable threads than cores. This
+module divides the node's cores between server workers and, within a worker,
+between its concurrent requests, then applies the per-library limits:
+
+    PyTorch    torch.set_num_threads / set_num_interop_threads
+    Tesseract  OMP_THREAD_LIMIT (in-process tesserocr and pytesseract children)
+    OpenCV     cv2.setNumThreads
+    BLAS/OMP   OMP_NUM_THREADS, MKL_NUM_THREADS, OPENBLAS_NUM_THREADS
+    OCR pool   OCR_TILE_WORKERS (process pool for tiled/scanned-page OCR)
+
+apply() must run before the OpenMP-based libraries are imported, since
+their runtimes read the environment once at load time. Explicitly set
+environment variables are never overridden; the ones this module set itself
+are recomputed when a forked worker applies its pinned budget.
+"""
+
+import os
+import sys
+from typing import Dict, List, Optional
+
+# "0" leaves every library at its default
+CPU_BUDGET = os.getenv("CPU_BUDGET", "1")
+# Cores available to this node's server; defaults to the process's affinity mask
+CPU_CORES = int(os.getenv("CPU_CORES", "0"))
+# Worker processes sharing those cores (gunicorn WEB_WORKERS)
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", os.getenv("WEB_WORKERS", "1")))
+# Requests a worker serves concurrently (gunicorn WEB_THREADS)
+CPU_REQUEST_CONCURRENCY = int(os.getenv("CPU_REQUEST_CONCURRENCY", os.getenv("WEB_THREADS", "1")))
+# Pin each worker to its own slice of cores
+CPU_AFFINITY = os.getenv("CPU_AFFINITY", "0") == "1"
+
+THREAD_VARIABLES = ("OMP_NUM_THREADS", "OMP_THREAD_LIMIT", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+# Variables the user set before this module was first imported
+_USER_SET = frozenset(name for name in (*THREAD_VARIABLES, "OCR_TILE_WORKERS") if name in os.environ)
+
+_applied: Optional[Dict[str, int]] = None
+
+
+def available_cores() -> List[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # macOS / Windows
+        return list(range(os.cpu_count() or 1))
+
+
+def compute_budget(cores: int, workers: int = 1, concurrency: int = 1) -> Dict[str, int]:
+    """
+    Thread limits for one worker
+
+    Args:
+        cores: Cores shared by all workers
+        workers: Worker processes on those cores
+        concurrency: Requests served concurrently by one worker
+
+    Returns:
+        Dict of worker_cores, request_threads (per-library thread limit for a
+        single request) and ocr_processes (OCR pool size)
+    """
+    worker_cores = max(1, cores // max(1, workers))
+    return {
+        "worker_cores": worker_cores,
+        "request_threads": max(1, worker_cores // max(1, concurrency)),
+        "ocr_processes": worker_cores,
+    }
+
+
+def worker_cpu_set(slot: int, workers: int = CPU_WORKERS, cores: Optional[List[int]] = None) -> List[int]:
+    """Cores of the slot-th worker when the node's cores are split evenly"""
+    cores = cores or available_cores()
+    per_worker = max(1, len(cores) // max(1, workers))
+    start = (slot % max(1, workers)) * per_worker % len(cores)
+    return cores[start:start + per_worker] or cores
+
+
+def pin_worker(slot: int):
+    """Restrict the calling process to its slice of cores (CPU_AFFINITY=1)"""
+    if not CPU_AFFINITY or not hasattr(os, "sched_setaffinity"):
+        return None
+    cpu_set = worker_cpu_set(slot)
+    os.sched_setaffinity(0, cpu_set)
+    return cpu_set
+
+
+def apply(workers: Optional[int] = None, concurrency: Optional[int] = None,
+          pinned: bool = False) -> Optional[Dict[str, int]]:
+    """
+    Apply the thread budget to this process
+
+    Args:
+        workers: Override CPU_WORKERS
+        concurrency: Override CPU_REQUEST_CONCURRENCY
+        pinned: The process is already pinned to its own cores, so all of
+            them belong to this worker
+
+    Returns:
+        The applied budget, or None when CPU_BUDGET=0
+    """
+    global _applied
+    if CPU_BUDGET == "0":
+        return None
+    cores = len(available_cores()) if pinned else (CPU_CORES or len(available_cores()))
+    budget = compute_budget(cores, 1 if pinned else (workers or CPU_WORKERS),
+                            concurrency or CPU_REQUEST_CONCURRENCY)
+    threads = str(budget["request_threads"])
+    # Overwrite values from an earlier apply (e.g. the master's, inherited by a
+    # pinned worker) but never the user's own
+    for name in THREAD_VARIABLES:
+        if name not in _USER_SET:
+            os.environ[name] = threads
+    if "OCR_TILE_WORKERS" not in _USER_SET:
+        os.environ["OCR_TILE_WORKERS"] = str(budget["ocr_processes"])
+        ocr = sys.modules.get("ocr")
+        if ocr is not None:
+            # Preloaded in the master; the pool itself is created lazily
+            ocr.OCR_TILE_WORKERS = budget["ocr_processes"]
+
+    try:
+        import cv2
+        cv2.setNumThreads(budget["request_threads"])
+    except ImportError:
+        pass
+    try:
+        import torch
+        torch.set_num_threads(budget["request_threads"])
+        try:
+            # Only allowed before the first parallel torch operation
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+    except ImportError:
+        pass
+
+    _applied = budget
+    return budget
+
+
+def describe() -> str:
+    if _applied is None:
+        return "cpu budget disabled"
+    return ", ".join(f"{key}={value}" for key, value in _applied.items())
@@ -0,0 +1,180 @@
+"""
+Document-type routing to entity label profiles
+A keyword classifier looks at the start of a document (roughly its first
+page) and picks a named label profile, so GLiNER only receives the labels
+that can occur in that kind of document instead of the full catalogue.
+Keywords are weighted, so generic words such as "total" or "section" only
+count alongside distinctive ones. Documents that match no profile strongly
+enough fall back to "general", which uses every label.
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+GENERAL_PROFILE = "general"
+# Characters examined by the classifier, about one page of text
+ROUTER_SAMPLE_CHARS = int(os.getenv("ROUTER_SAMPLE_CHARS", "3000"))
+# Weighted score of distinct keyword hits needed before a profile is chosen
+# over "general"; generic words weigh 1, so a few of them are not enough
+ROUTER_MIN_SCORE = int(os.getenv("ROUTER_MIN_SCORE", "5"))
+
+# Labels sent to GLiNER for every profile
+COMMON_LABELS = [
+    "PERSON_NAME", "NAME", "FULL_NAME", "EMAIL_ADDRESS", "PHONE_NUMBER", "MOBILE_NUMBER",
+    "POSTAL_ADDRESS", "PERMANENT_ADDRESS", "CITY", "STATE", "COUNTRY", "ZIP_CODE",
+    "DATE", "ORGANIZATION_NAME", "ID_NUMBER",
+]
+
+# keywords maps each phrase to its weight: 3 for phrases that name the document
+# type, 2 for distinctive terms, 1 for generic words that also occur elsewhere
+PROFILES: Dict[str, Dict] = {
+    "resume": {
+        "keywords": {
+            "resume": 3, "curriculum vitae": 3, "career objective": 3, "work experience": 2,
+            "experience": 1, "education": 1, "skills": 1, "internship": 2, "certifications": 1,
+            "projects": 1, "references": 1, "achievements": 1, "hobbies": 2, "about me": 2,
+            "linkedin": 2, "portfolio": 1,
+        },
+        "labels": [
+            "DATE_OF_BIRTH", "AGE", "GENDER", "NATIONALITY", "MARITAL_STATUS", "OCCUPATION",
+            "JOB_TITLE", "EMPLOYER_NAME", "WORK_ADDRESS", "WORK_EXPERIENCE", "SKILLS",
+            "QUALIFICATION", "INSTITUTION_NAME", "GRADUATION_YEAR", "ACADEMIC_SCORE",
+            "CERTIFICATION", "SPECIALIZATION", "URL", "USERNAME", "SOCIAL_MEDIA_HANDLE",
+            "PROJECT_NAME", "CAREER_OBJECTIVE", "SUMMARY", "AWARD_NAME", "AWARD_YEAR",
+            "INTERNSHIP_COMPANY", "INTERNSHIP_DURATION", "INTERNSHIP_ROLE", "REFERENCE_NAME",
+            "REFERENCE_CONTACT", "PORTFOLIO_LINK", "PROFESSIONAL_MEMBERSHIP", "LANGUAGE",
+            "HOBBIES", "INTERESTS", "PUBLICATION_TITLE", "DEGREE_MAJOR", "WORK_DURATION",
+            "EDUCATION_DURATION", "PERSONAL_SUMMARY", "SECTION_HEADER",
+        ],
+    },
+    "fir": {
+        "keywords": {
+            "first information report": 3, "fir": 2, "police station": 2, "ipc": 2, "section": 1,
+            "complainant": 2, "informant": 2, "accused": 2, "victim": 1, "witness": 1, "offence": 1,
+            "offense": 1, "inspector": 1, "sub-inspector": 2, "crime": 1, "incident": 1,
+            "station house officer": 3,
+        },
+        "labels": [
+            "AGE", "GENDER", "FIR_NUMBER", "OFFENSE_TYPE", "LEGAL_SECTION", "IPC SECTION",
+            "PHYSICAL_DESCRIPTION", "ITEM_NAME", "VICTIM_NAME", "ACCUSED_NAME", "WITNESS_NAME",
+            "WITNESS", "POLICE_STATION", "INCIDENT_DESCRIPTION", "SIGNATURE", "OFFICER_NAME",
+            "DESIGNATION", "CRIME_SCENE", "LOCATION", "PLACE", "VEHICLE_NUMBER",
+            "VEHICLE_DESCRIPTION", "TIME", "CASE_NUMBER", "COURT_NAME", "LAWYER_NAME",
+            "HEIGHT", "AADHAR_NUMBER",
+        ],
+    },
+    "receipt": {
+        "keywords": {
+            "receipt": 2, "invoice": 2, "bill": 1, "subtotal": 2, "total": 1, "tax": 1, "gst": 2,
+            "cashier": 2, "qty": 2, "quantity": 1, "price": 1, "amount paid": 2, "change": 1,
+            "thank you for shopping": 3, "order": 1, "payment method": 2,
+        },
+        "labels": [
+            "TRANSACTION_ID", "TRANSACTION_DATE", "AMOUNT", "PAYMENT_METHOD", "CURRENCY",
+            "MERCHANT_NAME", "CREDIT_CARD_NUMBER", "PRODUCT_NAME", "BRAND_NAME",
+            "CUSTOMER_ID", "TIME", "TAX_ID", "SERIAL_NUMBER", "WARRANTY_PERIOD",
+        ],
+    },
+    "bank_statement": {
+        "keywords": {
+            "bank statement": 3, "statement of account": 3, "account statement": 3,
+            "account number": 2, "ifsc": 2, "opening balance": 3, "closing balance": 3,
+            "withdrawal": 1, "deposit": 1, "credit": 1, "debit": 1, "balance": 1, "branch": 1,
+            "neft": 2, "imps": 2, "upi": 1, "cheque": 1,
+        },
+        "labels": [
+            "BANK_NAME", "ACCOUNT_NUMBER", "IFSC_CODE", "CREDIT_CARD_NUMBER", "PAN_NUMBER",
+            "TAX_ID", "SALARY", "INCOME", "TRANSACTION_ID", "TRANSACTION_DATE", "AMOUNT",
+            "PAYMENT_METHOD", "CURRENCY", "MERCHANT_NAME", "BRANCH_NAME", "CUSTOMER_ID",
+            "LOAN_ACCOUNT_NUMBER", "LOAN_AMOUNT", "EMI_AMOUNT",
+        ],
+    },
+}
+
+_KEYWORD_PATTERNS = {
+    name: re.compile(r"\b(?:" + "|".join(re.escape(k) for k in profile["keywords"]) + r")\b", re.IGNORECASE)
+    for name, profile in PROFILES.items()
+}
+
+ROUTING_DECISIONS = metrics.register(metrics.Counter(
+    f"{metrics.NAMESPACE}_routing_decisions_total",
+    "Label profile chosen per document, by source (classifier or override)"))
+ROUTING_OVERRIDES = metrics.register(metrics.Counter(
+    f"{metrics.NAMESPACE}_routing_overrides_total",
+    "Client overrides compared with the classifier's prediction, for routing accuracy"))
+
+
+def check_profiles(all_labels: List[str]) -> None:
+    """
+    Fail fast on profile labels missing from the catalogue
+
+    profile_labels filters the catalogue, so a misspelt profile label would
+    otherwise be dropped silently and never sent to GLiNER.
+
+    Raises:
+        ValueError: If a common or profile label is not in all_labels
+    """
+    catalogue = set(all_labels)
+    for name, profile in [("common", {"labels": COMMON_LABELS}), *PROFILES.items()]:
+        missing = [label for label in profile["labels"] if label not in catalogue]
+        if missing:
+            raise ValueError(f"Label profile '{name}' uses labels missing from the catalogue: {', '.join(missing)}")
+
+
+def profile_names() -> List[str]:
+    return [GENERAL_PROFILE, *PROFILES]
+
+
+def classify(text: str) -> Tuple[str, int]:
+    """
+    Pick the label profile for a document
+
+    Returns:
+        Tuple of (profile name, summed weight of the distinct keywords matched)
+    """
+    sample = (text or "")[:ROUTER_SAMPLE_CHARS]
+    best, best_score = GENERAL_PROFILE, 0
+    for name, pattern in _KEYWORD_PATTERNS.items():
+        keywords = PROFILES[name]["keywords"]
+        score = sum(keywords[m] for m in {m.lower() for m in pattern.findall(sample)})
+        if score > best_score:
+            best, best_score = name, score
+    if best_score < ROUTER_MIN_SCORE:
+        return GENERAL_PROFILE, best_score
+    return best, best_score
+
+
+def profile_labels(profile: str, all_labels: List[str]) -> List[str]:
+    """Labels for a profile, keeping the catalogue's order; all labels for "general" """
+    if profile not in PROFILES:
+        return list(all_labels)
+    wanted = set(COMMON_LABELS) | set(PROFILES[profile]["labels"])
+    return list(dict.fromkeys(label for label in all_labels if label in wanted))
+
+
+def route(text: str, all_labels: List[str], override: Optional[str] = None) -> Tuple[str, List[str]]:
+    """
+    Choose the profile and label set for a document
+
+    Args:
+        text: Extracted document text
+        all_labels: Full label catalogue
+        override: Profile requested by the client, if any
+
+    Returns:
+        Tuple of (profile name, labels to send to GLiNER)
+    """
+    with metrics.stage("document_routing"):
+        predicted, score = classify(text)
+    if override:
+        ROUTING_OVERRIDES.inc(predicted=predicted, chosen=override, agreed=str(predicted == override).lower())
+        profile, source = override, "override"
+    else:
+        profile, source = predicted, "classifier"
+    ROUTING_DECISIONS.inc(profile=profile, source=source)
+    labels = profile_labels(profile, all_labels)
+    metrics.record(document_profile=profile, routing_score=score, routed_labels=len(labels))
+    return profile, labels
@@ -0,0 +1,95 @@
+"""
+Content-addressed storage for uploaded documents
+Blobs are stored once under their SHA-256 digest, so a client can upload a
+document a single time and refer to it by id in later requests.
+
+Blobs hold unredacted originals, so they are not kept forever: a blob's
+mtime is refreshed whenever it is stored or read, and history.collect_garbage
+removes blobs that are unused for DOCUMENT_RETENTION_DAYS or exceed
+DOCUMENT_STORE_MAX_MB.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+from typing import Iterator, Optional, Tuple
+
+DOCUMENT_STORE = os.getenv("DOCUMENT_STORE", "./document_store")
+BLOB_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# Blobs and histories unused for longer than this are deleted (0 keeps them)
+DOCUMENT_RETENTION_DAYS = float(os.getenv("DOCUMENT_RETENTION_DAYS", "7"))
+# Size bound of all blobs; least recently used documents go first (0: unbounded)
+DOCUMENT_STORE_MAX_MB = int(os.getenv("DOCUMENT_STORE_MAX_MB", "2048"))
+
+
+def blob_id(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def blob_path(digest: str) -> str:
+    # Two-level fan-out keeps directories small
+    return os.path.join(DOCUMENT_STORE, "blobs", digest[:2], digest)
+
+
+def put_blob(data: bytes) -> str:
+    """Store data if it is not stored yet and return its id"""
+    digest = blob_id(data)
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename so concurrent readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    else:
+        _touch(path)
+    return digest
+
+
+def get_blob(digest: str) -> Optional[bytes]:
+    """Return the stored bytes, or None for unknown or malformed ids"""
+    if not BLOB_ID_PATTERN.match(digest or ""):
+        return None
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        data = f.read()
+    _touch(path)
+    return data
+
+
+def _touch(path: str):
+    """Mark a blob as used now, so retention counts from its last use"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def iter_blobs() -> Iterator[Tuple[str, int, float]]:
+    """(id, size in bytes, last use) of every stored blob"""
+    root = os.path.join(DOCUMENT_STORE, "blobs")
+    if not os.path.isdir(root):
+        return
+    for fan_out in os.listdir(root):
+        directory = os.path.join(root, fan_out)
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if not BLOB_ID_PATTERN.match(name):
+                continue
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+            yield name, stat.st_size, stat.st_mtime
+
+
+def delete_blob(digest: str):
+    try:
+        os.remove(blob_path(digest))
+    except FileNotFoundError:
+        pass
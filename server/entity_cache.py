@@ -0,0 +1,227 @@
+"""
+Cache of extracted entity lists
+Entity extraction is keyed on the SHA-256 of the text, the label set, the
+threshold and the model version. Results are also kept per label for each
+text, so when a client changes only some labels the model runs just for the
+labels that were never extracted and the results are merged. Entries live
+in a bounded in-memory LRU with an optional disk tier shared between
+workers.
+
+Entity lists are the personal data being redacted, so disk entries are
+encrypted (Fernet, from the optional cryptography package) with a key
+derived from the source text, which is never stored: a file can only be
+read by a request that already holds the same text. Without cryptography
+the disk tier stays off. The tier is bounded to ENTITY_CACHE_DISK_MB; the
+least recently used files go first.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import metrics
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+    InvalidToken = ValueError
+
+# 0 disables the cache (memory and disk): every call runs the model
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "256"))
+# Empty disables the disk tier; needs the cryptography package (entries are encrypted)
+ENTITY_CACHE_DIR = os.getenv("ENTITY_CACHE_DIR", "")
+# Size bound of the disk tier, least recently used files deleted first
+ENTITY_CACHE_DISK_MB = int(os.getenv("ENTITY_CACHE_DISK_MB", "256"))
+
+
+class EntityCache:
+    """Bounded LRU of JSON-serialisable values with an optional encrypted disk tier"""
+
+    def __init__(self, max_entries: int = ENTITY_CACHE_SIZE, directory: Optional[str] = ENTITY_CACHE_DIR,
+                 max_disk_bytes: int = ENTITY_CACHE_DISK_MB * 1024 * 1024):
+        if directory and Fernet is None:
+            print("ENTITY_CACHE_DIR is set but the cryptography package is missing; disk tier disabled")
+            directory = None
+        self.max_entries = max_entries
+        self.directory = directory or None
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bytes written since the tier was last measured; None until first measured
+        self._disk_bytes: Optional[int] = None
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.bin")
+
+    @staticmethod
+    def _cipher(secret: bytes):
+        return Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret).digest()))
+
+    def get(self, key: str, secret: bytes = b""):
+        """
+        Cached value for key
+
+        Args:
+            key: Cache key
+            secret: Material the disk entry is encrypted with (see put)
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        if self.directory is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                value = json.loads(self._cipher(secret).decrypt(f.read()))
+            os.utime(path)
+        except (FileNotFoundError, ValueError, InvalidToken):
+            return None
+        self._remember(key, value)
+        return value
+
+    def put(self, key: str, value, secret: bytes = b""):
+        """
+        Store value; on disk it is encrypted with a key derived from secret
+
+        Callers pass secret material that is not derivable from key, so the
+        files are unreadable without it.
+        """
+        self._remember(key, value)
+        if self.directory is None:
+            return
+        data = self._cipher(secret).encrypt(json.dumps(value).encode("utf-8"))
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(data)
+            over = self._disk_bytes is None or self._disk_bytes > self.max_disk_bytes
+        if over:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Measure the disk tier and delete the least recently used files above the bound"""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(".bin"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        if self.max_disk_bytes and total > self.max_disk_bytes:
+            # Down to 90% so a full tier is not rescanned on every write
+            target = self.max_disk_bytes * 0.9
+            for _, size, path in sorted(files):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    def _remember(self, key: str, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = EntityCache()
+_enabled = ENTITY_CACHE_SIZE > 0
+
+
+def set_enabled(enabled: bool):
+    """Turn the cache on or off for this process (the benchmark times the model)"""
+    global _enabled
+    _enabled = enabled
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def _digest(*parts) -> str:
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def cached_predict(text: str, labels: List[str], threshold: float, model_version: str,
+                   infer: Callable[[List[str]], List[Dict]]) -> List[Dict]:
+    """
+    Return entities for text, running infer only for labels not cached yet
+
+    Args:
+        text: Text passed to the model
+        labels: Labels requested by the caller
+        threshold: Model confidence threshold
+        model_version: Identifies the model and backend that produced results
+        infer: Callable running the model for a list of labels
+
+    Returns:
+        Entities for the requested labels, ordered by start offset
+    """
+    if not _enabled:
+        metrics.record(entity_cache="off", inferred_labels=len(set(labels)))
+        return sorted(infer(list(dict.fromkeys(labels))), key=lambda e: e.get("start", 0))
+
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    # Disk entries are encrypted with this; keys only contain digests of text_hash
+    secret = hashlib.sha256(b"entity-cache\x1f" + text.encode("utf-8")).digest()
+    exact_key = _digest("exact", text_hash, _digest(*sorted(labels)), threshold, model_version)
+    exact = _cache.get(exact_key, secret)
+    metrics.cache_lookup("entities", exact is not None)
+    if exact is not None:
+        metrics.record(entity_cache="exact")
+        return list(exact)
+
+    # Per-label results from earlier calls on the same text
+    labels_key = _digest("labels", text_hash, threshold, model_version)
+    by_label: Dict[str, List[Dict]] = dict(_cache.get(labels_key, secret) or {})
+    missing = [label for label in dict.fromkeys(labels) if label not in by_label]
+    metrics.cache_lookup("entity_labels", not missing)
+    if missing:
+        for label in missing:
+            by_label[label] = []
+        for entity in infer(missing):
+            by_label.setdefault(entity["label"], []).append(entity)
+        _cache.put(labels_key, by_label, secret)
+    if not missing:
+        outcome = "labels"
+    else:
+        outcome = "partial" if len(missing) < len(set(labels)) else "miss"
+    metrics.record(entity_cache=outcome, inferred_labels=len(missing))
+
+    entities = sorted(
+        (entity for label in dict.fromkeys(labels) for entity in by_label.get(label, [])),
+        key=lambda e: e.get("start", 0),
+    )
+    _cache.put(exact_key, entities, secret)
+    return entities
+
+
+def clear():
+    _cache.clear()
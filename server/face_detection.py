@@ -0,0 +1,158 @@
+"""
+Face detection for the RedactObjects redaction type
+Detectors are loaded once per worker thread and reused across requests
+(OpenCV detectors are not safe to call concurrently from several threads).
+Haar detection runs once, on a copy downscaled so the smallest face looked
+for just fills the cascade's 24 px window. That smallest face is relative to
+the image: FACE_MIN_FRACTION of its shorter side, but never below
+FACE_MIN_SIZE pixels. The detection frame then has a fixed size (about
+HAAR_WINDOW / FACE_MIN_FRACTION on its shorter side) whatever the input
+resolution, so the cost no longer grows with the megapixel count.
+
+Recall trade-off: faces smaller than FACE_MIN_FRACTION of the image (60 px
+on a 4000x3000 photo at the default 0.02) are not found. Set
+FACE_MIN_FRACTION=0 to search down to FACE_MIN_SIZE pixels at any size,
+which on large images costs as much as a full-resolution scan, or use the
+DNN backend.
+
+Backends (FACE_DETECTOR):
+- ``haar``: OpenCV frontal-face Haar cascade (default, no extra files)
+- ``dnn``: OpenCV DNN ResNet-10 SSD face detector on CPU; needs
+  FACE_DNN_PROTOTXT and FACE_DNN_MODEL pointing at deploy.prototxt and
+  res10_300x300_ssd_iter_140000.caffemodel
+"""
+
+import os
+import threading
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+FACE_DETECTOR = os.getenv("FACE_DETECTOR", "haar").lower()
+# Smallest face as a fraction of the shorter image side; 0 disables the relative bound
+FACE_MIN_FRACTION = float(os.getenv("FACE_MIN_FRACTION", "0.02"))
+# Smallest face, in original pixels, that Haar detection looks for
+FACE_MIN_SIZE = int(os.getenv("FACE_MIN_SIZE", "30"))
+FACE_DNN_PROTOTXT = os.getenv("FACE_DNN_PROTOTXT", "")
+FACE_DNN_MODEL = os.getenv("FACE_DNN_MODEL", "")
+FACE_DNN_INPUT_SIZE = int(os.getenv("FACE_DNN_INPUT_SIZE", "300"))
+FACE_DNN_CONFIDENCE = float(os.getenv("FACE_DNN_CONFIDENCE", "0.5"))
+
+Box = Tuple[int, int, int, int]
+
+# Side of the frontal-face cascade's detection window
+HAAR_WINDOW = 24
+
+_local = threading.local()
+_dnn_fallback_logged = False
+
+
+def _haar_cascade():
+    cascade = getattr(_local, "haar", None)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        _local.haar = cascade
+    return cascade
+
+
+def _dnn_net():
+    net = getattr(_local, "dnn", None)
+    if net is None:
+        net = cv2.dnn.readNetFromCaffe(FACE_DNN_PROTOTXT, FACE_DNN_MODEL)
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        _local.dnn = net
+    return net
+
+
+def dnn_available() -> bool:
+    return bool(FACE_DNN_PROTOTXT and FACE_DNN_MODEL
+                and os.path.exists(FACE_DNN_PROTOTXT) and os.path.exists(FACE_DNN_MODEL))
+
+
+def _downscale(image: np.ndarray, scale: float) -> np.ndarray:
+    if scale >= 1.0:
+        return image
+    height, width = image.shape[:2]
+    return cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def _haar_detect(gray: np.ndarray, min_side: int) -> List[Box]:
+    faces = _haar_cascade().detectMultiScale(
+        gray,
+        scaleFactor=1.1,
+        minNeighbors=5,
+        minSize=(min_side, min_side)
+    )
+    return [tuple(int(v) for v in face) for face in faces]
+
+
+def _to_gray(image: np.ndarray) -> np.ndarray:
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def min_face_size(height: int, width: int) -> int:
+    """Smallest face side, in original pixels, searched for in an image of this size"""
+    return max(HAAR_WINDOW, FACE_MIN_SIZE, int(FACE_MIN_FRACTION * min(height, width)))
+
+
+def detect_faces_haar(image: np.ndarray) -> List[Box]:
+    """
+    Haar cascade detection down to min_face_size original pixels
+
+    The image is downscaled so a face of min_face_size becomes HAAR_WINDOW
+    pixels, the smallest size the cascade can see, and scanned in one pass.
+    """
+    height, width = image.shape[:2]
+    scale = min(1.0, HAAR_WINDOW / min_face_size(height, width))
+    small = _downscale(_to_gray(image), scale)
+    return [
+        (int(x / scale), int(y / scale), int(w / scale), int(h / scale))
+        for (x, y, w, h) in _haar_detect(small, HAAR_WINDOW)
+    ]
+
+
+def detect_faces_dnn(image: np.ndarray) -> List[Box]:
+    """ResNet-10 SSD detection at FACE_DNN_INPUT_SIZE"""
+    height, width = image.shape[:2]
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    blob = cv2.dnn.blobFromImage(
+        image, 1.0, (FACE_DNN_INPUT_SIZE, FACE_DNN_INPUT_SIZE), (104.0, 177.0, 123.0)
+    )
+    net = _dnn_net()
+    net.setInput(blob)
+    detections = net.forward()
+
+    boxes = []
+    for detection in detections[0, 0]:
+        if float(detection[2]) < FACE_DNN_CONFIDENCE:
+            continue
+        x1, y1, x2, y2 = (detection[3:7] * np.array([width, height, width, height])).astype(int)
+        x1, y1 = max(0, x1), max(0, y1)
+        x2, y2 = min(width, x2), min(height, y2)
+        if x2 > x1 and y2 > y1:
+            boxes.append((int(x1), int(y1), int(x2 - x1), int(y2 - y1)))
+    return boxes
+
+
+def detect_faces(image: np.ndarray) -> List[Box]:
+    """
+    Detect faces with the configured backend
+
+    Args:
+        image: BGR or grayscale image at original resolution
+
+    Returns:
+        List of (x, y, w, h) boxes in original image coordinates
+    """
+    global _dnn_fallback_logged
+    if FACE_DETECTOR == "dnn":
+        if dnn_available():
+            return detect_faces_dnn(image)
+        if not _dnn_fallback_logged:
+            _dnn_fallback_logged = True
+            print("DNN face detector model files not found, falling back to Haar cascade")
+    return detect_faces_haar(image)
@@ -0,0 +1,85 @@
+"""
+Gunicorn settings for serving the redaction API
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app (and the GLiNER model, see wsgi.py) is loaded once in the master
+and shared copy-on-write by the forked workers. Each worker serves requests
+from a thread pool. Graceful operations:
+
+    kill -HUP <master>    replace workers one by one (code is not reloaded
+                          because the app is preloaded)
+    kill -USR2 <master>   start a new master with new code, then
+    kill -WINCH <old>     stop the old workers and
+    kill -TERM <old>      retire the old master once the new one is ready
+    kill -TERM <master>   stop accepting, finish in-flight requests, exit
+"""
+
+import itertools
+import os
+
+import memory_usage
+
+bind = os.getenv("SERVER_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_WORKERS", "2"))
+threads = int(os.getenv("WEB_THREADS", "4"))
+worker_class = "gthread"
+preload_app = True
+
+# Size the per-library thread budget for this worker layout. cpu_budget
+# reads these when the preloaded app first imports it, so it is only
+# imported inside the hooks below
+os.environ.setdefault("CPU_WORKERS", str(workers))
+os.environ.setdefault("CPU_REQUEST_CONCURRENCY", str(threads))
+
+# Redacting large documents can take minutes
+timeout = int(os.getenv("WEB_TIMEOUT", "300"))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "60"))
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth; 0 disables
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "1000"))
+max_requests_jitter = max(1, max_requests // 10) if max_requests else 0
+
+accesslog = os.getenv("WEB_ACCESS_LOG", "-")
+
+
+def when_ready(server):
+    import cpu_budget
+    print(f"[cpu] {cpu_budget.describe()}", flush=True)
+    memory_usage.report("master ready")
+
+
+def pre_fork(server, worker):
+    # Runs in the master. worker.age keeps growing as workers are recycled,
+    # so it cannot pick the core slice; take the lowest slot no live worker
+    # holds. The arbiter drops a worker from server.WORKERS when it exits
+    # (before child_exit), which frees its slot for the replacement
+    in_use = {getattr(w, "cpu_slot", None) for w in server.WORKERS.values()}
+    worker.cpu_slot = next(slot for slot in itertools.count() if slot not in in_use)
+
+
+def post_fork(server, worker):
+    import cpu_budget
+    # CPU_AFFINITY=1: pin the worker to the slice of cores of its slot
+    cpu_set = cpu_budget.pin_worker(worker.cpu_slot)
+    if cpu_set is not None:
+        # Recomputes the limits the master set for its slice of cores
+        cpu_budget.apply(pinned=True)
+        print(f"[cpu] worker {worker.age} (slot {worker.cpu_slot}) pinned to cores {cpu_set}; "
+              f"{cpu_budget.describe()}", flush=True)
+
+
+def post_worker_init(worker):
+    memory_usage.report(f"worker {worker.age} started")
+    # Report again shortly after start, once the first requests have touched memory
+    if os.getenv("WEB_MEMORY_REPORT_DELAY"):
+        import threading
+        delay = float(os.getenv("WEB_MEMORY_REPORT_DELAY"))
+        timer = threading.Timer(delay, memory_usage.report, args=(f"worker {worker.age} after {delay:g}s",))
+        timer.daemon = True
+        timer.start()
+
+
+def worker_exit(server, worker):
+    memory_usage.report(f"worker {worker.age} exiting", worker.pid)
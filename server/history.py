@@ -0,0 +1,373 @@
+"""
+Versioned redaction history
+Every redaction step is recorded as an immutable version with a parent
+pointer. Version contents live in the content-addressed document store, so
+identical outputs are stored once. Undo and redo only move the document's
+head pointer; nothing is scanned or copied.
+
+Histories are per owner (a session or user id from the caller): the
+document id is derived from the owner and the original's digest, so two
+users redacting the same file do not move each other's head. publish
+exposes a version under a per-document directory of HISTORY_PUBLISH_DIR,
+which is deleted together with the history.
+
+collect_garbage enforces the store's retention: histories untouched for
+DOCUMENT_RETENTION_DAYS are deleted with the blobs only they reference, and
+while the blobs exceed DOCUMENT_STORE_MAX_MB the least recently used
+documents are deleted. It runs at most every DOCUMENT_GC_INTERVAL seconds
+from maybe_collect_garbage, which every write path calls.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import document_store
+
+try:
+    import fcntl
+except ImportError:  # Windows: per-process locking only
+    fcntl = None
+
+HISTORY_DIR = os.path.join(document_store.DOCUMENT_STORE, "history")
+# Published versions go to <HISTORY_PUBLISH_DIR>/<document id>/<filename>
+HISTORY_PUBLISH_DIR = os.getenv("HISTORY_PUBLISH_DIR", "../public/documents")
+DOCUMENT_GC_INTERVAL = int(os.getenv("DOCUMENT_GC_INTERVAL", "600"))
+# Unreferenced blobs younger than this may belong to a commit in progress
+GC_GRACE_SECONDS = 300
+
+# document id -> [lock, holders]; entries are removed when the last holder leaves
+_locks: Dict[str, list] = {}
+_locks_guard = threading.Lock()
+_gc_lock = threading.Lock()
+_last_gc = 0.0
+
+
+def _manifest_path(document_id: str) -> str:
+    return os.path.join(HISTORY_DIR, f"{document_id}.json")
+
+
+@contextmanager
+def _locked(document_id: str):
+    """Serialise manifest updates across threads and, where supported, processes"""
+    with _locks_guard:
+        entry = _locks.setdefault(document_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            if fcntl is None:
+                yield
+            else:
+                with _file_lock(_manifest_path(document_id) + ".lock"):
+                    yield
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _locks[document_id]
+
+
+@contextmanager
+def _file_lock(path: str):
+    """
+    Exclusive flock on path
+
+    _drop_document deletes the lock file while holding it, so a process that
+    was waiting may end up locking the unlinked file; it then retries on the
+    file now at path, which is what every other process locks.
+    """
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    while True:
+        lock_file = open(path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                current = os.stat(path).st_ino == os.fstat(lock_file.fileno()).st_ino
+            except FileNotFoundError:
+                current = False
+            if current:
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                return
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            lock_file.close()
+
+
+def _load(document_id: str) -> Optional[Dict]:
+    if not document_store.BLOB_ID_PATTERN.match(document_id or ""):
+        return None
+    try:
+        with open(_manifest_path(document_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _load_owned(document_id: str, owner: Optional[str]) -> Optional[Dict]:
+    """The manifest, or None when owner is given and the history is someone else's"""
+    manifest = _load(document_id)
+    if manifest is None or (owner is not None and manifest.get("owner") != _owner_key(owner)):
+        return None
+    return manifest
+
+
+def _save(manifest: Dict):
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=HISTORY_DIR)
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, _manifest_path(manifest["document_id"]))
+
+
+def _version_info(manifest: Dict, version_id: str) -> Dict:
+    version = manifest["versions"][version_id]
+    return {"document_id": manifest["document_id"], "version_id": version_id, **version}
+
+
+def _owner_key(owner: str) -> str:
+    # Stored instead of the owner itself, which may be a client address
+    return document_store.blob_id(owner.encode("utf-8"))
+
+
+def document_id_for(original: str, owner: str = "") -> str:
+    """History id of an original (its blob id) for one owner"""
+    return document_store.blob_id(f"{owner}\0{original}".encode("utf-8"))
+
+
+def ensure_document(content: bytes, kind: str, owner: str = "") -> str:
+    """
+    Register an original document, creating version 0 on first sight
+
+    Args:
+        content: Original file bytes
+        kind: "pdf" or "image"
+        owner: Session or user the history belongs to
+
+    Returns:
+        The document id (see document_id_for)
+    """
+    original = document_store.put_blob(content)
+    document_id = document_id_for(original, owner)
+    with _locked(document_id):
+        if _load(document_id) is None:
+            _save({
+                "document_id": document_id,
+                "owner": _owner_key(owner),
+                "kind": kind,
+                "head": "0",
+                "next": 1,
+                "redo": [],
+                "versions": {
+                    "0": {"parent": None, "blob": original, "created": time.time(), "description": "original"},
+                },
+            })
+    maybe_collect_garbage()
+    return document_id
+
+
+def commit(document_id: str, content: bytes, description: str) -> Dict:
+    """Record content as a new version on top of the current head"""
+    blob = document_store.put_blob(content)
+    with _locked(document_id):
+        manifest = _load(document_id)
+        if manifest is None:
+            raise KeyError(f"Unknown document {document_id}")
+        version_id = str(manifest["next"])
+        manifest["versions"][version_id] = {
+            "parent": manifest["head"],
+            "blob": blob,
+            "created": time.time(),
+            "description": description,
+        }
+        manifest["next"] += 1
+        manifest["head"] = version_id
+        manifest["redo"] = []
+        _save(manifest)
+        version = _version_info(manifest, version_id)
+    maybe_collect_garbage()
+    return version
+
+
+def undo(document_id: str, owner: Optional[str] = None) -> Optional[Dict]:
+    """Move head to its parent; None when there is nothing to undo or owner does not match"""
+    with _locked(document_id):
+        manifest = _load_owned(document_id, owner)
+        if manifest is None:
+            return None
+        parent = manifest["versions"][manifest["head"]]["parent"]
+        if parent is None:
+            return None
+        manifest["redo"].append(manifest["head"])
+        manifest["head"] = parent
+        _save(manifest)
+        return _version_info(manifest, parent)
+
+
+def redo(document_id: str, owner: Optional[str] = None) -> Optional[Dict]:
+    """Move head back to the most recently undone version"""
+    with _locked(document_id):
+        manifest = _load_owned(document_id, owner)
+        if manifest is None or not manifest["redo"]:
+            return None
+        manifest["head"] = manifest["redo"].pop()
+        _save(manifest)
+        return _version_info(manifest, manifest["head"])
+
+
+def get_version(document_id: str, version_id: Optional[str] = None,
+                owner: Optional[str] = None) -> Optional[Dict]:
+    """Version metadata (the head when version_id is None); None for another owner's history"""
+    manifest = _load_owned(document_id, owner)
+    if manifest is None:
+        return None
+    version_id = version_id if version_id is not None else manifest["head"]
+    if version_id not in manifest["versions"]:
+        return None
+    return {**_version_info(manifest, version_id), "kind": manifest["kind"]}
+
+
+def _publish_dir(document_id: str) -> str:
+    return os.path.join(HISTORY_PUBLISH_DIR, document_id)
+
+
+def publish(document_id: str, blob: str, filename: str) -> str:
+    """
+    Expose a stored blob at <HISTORY_PUBLISH_DIR>/<document_id>/<filename>
+
+    Uses an atomically replaced symlink so publishing is O(1); falls back to
+    a copy where symlinks are not permitted. The directory belongs to the
+    document and is deleted with its history, so the link never outlives
+    the manifest that keeps its blob alive.
+
+    Returns:
+        The published path
+    """
+    directory = _publish_dir(document_id)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, filename)
+    source = os.path.abspath(document_store.blob_path(blob))
+    tmp_link = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.symlink(source, tmp_link)
+        os.replace(tmp_link, path)
+    except OSError:
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        if os.path.islink(path):
+            os.remove(path)
+        data = document_store.get_blob(blob)
+        with open(path, "wb") as f:
+            f.write(data)
+    return path
+
+
+# ==================== RETENTION ====================
+
+def _documents() -> List[Tuple[float, str]]:
+    """(last change, document id) of every history, least recently changed first"""
+    if not os.path.isdir(HISTORY_DIR):
+        return []
+    documents = []
+    for name in os.listdir(HISTORY_DIR):
+        document_id = name[:-len(".json")]
+        if not name.endswith(".json") or not document_store.BLOB_ID_PATTERN.match(document_id):
+            continue
+        try:
+            documents.append((os.path.getmtime(_manifest_path(document_id)), document_id))
+        except FileNotFoundError:
+            continue
+    return sorted(documents)
+
+
+def _blobs_of(document_id: str) -> List[str]:
+    manifest = _load(document_id)
+    if manifest is None:
+        return []
+    return list({version["blob"] for version in manifest["versions"].values()})
+
+
+def _drop_document(document_id: str):
+    with _locked(document_id):
+        # Published links first, so none points at a blob deleted below
+        shutil.rmtree(_publish_dir(document_id), ignore_errors=True)
+        # The lock file goes last; _file_lock notices and relocks
+        for path in (_manifest_path(document_id), _manifest_path(document_id) + ".lock"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def collect_garbage() -> Dict:
+    """
+    Delete expired histories and blobs, then shrink the store to its size bound
+
+    Returns:
+        Counts of deleted documents and blobs and the bytes left
+    """
+    now = time.time()
+    retention = document_store.DOCUMENT_RETENTION_DAYS * 86400
+    max_bytes = document_store.DOCUMENT_STORE_MAX_MB * 1024 * 1024
+    dropped = 0
+
+    live = []
+    for changed, document_id in _documents():
+        if retention and changed < now - retention:
+            _drop_document(document_id)
+            dropped += 1
+        else:
+            live.append((changed, document_id))
+    blobs_by_document = {document_id: _blobs_of(document_id) for _, document_id in live}
+    references = Counter(blob for blobs in blobs_by_document.values() for blob in blobs)
+
+    blobs = {digest: (size, used) for digest, size, used in document_store.iter_blobs()}
+    deleted = 0
+    total = sum(size for size, _ in blobs.values())
+    # Uploads without a history (e.g. manual redaction) expire on their own
+    for digest, (size, used) in sorted(blobs.items(), key=lambda item: item[1][1]):
+        expired = retention and used < now - retention
+        over = max_bytes and total > max_bytes and used < now - GC_GRACE_SECONDS
+        if digest not in references and (expired or over):
+            document_store.delete_blob(digest)
+            deleted += 1
+            total -= size
+
+    # Still too large: delete whole documents, least recently changed first
+    for changed, document_id in live:
+        if not max_bytes or total <= max_bytes or changed >= now - GC_GRACE_SECONDS:
+            break
+        _drop_document(document_id)
+        dropped += 1
+        for blob in blobs_by_document[document_id]:
+            references[blob] -= 1
+            if references[blob] <= 0 and blob in blobs:
+                document_store.delete_blob(blob)
+                deleted += 1
+                total -= blobs[blob][0]
+
+    if dropped or deleted:
+        print(f"[history] Deleted {dropped} documents and {deleted} blobs; {total} bytes stored")
+    return {"documents": dropped, "blobs": deleted, "bytes": total}
+
+
+def maybe_collect_garbage():
+    """collect_garbage, at most once per DOCUMENT_GC_INTERVAL in this process"""
+    global _last_gc
+    if time.time() - _last_gc < DOCUMENT_GC_INTERVAL or not _gc_lock.acquire(blocking=False):
+        return
+    try:
+        _last_gc = time.time()
+        collect_garbage()
+    except OSError as e:
+        print(f"[history] Garbage collection failed: {str(e)}")
+    finally:
+        _gc_lock.release()
@@ -0,0 +1,185 @@
+"""
+Page-by-page ingestion of multi-page images
+cv2.imread only returns the first page of a multi-page TIFF and decodes the
+whole frame up front. PageReader decodes one frame at a time, so OCR and
+redaction can run per page while only the current page is held in memory,
+and the writers encode each redacted page as soon as it is produced. Peak
+memory therefore depends on the largest page, not on the page count.
+"""
+
+import io
+import os
+import time
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+import cv2
+import fitz
+import numpy as np
+from PIL import Image, TiffImagePlugin
+
+import output_profiles
+
+MULTIPAGE_EXTENSIONS = (".tif", ".tiff")
+# Output container for multi-page input: "tiff" or "pdf"
+MULTIPAGE_OUTPUT_FORMAT = os.getenv("MULTIPAGE_OUTPUT_FORMAT", "tiff").lower()
+MULTIPAGE_FORMATS = {
+    "tiff": (".tiff", "image/tiff"),
+    "pdf": (".pdf", "application/pdf"),
+}
+# Used for the PDF page size when the TIFF carries no resolution
+DEFAULT_DPI = 200
+
+
+class Page(NamedTuple):
+    index: int
+    image: np.ndarray  # BGR, as cv2.imread returns it
+    mode: str          # Pillow mode of the source frame, e.g. "1" for fax pages
+    dpi: Tuple[float, float]
+
+
+def is_multipage_image(filename: str) -> bool:
+    return bool(filename) and filename.lower().endswith(MULTIPAGE_EXTENSIONS)
+
+
+def resolve_output_format(name: Optional[str]) -> str:
+    name = (name or "").lower()
+    if name == "tif":
+        name = "tiff"
+    return name if name in MULTIPAGE_FORMATS else MULTIPAGE_OUTPUT_FORMAT
+
+
+class PageReader:
+    """Lazily decodes the frames of an image file, one page per iteration"""
+
+    def __init__(self, source):
+        """
+        Args:
+            source: Path or seekable binary file object (e.g. an upload stream)
+        """
+        self._image = Image.open(source)
+        # Counting frames walks the IFD chain without decoding pixel data
+        self.page_count = getattr(self._image, "n_frames", 1)
+
+    def __iter__(self) -> Iterator[Page]:
+        for index in range(self.page_count):
+            self._image.seek(index)
+            frame = self._image
+            dpi = frame.info.get("dpi")
+            if not dpi or not all(dpi):
+                dpi = (DEFAULT_DPI, DEFAULT_DPI)
+            rgb = np.asarray(frame.convert("RGB"))
+            yield Page(index, cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), frame.mode, tuple(float(d) for d in dpi))
+
+    def close(self):
+        self._image.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _to_pil(page: Page, image: np.ndarray) -> Image.Image:
+    """Redacted BGR page as a Pillow image in the source frame's mode"""
+    pil = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    if page.mode == "1":
+        return pil.convert("L").point(lambda v: 255 if v >= 128 else 0, mode="1")
+    if page.mode in ("L", "I;16"):
+        return pil.convert("L")
+    return pil
+
+
+def write_tiff(pages: Iterable[Tuple[Page, np.ndarray]], output) -> float:
+    """
+    Append redacted pages to a multi-page TIFF as they arrive
+
+    Bilevel (fax) pages are kept bilevel with CCITT Group 4 compression,
+    everything else uses Deflate.
+
+    Args:
+        pages: Iterable of (source page, redacted BGR image)
+        output: Path or writable, seekable binary file object
+
+    Returns:
+        Time spent encoding in milliseconds
+    """
+    elapsed = 0.0
+    with TiffImagePlugin.AppendingTiffWriter(output, new=True) as tiff:
+        for page, image in pages:
+            start = time.perf_counter()
+            pil = _to_pil(page, image)
+            compression = "group4" if pil.mode == "1" else "tiff_adobe_deflate"
+            pil.save(tiff, format="TIFF", compression=compression, dpi=page.dpi)
+            tiff.newFrame()
+            elapsed += time.perf_counter() - start
+    return elapsed * 1000
+
+
+def write_pdf(pages: Iterable[Tuple[Page, np.ndarray]], image_format: Optional[str] = None,
+              image_quality: Optional[int] = None) -> Tuple[fitz.Document, float]:
+    """
+    Build a PDF with one image page per redacted page
+
+    Each page is encoded (see output_profiles.encode_image) and inserted
+    right away, so the document only holds compressed page images.
+
+    Returns:
+        Tuple of (fitz document for the caller to save with a PDF profile,
+        time spent encoding pages in milliseconds)
+    """
+    elapsed = 0.0
+    doc = fitz.open()
+    for page, image in pages:
+        start = time.perf_counter()
+        encoded, _ = output_profiles.encode_image(image, image_format, image_quality)
+        height, width = image.shape[:2]
+        pdf_page = doc.new_page(width=width * 72 / page.dpi[0], height=height * 72 / page.dpi[1])
+        pdf_page.insert_image(pdf_page.rect, stream=encoded)
+        elapsed += time.perf_counter() - start
+    return doc, elapsed * 1000
+
+
+def redact_pages(source, redact_page, output_format: Optional[str] = None, output_path: Optional[str] = None,
+                 image_format: Optional[str] = None, image_quality: Optional[int] = None,
+                 pdf_profile: Optional[str] = None) -> Tuple[Optional[bytes], Dict]:
+    """
+    Redact a multi-page image one page at a time
+
+    Args:
+        source: Path or seekable binary file object
+        redact_page: Callable(BGR image) -> redacted BGR image
+        output_format: "tiff" or "pdf" (default MULTIPAGE_OUTPUT_FORMAT)
+        output_path: Write here; None returns the encoded bytes instead
+        image_format / image_quality: Page image encoding inside a PDF
+        pdf_profile: Output profile for a PDF
+
+    Returns:
+        Tuple of (encoded bytes or None when written to output_path, encode
+        stats with format, extension, mimetype, pages, encode_ms and
+        output_bytes, plus the profile for a PDF)
+    """
+    output_format = resolve_output_format(output_format)
+    extension, mimetype = MULTIPAGE_FORMATS[output_format]
+    stats = {"format": output_format, "extension": extension, "mimetype": mimetype}
+
+    with PageReader(source) as reader:
+        redacted = ((page, redact_page(page.image)) for page in reader)
+        if output_format == "tiff":
+            target = output_path or io.BytesIO()
+            encode_ms = write_tiff(redacted, target)
+            data = None if output_path else target.getvalue()
+        else:
+            doc, encode_ms = write_pdf(redacted, image_format, image_quality)
+            with doc:
+                if output_path:
+                    data, pdf_stats = None, output_profiles.save_pdf(doc, output_path, pdf_profile)
+                else:
+                    data, pdf_stats = output_profiles.encode_pdf(doc, pdf_profile)
+            encode_ms += pdf_stats["encode_ms"]
+            stats["profile"] = pdf_stats["profile"]
+        stats["pages"] = reader.page_count
+
+    stats["encode_ms"] = round(encode_ms, 2)
+    stats["output_bytes"] = os.path.getsize(output_path) if output_path else len(data)
+    return data, stats
@@ -0,0 +1,185 @@
+"""
+Incremental PDF re-redaction
+The refine-and-execute loop redacts the same document again and again with
+slightly different plans. Per document (keyed by the SHA-256 of the original
+bytes) this keeps:
+
+- the OCR words of scanned pages
+- for every entity text ever searched, the pages and areas where it was
+  found, so only texts new to the plan are searched
+- per redaction type, the last output and, for every page, the key it was
+  rendered with: the set of (text, label) entities that hit the page
+
+A new plan maps to a key per page. Pages whose key is unchanged are taken
+from the previous output; only the others are redacted again and spliced
+in. Searches run on the unredacted original, so the hits are exact.
+
+Only the prompt execute loop uses this. The states are bounded by document
+count and by the total size of the outputs they hold.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+import fitz
+
+import document_store
+import metrics
+
+# Applies to /api/promptRedaction/execute only
+INCREMENTAL_REDACTION = os.getenv("INCREMENTAL_REDACTION", "1") == "1"
+# Documents kept; each holds its last output per redaction type
+INCREMENTAL_CACHE_SIZE = int(os.getenv("INCREMENTAL_CACHE_SIZE", "16"))
+# Total size of the kept outputs; least recently used documents go first
+INCREMENTAL_CACHE_BYTES = int(os.getenv("INCREMENTAL_CACHE_MB", "256")) * 1024 * 1024
+# Deleting and inserting pages orphans the replaced objects; "fast" (garbage=1) keeps them
+SPLICE_MIN_GARBAGE = 3
+
+PageKey = Tuple[str, FrozenSet[Tuple[str, str]]]
+
+
+class DocumentState:
+    """Search results and previous outputs of one original document"""
+
+    def __init__(self):
+        self.ocr_pages: Optional[Dict[int, List[Dict]]] = None
+        # entity text -> {page number: areas}
+        self.hits: Dict[str, Dict[int, list]] = {}
+        # redact type -> (output PDF bytes, page keys)
+        self.outputs: Dict[str, Tuple[bytes, List[PageKey]]] = {}
+        self.lock = threading.Lock()
+
+    def search(self, doc, texts, find_areas: Callable) -> None:
+        """Search every page for the texts that were never searched"""
+        new_texts = [text for text in dict.fromkeys(texts) if text not in self.hits]
+        for text in new_texts:
+            found = {}
+            for page in doc:
+                with metrics.stage("pdf_search"):
+                    areas = find_areas(page, text)
+                if areas:
+                    found[page.number] = list(areas)
+            self.hits[text] = found
+
+    def page_entities(self, page_count: int, entities: List[Dict]) -> List[List[Dict]]:
+        """Entities of the plan that were found on each page"""
+        pages = [[] for _ in range(page_count)]
+        for entity in entities:
+            for number in self.hits[entity['text']]:
+                pages[number].append(entity)
+        return pages
+
+    def areas(self, page, text: str) -> list:
+        return self.hits.get(text, {}).get(page.number, [])
+
+    def output_bytes(self) -> int:
+        return sum(len(data) for data, _ in self.outputs.values())
+
+
+_states: "OrderedDict[str, DocumentState]" = OrderedDict()
+_states_lock = threading.Lock()
+
+
+def document_state(pdf_content: bytes) -> DocumentState:
+    document_id = document_store.blob_id(pdf_content)
+    with _states_lock:
+        state = _states.get(document_id)
+        metrics.cache_lookup("incremental_document", state is not None)
+        if state is None:
+            state = _states[document_id] = DocumentState()
+        _states.move_to_end(document_id)
+        _evict()
+        return state
+
+
+def _evict() -> None:
+    """Drop least recently used states beyond the count and size bounds (caller holds _states_lock)"""
+    while len(_states) > INCREMENTAL_CACHE_SIZE:
+        _states.popitem(last=False)
+    total = sum(state.output_bytes() for state in _states.values())
+    while len(_states) > 1 and total > INCREMENTAL_CACHE_BYTES:
+        _, state = _states.popitem(last=False)
+        total -= state.output_bytes()
+
+
+def _store_output(state: DocumentState, redact_type: str, data: bytes, keys: List[PageKey]) -> None:
+    if len(data) > INCREMENTAL_CACHE_BYTES:
+        state.outputs.pop(redact_type, None)
+        return
+    state.outputs[redact_type] = (data, keys)
+    with _states_lock:
+        _evict()
+
+
+def page_key(redact_type: str, entities: List[Dict]) -> PageKey:
+    return redact_type, frozenset((e['text'], e.get('label', '')) for e in entities)
+
+
+def splice_pages(previous: bytes, source, page_numbers: List[int]):
+    """
+    Previous output with the given pages replaced by those of source
+
+    Returns:
+        A new fitz document; the caller closes it
+    """
+    output = fitz.open(stream=previous, filetype="pdf")
+    toc = output.get_toc(simple=False)
+    for number in page_numbers:
+        output.delete_page(number)
+        # Resources shared between pages of source are copied only once
+        output.insert_pdf(source, from_page=number, to_page=number, start_at=number)
+    if toc:
+        output.set_toc(toc)
+    return output
+
+
+def redact(doc, pdf_content: bytes, entities: List[Dict], redact_type: str,
+           redact_page: Callable, find_areas: Callable, ocr_scan: Callable, encode: Callable):
+    """
+    Redact doc, reusing the pages of the previous output of this document
+
+    Args:
+        doc: The original document, opened from pdf_content; modified in place
+        entities: Plan entities ({"text", "label"})
+        redact_type: Redaction style
+        redact_page: Callable(page, entities, ocr_pages, find_areas) redacting one page
+        find_areas: Callable(page, text, ocr_pages) locating text on a page
+        ocr_scan: Callable() returning the OCR words of scanned pages
+        encode: Callable(doc, min_garbage=0) returning (PDF bytes, encode stats)
+
+    Returns:
+        Tuple of (PDF bytes, encode stats with an "incremental" summary)
+    """
+    state = document_state(pdf_content)
+    with state.lock:
+        if state.ocr_pages is None:
+            state.ocr_pages = ocr_scan()
+        ocr_pages = state.ocr_pages
+        state.search(doc, [e['text'] for e in entities], lambda page, text: find_areas(page, text, ocr_pages))
+
+        pages = state.page_entities(len(doc), entities)
+        keys = [page_key(redact_type, page_entities) for page_entities in pages]
+
+        previous = state.outputs.get(redact_type)
+        if previous is not None and len(previous[1]) == len(keys):
+            changed = [number for number, key in enumerate(keys) if key != previous[1][number]]
+        else:
+            previous, changed = None, list(range(len(keys)))
+        for number in changed:
+            metrics.cache_lookup("incremental_page", False)
+            redact_page(doc[number], pages[number], ocr_pages, state.areas)
+        for _ in range(len(keys) - len(changed)):
+            metrics.cache_lookup("incremental_page", True)
+
+        if previous is None:
+            data, encode_stats = encode(doc)
+        else:
+            with splice_pages(previous[0], doc, changed) as output:
+                data, encode_stats = encode(output, min_garbage=SPLICE_MIN_GARBAGE)
+        _store_output(state, redact_type, data, keys)
+
+    encode_stats["incremental"] = {"recomputed_pages": len(changed), "reused_pages": len(keys) - len(changed)}
+    metrics.record(recomputed_pages=len(changed))
+    return data, encode_stats
@@ -0,0 +1,198 @@
+"""
+LLM backends for intent analysis, plan refinement and synthetic replacement
+Every backend turns a list of chat messages into the assistant's text and
+can be dropped into a LangChain chain (prompt | backend.runnable() | parser).
+
+    gemini  Google Gemini through LangChain (GOOGLE_API_KEY)
+    openai  Any OpenAI-compatible chat completions endpoint, e.g. the hosted
+            Llama 3.3 70B used for synthetic replacement (OPENAI_API_KEY)
+    local   A quantized GGUF model on CPU through llama-cpp-python; output
+            is constrained by a grammar generated from the JSON schema, so
+            plans always parse as a RedactionPlan
+
+LLM_BACKEND selects the backend for redaction plans and
+SYNTHETIC_LLM_BACKEND the one for synthetic replacements.
+"""
+
+import abc
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib import request as urlrequest
+
+import metrics
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+SYNTHETIC_LLM_BACKEND = os.getenv("SYNTHETIC_LLM_BACKEND", "openai")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.1"))
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "2048"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://glhf.chat/api/openai/v1")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "hf:meta-llama/Llama-3.3-70B-Instruct")
+# Path to a GGUF file, e.g. qwen2.5-3b-instruct-q4_k_m.gguf
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "")
+LOCAL_LLM_CONTEXT = int(os.getenv("LOCAL_LLM_CONTEXT", "8192"))
+
+LLM_CALLS = metrics.register(metrics.Counter(
+    f"{metrics.NAMESPACE}_llm_calls_total", "LLM calls by backend, role and outcome"))
+LLM_DURATION = metrics.register(metrics.Histogram(
+    f"{metrics.NAMESPACE}_llm_duration_seconds", "LLM call latency by backend", metrics.DURATION_BUCKETS))
+
+_ROLES = {"human": "user", "ai": "assistant", "system": "system"}
+_LANGCHAIN_ROLES = {role: kind for kind, role in _ROLES.items()}
+
+
+def to_messages(prompt_value) -> List[Dict[str, str]]:
+    """Convert a LangChain prompt value (or plain string) to chat messages"""
+    if hasattr(prompt_value, "to_messages"):
+        return [{"role": _ROLES.get(m.type, "user"), "content": m.content} for m in prompt_value.to_messages()]
+    return [{"role": "user", "content": str(prompt_value)}]
+
+
+class LLMBackend(abc.ABC):
+    """Base class: subclasses implement _complete"""
+
+    name = "base"
+
+    @abc.abstractmethod
+    def _complete(self, messages: List[Dict[str, str]], schema: Optional[Dict]) -> str:
+        """Return the assistant's text for messages, following schema where supported"""
+
+    def complete(self, messages: List[Dict[str, str]], schema: Optional[Dict] = None, role: str = "plan") -> str:
+        """
+        Run one chat completion
+
+        Args:
+            messages: OpenAI-style [{"role", "content"}] messages
+            schema: JSON schema the answer must follow, if the backend can enforce it
+            role: "plan" or "synthetic", for metrics
+
+        Returns:
+            The assistant's text
+        """
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            text = self._complete(messages, schema)
+            outcome = "ok"
+            return text
+        finally:
+            LLM_CALLS.inc(backend=self.name, role=role, outcome=outcome)
+            LLM_DURATION.observe(time.perf_counter() - start, backend=self.name)
+
+    def runnable(self, output_model=None):
+        """LangChain runnable returning text, constrained to output_model's schema where supported"""
+        from langchain_core.runnables import RunnableLambda
+
+        schema = output_model.model_json_schema() if output_model is not None else None
+        return RunnableLambda(lambda prompt_value: self.complete(to_messages(prompt_value), schema))
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, model: str = GEMINI_MODEL):
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        api_key = os.getenv('GOOGLE_API_KEY')
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY not found in environment variables")
+        self.llm = ChatGoogleGenerativeAI(model=model, temperature=LLM_TEMPERATURE, google_api_key=api_key)
+
+    def _complete(self, messages, schema):
+        # The format instructions in the prompt carry the schema
+        history = [(_LANGCHAIN_ROLES[m["role"]], m["content"]) for m in messages]
+        return self.llm.invoke(history).content
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    name = "openai"
+
+    def __init__(self, base_url: str = OPENAI_BASE_URL, model: str = OPENAI_MODEL,
+                 api_key: Optional[str] = None, timeout: float = LLM_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.api_key = api_key if api_key is not None else os.getenv("OPENAI_API_KEY", "")
+        self.timeout = timeout
+
+    def _complete(self, messages, schema):
+        payload = {"model": self.model, "messages": messages,
+                   "temperature": LLM_TEMPERATURE, "max_tokens": LLM_MAX_TOKENS}
+        if schema is not None:
+            payload["response_format"] = {"type": "json_object"}
+        req = urlrequest.Request(
+            f"{self.base_url}/chat/completions", data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"})
+        with urlrequest.urlopen(req, timeout=self.timeout) as response:
+            return json.load(response)["choices"][0]["message"]["content"]
+
+
+class LlamaCppBackend(LLMBackend):
+    name = "local"
+
+    def __init__(self, model_path: str = LOCAL_LLM_MODEL, n_ctx: int = LOCAL_LLM_CONTEXT,
+                 n_threads: Optional[int] = None):
+        try:
+            from llama_cpp import Llama
+        except ImportError as e:
+            raise ValueError("LLM_BACKEND=local needs llama-cpp-python (pip install llama-cpp-python)") from e
+        if not model_path or not os.path.exists(model_path):
+            raise ValueError(f"LOCAL_LLM_MODEL must point to a GGUF file, got '{model_path}'")
+        # cpu_budget sets OMP_NUM_THREADS to this worker's per-request share
+        n_threads = n_threads or int(os.getenv("OMP_NUM_THREADS", "0")) or None
+        self.model_path = model_path
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
+        # A llama.cpp context serves one generation at a time
+        self._lock = threading.Lock()
+
+    def _complete(self, messages, schema):
+        kwargs = {"temperature": LLM_TEMPERATURE, "max_tokens": LLM_MAX_TOKENS}
+        if schema is not None:
+            kwargs["response_format"] = {"type": "json_object", "schema": schema}
+        with self._lock:
+            result = self.llm.create_chat_completion(messages=messages, **kwargs)
+        return result["choices"][0]["message"]["content"]
+
+
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "openai": OpenAICompatibleBackend,
+    "local": LlamaCppBackend,
+}
+
+# One instance per backend name: every backend is configured from this
+# module's settings, so the name identifies the configuration, and roles using
+# the same backend share it (one GGUF model in memory, one generation lock)
+_instances: Dict[str, LLMBackend] = {}
+# Backends installed with set_backend, by role
+_overrides: Dict[str, LLMBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def create_backend(name: str) -> LLMBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{name}'. Available: {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+def get_backend(role: str = "plan") -> LLMBackend:
+    """Shared backend instance for a role ("plan" or "synthetic")"""
+    name = SYNTHETIC_LLM_BACKEND if role == "synthetic" else LLM_BACKEND
+    with _backends_lock:
+        if role in _overrides:
+            return _overrides[role]
+        if name not in _instances:
+            _instances[name] = create_backend(name)
+            print(f"[llm] loaded backend: {name}")
+        return _instances[name]
+
+
+def set_backend(backend: LLMBackend, role: Optional[str] = None):
+    """Use backend for one role, or for both when role is None"""
+    with _backends_lock:
+        for r in ([role] if role else ["plan", "synthetic"]):
+            _overrides[r] = backend
@@ -0,0 +1,315 @@
+"""
+End-to-end load test harness
+Starts a local stand-in for the LLM (an OpenAI-style chat completions
+server with configurable latency, error rate and a canned RedactionPlan),
+makes it the LLM backend for plans and synthetic replacements,
+serves the Flask app on an ephemeral port and drives mixed concurrent
+traffic at it with documents from public/. Reports throughput, latency
+percentiles and error rates per endpoint. No request leaves the machine.
+
+Usage:
+    python load_test.py --concurrency 8 --requests 200
+    python load_test.py --duration 60 --llm-latency-ms 800 --llm-error-rate 0.05
+    python load_test.py --mix entities=2,analyze=1,execute=1,synthetic=1 --output load.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+import benchmark
+import llm_backends
+import main
+
+DOCUMENT_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png")
+# Outputs the app itself writes into public/
+GENERATED_PREFIXES = ("redacted_", "manual_redaction_", "loadtest_")
+
+DEFAULT_PLAN = {
+    "entities": [
+        {"text": "John Smith", "entity_type": "PERSON_NAME", "reason": "Personal identifier", "confidence": 0.95},
+        {"text": "john@example.com", "entity_type": "EMAIL_ADDRESS", "reason": "Personal contact", "confidence": 0.9},
+        {"text": "Hyderabad", "entity_type": "CITY", "reason": "Location", "confidence": 0.8},
+    ],
+    "redaction_strategy": "BlackOut",
+    "summary": "Load test plan",
+}
+DEFAULT_MIX = "entities=3,analyze=2,refine=1,preview=1,execute=2,synthetic=1"
+SYNTHETIC_WORDS = ["Alex", "Jordan", "Taylor", "Morgan", "Casey", "Riley"]
+
+
+# ==================== FAKE LLM SERVER ====================
+
+class FakeLLMServer:
+    """OpenAI-compatible /v1/chat/completions stand-in with injected latency and errors"""
+
+    def __init__(self, plan: Dict, latency_ms: float = 300, jitter_ms: float = 100,
+                 error_rate: float = 0.0, seed: int = 1234):
+        self.plan_json = json.dumps(plan)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.stats = {"requests": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def _respond(self, payload: Dict):
+        """Decide latency, failure and content for one completion request"""
+        with self._lock:
+            self.stats["requests"] += 1
+            delay = max(0.0, self.rng.gauss(self.latency_ms, self.jitter_ms)) / 1000
+            fail = self.rng.random() < self.error_rate
+            if fail:
+                self.stats["errors"] += 1
+            word = self.rng.choice(SYNTHETIC_WORDS)
+        time.sleep(delay)
+        if fail:
+            return 503, {"error": {"message": "injected failure", "type": "server_error"}}
+        last_message = (payload.get("messages") or [{}])[-1].get("content", "")
+        content = word if "synthetic" in last_message.lower() else self.plan_json
+        return 200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "model": payload.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        }
+
+    def start(self) -> str:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                status, body = fake._respond(json.loads(self.rfile.read(length) or b"{}"))
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+
+
+def install_fake_llm(base_url: str):
+    """Point every LLM call of the app at base_url"""
+    llm_backends.set_backend(llm_backends.OpenAICompatibleBackend(base_url, model="fake", api_key=""))
+
+
+# ==================== TRAFFIC ====================
+
+def load_documents(directory: str) -> List[Dict]:
+    documents = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(DOCUMENT_EXTENSIONS) or name.startswith(GENERATED_PREFIXES):
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            documents.append({"name": name, "content": f.read(), "pdf": name.lower().endswith(".pdf")})
+    return documents
+
+
+def _upload(document: Dict):
+    # The app saves uploads into public/ under their own name and may delete
+    # them afterwards, so never reuse the name of a real document
+    name = f"loadtest_{uuid.uuid4().hex[:8]}_{document['name']}"
+    return {"file": (name, document["content"])}
+
+
+def _plan_entities(plan: Dict) -> List[Dict]:
+    return [{"text": e["text"], "label": e["entity_type"], "reason": e["reason"], "confidence": e["confidence"]}
+            for e in plan["entities"]]
+
+
+def build_scenarios(base_url: str, plan: Dict) -> Dict[str, Callable]:
+    """Endpoint name -> callable(session, document) returning the HTTP response"""
+    entities = _plan_entities(plan)
+    entities_json = json.dumps([{"text": e["text"], "label": e["label"]} for e in entities])
+
+    return {
+        "entities": lambda s, d: s.post(f"{base_url}/api/entities", files=_upload(d)),
+        "analyze": lambda s, d: s.post(f"{base_url}/api/promptRedaction/analyze", files=_upload(d),
+                                       data={"intent": "Remove all personal information"}),
+        "refine": lambda s, d: s.post(f"{base_url}/api/promptRedaction/refine",
+                                      json={"current_plan": plan, "feedback": "Also keep city names"}),
+        "preview": lambda s, d: s.post(f"{base_url}/api/promptRedaction/preview",
+                                       json={"text": "John Smith from Hyderabad, john@example.com",
+                                             "entities": entities}),
+        "execute": lambda s, d: s.post(f"{base_url}/api/promptRedaction/execute", files=_upload(d),
+                                       data={"entities": entities_json, "type": "BlackOut", "mode": "stream"}),
+        "synthetic": lambda s, d: s.post(f"{base_url}/api/redactEntity?type=SyntheticReplacement",
+                                         files=_upload(d), data={"entities": entities_json}),
+    }
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def run_load(base_url: str, documents: List[Dict], plan: Dict, mix: Dict[str, float], concurrency: int,
+             total_requests: Optional[int], duration: Optional[float], seed: int) -> Dict:
+    """Drive traffic and return per-endpoint samples plus the wall time"""
+    scenarios = build_scenarios(base_url, plan)
+    unknown = set(mix) - set(scenarios)
+    if unknown:
+        raise ValueError(f"Unknown endpoints in mix: {', '.join(sorted(unknown))}")
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    pdfs = [d for d in documents if d["pdf"]] or documents
+
+    samples: Dict[str, List] = {name: [] for name in names}
+    lock = threading.Lock()
+    counter = iter(range(total_requests)) if total_requests else None
+    deadline = time.perf_counter() + duration if duration else None
+
+    def next_ticket() -> bool:
+        with lock:
+            if counter is not None:
+                return next(counter, None) is not None
+            return time.perf_counter() < deadline
+
+    def worker(index: int):
+        rng = random.Random(f"{seed}-{index}")
+        session = requests.Session()
+        while next_ticket():
+            name = rng.choices(names, weights)[0]
+            # SyntheticReplacement only exists for PDFs
+            document = rng.choice(pdfs if name == "synthetic" else documents)
+            start = time.perf_counter()
+            try:
+                response = scenarios[name](session, document)
+                status, ok = response.status_code, response.ok
+            except requests.RequestException as e:
+                status, ok = type(e).__name__, False
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                samples[name].append((elapsed, ok, status))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return {"samples": samples, "wall_seconds": time.perf_counter() - start}
+
+
+def summarize_load(result: Dict) -> Dict:
+    wall = result["wall_seconds"]
+    endpoints = {}
+    all_latencies, all_errors, total = [], 0, 0
+    for name, samples in result["samples"].items():
+        if not samples:
+            continue
+        latencies = [s[0] for s in samples]
+        errors = [s for s in samples if not s[1]]
+        statuses: Dict[str, int] = {}
+        for _, _, status in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        endpoints[name] = {
+            "requests": len(samples),
+            "throughput_rps": round(len(samples) / wall, 3),
+            "error_rate": round(len(errors) / len(samples), 4),
+            "statuses": statuses,
+            "latency_ms": benchmark.summarize(latencies),
+        }
+        all_latencies.extend(latencies)
+        all_errors += len(errors)
+        total += len(samples)
+    overall = {
+        "requests": total,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(total / wall, 3) if wall else 0,
+        "error_rate": round(all_errors / total, 4) if total else 0,
+        "latency_ms": benchmark.summarize(all_latencies) if all_latencies else {},
+    }
+    return {"overall": overall, "endpoints": endpoints}
+
+
+def start_app() -> tuple:
+    """Serve the Flask app on an ephemeral port in a background thread"""
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Load test the redaction API against a local fake LLM")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=100, help="Total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, help="Run for this many seconds instead of a request count")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Endpoint weights, e.g. entities=3,analyze=1")
+    parser.add_argument("--documents", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "public"),
+                        help="Directory with PDFs and images to upload")
+    parser.add_argument("--plan-file", help="JSON RedactionPlan returned by the fake LLM")
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="Mean fake LLM latency")
+    parser.add_argument("--llm-jitter-ms", type=float, default=100, help="Standard deviation of fake LLM latency")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction of LLM calls that fail")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Write the JSON report to this path instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    plan = DEFAULT_PLAN
+    if args.plan_file:
+        with open(args.plan_file) as f:
+            plan = json.load(f)
+    documents = load_documents(args.documents)
+    if not documents:
+        print(f"No documents found in {args.documents}", file=sys.stderr)
+        return 1
+
+    fake_llm = FakeLLMServer(plan, args.llm_latency_ms, args.llm_jitter_ms, args.llm_error_rate, args.seed)
+    install_fake_llm(fake_llm.start())
+    server, base_url = start_app()
+    print(f"[load] app at {base_url}, {len(documents)} documents, concurrency {args.concurrency}", file=sys.stderr)
+    try:
+        result = run_load(base_url, documents, plan, parse_mix(args.mix), args.concurrency,
+                          None if args.duration else args.requests, args.duration, args.seed)
+    finally:
+        server.shutdown()
+        fake_llm.stop()
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        **summarize_load(result),
+        "llm": fake_llm.stats,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
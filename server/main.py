@@ -1,22 +1,39 @@
-from flask import Flask, jsonify, request, json, send_from_directory, url_for
+from flask import Flask, Response, jsonify, request, json, send_from_directory, url_for
 from flask_cors import CORS
 import certifi
 import os
 import time
 
 os.environ.setdefault("SSL_CERT_FILE", certifi.where())
+# Thread limits must be in place before OpenCV, PyTorch and Tesseract load
+import cpu_budget
+cpu_budget.apply()
 import fitz
-import re
 import cv2
-import pytesseract
-from pytesseract import Output
 import os
-import google.generativeai as genai
-from gliner import GLiNER
+import gliner
 import mimetypes
+import threading
+from urllib.parse import quote
 import numpy as np
-import shutil
-import asyncio
+
+import document_router
+import document_store
+import entity_cache
+import face_detection
+import history
+import image_pages
+import incremental_redaction
+import llm_backends
+import metrics
+import model_loading
+import normalization
+import ocr
+import output_profiles
+import profiling
+import redaction_render
+import structured_detector
+import tiled_redaction
 
 # Import prompt-based redaction module
 from prompt_redaction import (
@@ -27,9 +44,18 @@ from prompt_redaction import (
 )
 
 app = Flask(__name__)
-CORS(app)
-model = GLiNER.from_pretrained("knowledgator/gliner-multitask-large-v0.5")
+# Lets browser clients read the metadata of file responses
+CORS(app, expose_headers=[
+    'X-Document-Id', 'X-Redaction-Count', 'X-Redaction-File-Type', 'X-Redaction-Total-Redactions',
+    'X-Redaction-Original-Filename', 'X-Redaction-Encode-Ms', 'X-Redaction-Output-Bytes',
+])
+metrics.init_app(app)
+profiling.init_app(app)
+GLINER_MODEL_NAME = os.getenv("GLINER_MODEL", "knowledgator/gliner-multitask-large-v0.5")
+_model = None
+_model_lock = threading.Lock()
 UPLOAD_FOLDER = '../public'
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", str(64 * 1024)))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 labels = [
@@ -269,6 +295,7 @@ labels = [
                                   "PLACE"     # For "black motorcycle"
 ]
 
+document_router.check_profiles(labels)
 
 labels_string = ", ".join(labels)
 
@@ -280,6 +307,56 @@ No extra text, return empty string if none.
 Request: {user_request}. Entities:"""
 
 
+def get_model():
+    """Load the GLiNER model on first use and share it across requests"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            # Another request thread may have loaded it while this one waited
+            if _model is None:
+                _model = model_loading.load_gliner(GLINER_MODEL_NAME)
+    return _model
+
+
+def predict_entities(text, entity_labels=None, threshold=0.5, normalized=None):
+    """
+    Detect entities in text
+
+    Structured identifiers (emails, phones, card numbers, dates, ...) are
+    found by the regex pre-detector; only the remaining labels are sent to
+    GLiNER, timed as the "gliner" stage.
+
+    Args:
+        text: Cleaned text (preprocess_text output)
+        normalized: normalization.preprocess result that produced text; the
+            pre-detector then scans the uncleaned source, where separators
+            such as ':' and '/' are still present
+    """
+    structured_labels, model_labels = structured_detector.split_labels(entity_labels or labels)
+    with metrics.stage("structured_detection"):
+        if normalized is not None:
+            structured = structured_detector.detect_in_source(normalized, structured_labels)
+        else:
+            structured = structured_detector.detect(text, structured_labels)
+    metrics.record(structured_entities=len(structured), gliner_labels=len(model_labels))
+    if not model_labels:
+        return structured
+    model_entities = entity_cache.cached_predict(
+        text, model_labels, threshold, model_version(),
+        lambda missing: run_gliner(text, missing, threshold))
+    return structured_detector.merge(structured, model_entities)
+
+
+def run_gliner(text, entity_labels, threshold):
+    with metrics.stage("gliner"):
+        return get_model().predict_entities(text, entity_labels, threshold=threshold)
+
+
+def model_version():
+    """Identifies the model whose results are cached"""
+    return f"{GLINER_MODEL_NAME}@{getattr(gliner, '__version__', 'unknown')}"
+
+
 def is_image_file(filename):
     mime_type, _ = mimetypes.guess_type(filename)
     return mime_type and mime_type.startswith('image/')
@@ -288,12 +365,38 @@ def is_pdf_file(filename):
     mime_type, _ = mimetypes.guess_type(filename)
     return mime_type == 'application/pdf'
 
+def release_output_path(path):
+    """Drop a published history symlink so writing to path cannot modify a stored version"""
+    if os.path.islink(path):
+        os.remove(path)
+
+def request_owner():
+    """
+    Session or user whose redaction history a request uses
+
+    The X-Session-Id header or session_id field/query parameter, else the
+    client address.
+    """
+    return (request.headers.get('X-Session-Id') or request.form.get('session_id')
+            or request.args.get('session_id') or request.remote_addr or '')
+
+def record_redaction_version(original_content, output_path, kind, description, document_id=None):
+    """Store the redacted output as a new version of the original document"""
+    owner = request_owner()
+    with metrics.stage("history_commit"):
+        if not document_id or history.get_version(document_id, owner=owner) is None:
+            document_id = history.ensure_document(original_content, kind, owner)
+        with open(output_path, 'rb') as f:
+            return history.commit(document_id, f.read(), description)
+
+def redacted_image_mimetype(path):
+    """The shared image output may hold JPEG, PNG or WebP depending on the profile"""
+    with open(path, 'rb') as f:
+        return output_profiles.sniff_image_mimetype(f.read(16))
+
+
 def normalize_text(text):
-    date_pattern = r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b'
-    text = re.sub(date_pattern, lambda m: m.group().replace('/', '-'), text)
-    
-    text = ' '.join(text.split()).lower()
-    return text
+    return normalization.normalize_for_matching(text).text
 
 @app.route('/api/entities', methods=['POST'])
 def entities():
@@ -304,11 +407,17 @@ def entities():
     if not file or file.filename == '':
         return jsonify({"error": "No file uploaded"}), 400
 
+    # Not "profile": that query parameter requests a profiler run (profiling.py)
+    profile_override = request.args.get('label_profile') or request.form.get('label_profile')
+    if profile_override and profile_override not in document_router.profile_names():
+        return jsonify({"error": f"Unknown label_profile '{profile_override}'. Use one of: {', '.join(document_router.profile_names())}"}), 400
+
     try:
         temp_path = os.path.join(UPLOAD_FOLDER, file.filename)
         # undo_path= os.path.join(UPLOAD_FOLDER, file.filename+"_undo")
         # file.save(undo_path)
         file.save(temp_path)
+        metrics.record(document_bytes=os.path.getsize(temp_path))
 
         if is_image_file(file.filename):
             extracted_text = extract_text_from_image(temp_path)
@@ -325,9 +434,11 @@ def entities():
         if not extracted_text:
             return jsonify({"error": "No text could be extracted from the file"}), 400
 
-        cleaned_text = preprocess_text(extracted_text)
+        normalized = normalization.preprocess(extracted_text)
+        cleaned_text = normalized.text
 
-        entities = model.predict_entities(cleaned_text, labels, threshold=0.5)
+        profile, profile_labels = document_router.route(cleaned_text, labels, profile_override)
+        entities = predict_entities(cleaned_text, profile_labels, normalized=normalized)
         
         seen = set()
         entity_list = []
@@ -338,12 +449,14 @@ def entities():
                 seen.add(key)
                 entity_list.append({"text": entity["text"], "label": entity["label"]})
 
+        metrics.record(entities=len(entity_list))
         print(entity_list)
        
         return jsonify({
             "message": "Entities extracted successfully",
             "entities": entity_list,
-            "extractedText": cleaned_text 
+            "extractedText": cleaned_text,
+            "label_profile": profile
         }), 200
 
     except Exception as e:
@@ -352,220 +465,171 @@ def entities():
         }), 500
 
 
-def find_text_matches(source_text, target_text):
-    if not source_text or not target_text:
-        return []
-
-    source_normalized = normalize_text(source_text)
-    target_normalized = normalize_text(target_text)
-    if not target_normalized:
-        return []
-
-    matches = []
-    start = 0
-    while True:
-        idx = source_normalized.find(target_normalized, start)
-        if idx == -1:
-            break
-        matches.append((idx, idx + len(target_normalized)))
-        start = idx + 1
-    return matches
-
+@metrics.timed("ocr_text")
 def extract_text_from_image(image_path):
     try:
+        if image_pages.is_multipage_image(image_path):
+            # One decoded page in memory at a time
+            with image_pages.PageReader(image_path) as reader:
+                metrics.record(pages=reader.page_count)
+                return "\n\n".join(ocr_image_text(page.image) for page in reader).strip()
+
         image = cv2.imread(image_path)
         if image is None:
             raise ValueError("Failed to load image")
-        
-        if len(image.shape) == 2:
-            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-        elif image.shape[2] == 4:
-            image = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
-        else:
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        image = cv2.resize(image, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
-        image = cv2.GaussianBlur(image, (3,3), 0)
-        
-        custom_config = r'--oem 3 --psm 6'
-        text = pytesseract.image_to_string(image, config=custom_config)
-        return text.strip()
+        return ocr_image_text(image).strip()
     except Exception as e:
         print(f"Error in OCR processing: {str(e)}")
         return ""
+
+def ocr_image_text(image):
+    with metrics.stage("ocr_preprocess"):
+        image, transform = ocr.preprocess_for_ocr(image)
+    metrics.record(ocr_transform=transform.describe())
+    return ocr.image_to_text(image)
+@metrics.timed("pdf_text_extraction")
 def extract_text_from_pdf(pdf_content):
     full_text = ""
     with fitz.open(stream=pdf_content, filetype="pdf") as doc:
+        metrics.record(pages=len(doc))
+        ocr_pages = ocr_scanned_pdf_pages(pdf_content, doc)
         for page in doc:
-            full_text += page.get_text()
+            full_text += get_page_text(page, ocr_pages)
     return full_text
 
+
+def ocr_scanned_pdf_pages(pdf_content, doc):
+    """OCR the pages of doc that have no text layer, keyed by page number"""
+    with metrics.stage("pdf_ocr_fallback"):
+        ocr_pages = ocr.ocr_scanned_pages(pdf_content, doc)
+    if ocr_pages:
+        metrics.record(ocr_pages=len(ocr_pages))
+    return ocr_pages
+
+
+def get_page_text(page, ocr_pages):
+    """Text layer of a page, or its OCR text when the page is scanned"""
+    if page.number in ocr_pages:
+        return ocr.words_to_text(ocr_pages[page.number]) + "\n"
+    return page.get_text()
+
+
+def find_entity_areas(page, text, ocr_pages):
+    """Locate text on a page, searching OCR words for scanned pages"""
+    if page.number in ocr_pages:
+        return ocr.search_words(ocr_pages[page.number], text)
+    return page.search_for(text)
+
 def preprocess_text(text):
-    text = re.sub(r'\s+', ' ', text)
+    return normalization.preprocess(text).text
+
+
+@metrics.timed("ocr_boxes")
+def get_text_boxes(image):
+    with metrics.stage("ocr_preprocess"):
+        processed, transform = ocr.preprocess_for_ocr(image)
+    words = ocr.image_to_words(processed)
     
-    text = re.sub(r'[^\w\s.,!?@#$%^&*()-]', '', text)
+    text_boxes = []
+    for word in words:
+        if int(float(word['conf'])) > 60:  
+            text = word['text'].strip()
+            if text:
+                x, y, w, h = transform.to_original((word['left'], word['top'],
+                                                    word['width'], word['height']))
+                text_boxes.append({
+                    'text': text,
+                    'bbox': (x, y, w, h),
+                    'conf': word['conf']
+                })
+    return text_boxes
+
+@metrics.timed("image_redaction_rendering")
+def redact_matching_text(image, text_boxes, entities, redact_type):
+    redacted = image.copy()
+
+    layout = normalization.WordLayout([box['text'] for box in text_boxes])
+    # Entity texts come from preprocess_text output, so the OCR words are
+    # cleaned the same way and matches resolve through the index map
+    normalized = normalization.preprocess(layout.text)
+    print(entities)
+
+    if redact_type == "RedactObjects":
+        print("FACE")
+        with metrics.stage("face_detection"):
+            faces = face_detection.detect_faces(redacted)
+
+        for (x, y, w, h) in faces:
+            cv2.rectangle(redacted, (x, y), (x+w, y+h), (0, 0, 0), -1)
+            cv2.putText(
+                redacted,
+                "FACE REDACTED",
+                (x, y-10),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.5,
+                (255, 255, 255),
+                1
+            )
+
+    # Box index -> replacement label; a box is drawn once even if several matches select it
+    targets = {}
+    for entity in entities:
+        for span in normalization.find_spans(layout, entity['text'], normalized, normalization.preprocess):
+            for i in span:
+                targets[i] = entity.get('label', 'REDACTED')
+
+    redaction_render.render_redactions(
+        redacted,
+        [(text_boxes[i]['bbox'], label) for i, label in targets.items()],
+        redact_type
+    )
     
-    return text.strip()
+    return redacted
 
 
-def process_image_redaction(file, entities, redact_type):
-    file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(file_path)
-    def get_text_boxes(image):
-        custom_config = r'--oem 3 --psm 6'
-        data = pytesseract.image_to_data(image, output_type=Output.DICT, config=custom_config)
-        
-        text_boxes = []
-        n_boxes = len(data['text'])
-        for i in range(n_boxes):
-            if int(data['conf'][i]) > 60:  
-                text = data['text'][i].strip()
-                if text:
-                    x, y, w, h = (data['left'][i], data['top'][i],
-                                  data['width'][i], data['height'][i])
-                    text_boxes.append({
-                        'text': text,
-                        'bbox': (x, y, w, h),
-                        'conf': data['conf'][i]
-                    })
-        return text_boxes
-
-    def find_text_matches(source_text, target_text):
-        """Find matches of target_text in source_text."""
-        matches = []
-        start_idx = source_text.find(target_text)
-        while start_idx != -1:
-            end_idx = start_idx + len(target_text)
-            matches.append((start_idx, end_idx))
-            start_idx = source_text.find(target_text, end_idx)
-        return matches
-
-    def redact_matching_text(image, text_boxes, entities, redact_type):
-        redacted = image.copy()
-
-        source_text = " ".join([box['text'] for box in text_boxes])
-        print(entities)
-
-        if redact_type == "RedactObjects":
-            print("FACE")
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
-
-            gray = cv2.cvtColor(redacted, cv2.COLOR_BGR2GRAY)
-            faces = face_cascade.detectMultiScale(
-                gray,
-                scaleFactor=1.1,
-                minNeighbors=5,
-                minSize=(30, 30)
-            )
+@profiling.profiled
+def process_image_redaction(file, entities, redact_type, image_format=None, image_quality=None, in_memory=False,
+                            multipage_format=None, pdf_profile=None):
+    """
+    Redact an uploaded image
 
-            for (x, y, w, h) in faces:
-                cv2.rectangle(redacted, (x, y), (x+w, y+h), (0, 0, 0), -1)
-                cv2.putText(
-                    redacted,
-                    "FACE REDACTED",
-                    (x, y-10),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.5,
-                    (255, 255, 255),
-                    1
-                )
-
-                roi_gray = gray[y:y+h, x:x+w]
-                eyes = eye_cascade.detectMultiScale(roi_gray)
-                for (ex, ey, ew, eh) in eyes:
-                    cv2.rectangle(
-                        redacted,
-                        (x + ex, y + ey),
-                        (x + ex + ew, y + ey + eh),
-                        (0, 0, 0),
-                        -1
-                    )
+    Multi-page TIFFs are redacted page by page and written as a multi-page
+    TIFF or PDF (multipage_format), see process_multipage_image_redaction.
 
-        for entity in entities:
-            target_text = entity['text']
-            matches = find_text_matches(source_text, target_text)
-            
-            for start_idx, end_idx in matches:
-                for box in text_boxes:
-                    if target_text in box['text']:
-                        x, y, w, h = box['bbox']
-                        padding = int(h * 0.1)
-                        
-                        replacement = entity.get('label', 'REDACTED')
-                        font = cv2.FONT_HERSHEY_SIMPLEX
-                        font_scale = h / 30
-                        thickness = 1
-                        
-                        (text_w, text_h), _ = cv2.getTextSize(
-                            replacement, font, font_scale, thickness
-                        )
-                        
-                        while text_w > w and font_scale > 0.3:
-                            font_scale -= 0.1
-                            (text_w, text_h), _ = cv2.getTextSize(
-                                replacement, font, font_scale, thickness
-                            )
-                        
-                        text_x = x + (w - text_w) // 2
-                        text_y = y + (h + text_h) // 2
-                        
-                        if redact_type == "BlackOut" or redact_type=="RedactObjects":
-                            cv2.rectangle(
-                                redacted,
-                                (x - padding, y - padding),
-                                (x + w + padding, y + h + padding),
-                                (0, 0, 0),
-                                -1,
-                            )
-                            cv2.putText(
-                                redacted,
-                                "",
-                                (text_x, text_y),
-                                font,
-                                font_scale,
-                                (255, 255, 255),
-                                thickness,
-                            )
-                        
-                        elif redact_type == "Vanishing":
-                            cv2.rectangle(
-                                redacted,
-                                (x - padding, y - padding),
-                                (x + w + padding, y + h + padding),
-                                (255, 255, 255),
-                                -1,
-                            )
-                        
-                        elif redact_type == "Blurring":
-                            x1, y1 = max(0, x - padding), max(0, y - padding)
-                            x2, y2 = min(image.shape[1], x + w + padding), min(image.shape[0], y + h + padding)
-                            roi = redacted[y1:y2, x1:x2]
-                            blurred_roi = cv2.GaussianBlur(roi, (15, 15), 0)
-                            redacted[y1:y2, x1:x2] = blurred_roi
-                        
-                        elif redact_type in ["CategoryReplacement", "SyntheticReplacement"]:
-                            cv2.rectangle(
-                                redacted,
-                                (x - padding, y - padding),
-                                (x + w + padding, y + h + padding),
-                                (255, 255, 255),
-                                -1,
-                            )
-                            cv2.putText(
-                                redacted,
-                                replacement,
-                                (text_x, text_y),
-                                font,
-                                font_scale,
-                                (0, 0, 0),
-                                thickness,
-                            )
-        
-        return redacted
+    Returns:
+        Tuple of (output path, encode stats); with in_memory the upload is
+        decoded from memory and the encoded image bytes replace the path,
+        so nothing touches the disk
+    """
+    if image_pages.is_multipage_image(file.filename):
+        return process_multipage_image_redaction(
+            file, entities, redact_type, multipage_format, image_format, image_quality, pdf_profile, in_memory)
+
+    if in_memory:
+        image_content = file.read()
+        metrics.record(document_bytes=len(image_content), pages=1, entities=len(entities))
+    else:
+        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
+        file.save(file_path)
+        metrics.record(document_bytes=os.path.getsize(file_path), pages=1, entities=len(entities))
 
     try:
-        image = cv2.imread(file_path)
+        # Very large images are redacted tile by tile from a memory-mapped copy
+        source = image_content if in_memory else file_path
+        if tiled_redaction.should_tile(tiled_redaction.image_size(source)):
+            output_path = None if in_memory else os.path.join(UPLOAD_FOLDER, "redacted_image.jpg")
+            if output_path:
+                release_output_path(output_path)
+            encoded, encode_stats = tiled_redaction.redact_image(
+                source, entities, redact_type, image_format, image_quality, output_path)
+            metrics.record(output_bytes=encode_stats["output_bytes"], output_format=encode_stats["format"])
+            return (encoded if in_memory else output_path), encode_stats
+
+        with metrics.stage("image_decode"):
+            if in_memory:
+                image = cv2.imdecode(np.frombuffer(image_content, dtype=np.uint8), cv2.IMREAD_COLOR)
+            else:
+                image = cv2.imread(file_path)
         if image is None:
             raise ValueError("Failed to load image for redaction")
         
@@ -573,145 +637,299 @@ def process_image_redaction(file, entities, redact_type):
         
         redacted_image = redact_matching_text(image, text_boxes, entities, redact_type)
         
-        output_path = os.path.join(UPLOAD_FOLDER, "redacted_image.jpg")
-        cv2.imwrite(output_path, redacted_image)
+        with metrics.stage("image_save"):
+            encoded, encode_stats = output_profiles.encode_image(redacted_image, image_format, image_quality)
+            if not in_memory:
+                # Keeps the legacy filename; serving sniffs the actual format
+                output_path = os.path.join(UPLOAD_FOLDER, "redacted_image.jpg")
+                release_output_path(output_path)
+                with open(output_path, "wb") as f:
+                    f.write(encoded)
+        metrics.record(output_bytes=encode_stats["output_bytes"], output_format=encode_stats["format"])
         
-        return output_path
+        return (encoded if in_memory else output_path), encode_stats
 
     except Exception as e:
         raise Exception(f"Error in image redaction: {str(e)}")
-async def process_pdf_redaction(pdf_content, entities, redact_type):
-    with fitz.open(stream=pdf_content, filetype="pdf") as doc:
-        for page_number, page in enumerate(doc):
-            if redact_type == "Blurring":
-                for entity in entities:
-                    areas = page.search_for(entity['text']) 
-                    for area in areas:
-                        try:
-                            blur_annot = page.add_redact_annot(area, fill=(255, 255, 255)) 
-                        except Exception as e:
-                            print(f"Error blurring text on page {page_number}: {str(e)}")
-                            continue
-                page.apply_redactions() 
-            else:
-                for entity in entities:
-                    areas = page.search_for(entity['text'])
-                    cleaned_text = preprocess_text(page.get_text())
-
-                    for area in areas:
-                        try:
-                            if redact_type == "SyntheticReplacement":
-                                font_size = (area[3] - area[1]) * 0.6
-                                if not cleaned_text or not entities:
-                                    return jsonify({"error": "Invalid input data"}), 400
-                                
-                                modified_text = cleaned_text
-                                entity_text = entity["text"]
-                                label = entity["label"]
-                                
-                                context_start = max(0, modified_text.find(entity_text) - 100)
-                                context_end = min(len(modified_text), modified_text.find(entity_text) + len(entity_text) + 100)
-                                context = modified_text[context_start:context_end]
-                                print(context)
-                                completion = client.chat.completions.create(
-                                    model="hf:meta-llama/Llama-3.3-70B-Instruct",
-                                    messages=[
-                                        {"role": "system", "content": "You are a helpful assistant which generates synthetic replacements for given entities."},
-                                        {"role": "user", "content": f"Context:{context} Entity_TEXT:{entity_text} Label:{label}. Generate ONE synthetic entity similar to the entity without any additional information and text."}
-                                    ]
-                                )
-                                synthetic_replacement = completion.choices[0].message.content.strip()
-                                synthetic_replacement = synthetic_replacement.split()[0]
-                                print(synthetic_replacement)
-                                annot = page.add_redact_annot(
-                                    area, 
-                                    text=synthetic_replacement, 
-                                    text_color=(0, 0, 0), 
-                                    fontsize=font_size
-                                )
-                            else:
-                                if redact_type == "BlackOut":
-                                    annot = page.add_redact_annot(area, fill=(0, 0, 0))
-                                elif redact_type == "Vanishing":
-                                    annot = page.add_redact_annot(area, fill=(1, 1, 1))
-                                elif redact_type == "CategoryReplacement":
-                                    font_size = (area[3]-area[1])*0.6
-                                    annot = page.add_redact_annot(area, text=entity['label'], 
-                                                    text_color=(0, 0, 0), fontsize=font_size)
-                                annot.update()
-                        except Exception as e:
-                            print(f"Error processing redaction on page {page_number}: {str(e)}")
-                            continue
-                
-                page.apply_redactions()
-        
-        output_path = os.path.join(UPLOAD_FOLDER, "redacted_document.pdf")
+
+def process_multipage_image_redaction(file, entities, redact_type, output_format=None, image_format=None,
+                                      image_quality=None, pdf_profile=None, in_memory=False):
+    """
+    Redact a multi-page image one page at a time
+
+    Pages are decoded, OCRed, redacted and encoded one after another, so
+    memory stays flat regardless of the page count. The upload is read
+    from its (spooled) stream when in_memory, otherwise from the saved copy.
+
+    Returns:
+        Tuple of (output path or bytes, encode stats)
+    """
+    if in_memory:
+        source = file.stream
+        metrics.record(entities=len(entities))
+    else:
+        source = os.path.join(UPLOAD_FOLDER, file.filename)
+        file.save(source)
+        metrics.record(document_bytes=os.path.getsize(source), entities=len(entities))
+
+    def redact_page(image):
+        text_boxes = get_text_boxes(image)
+        return redact_matching_text(image, text_boxes, entities, redact_type)
+
+    try:
+        # Same legacy output path as single images; serving sniffs the format
+        output_path = None if in_memory else os.path.join(UPLOAD_FOLDER, "redacted_image.jpg")
+        if output_path:
+            release_output_path(output_path)
+        with metrics.stage("multipage_redaction"):
+            encoded, encode_stats = image_pages.redact_pages(
+                source, redact_page, output_format, output_path, image_format, image_quality, pdf_profile)
+        metrics.record(pages=encode_stats["pages"], output_bytes=encode_stats["output_bytes"],
+                       output_format=encode_stats["format"])
+        return (encoded if in_memory else output_path), encode_stats
+
+    except Exception as e:
+        raise Exception(f"Error in multi-page image redaction: {str(e)}")
+
+def redact_pdf_page(page, entities, redact_type, ocr_pages, find_areas):
+    """
+    Redact the entities on one PDF page
+
+    Raises:
+        ValueError: SyntheticReplacement on a page without text to give the
+            LLM as context
+
+    Args:
+        page: fitz page, modified in place
+        entities: Entities to redact on this page
+        redact_type: Redaction style
+        ocr_pages: OCR words of scanned pages, keyed by page number
+        find_areas: Callable(page, text) returning the areas of text on the page
+    """
+    if redact_type == "Blurring":
+        for entity in entities:
+            with metrics.stage("pdf_search"):
+                areas = find_areas(page, entity['text'])
+            for area in areas:
+                try:
+                    blur_annot = page.add_redact_annot(area, fill=(255, 255, 255)) 
+                except Exception as e:
+                    print(f"Error blurring text on page {page.number}: {str(e)}")
+                    continue
+        with metrics.stage("pdf_apply_redactions"):
+            page.apply_redactions() 
+    else:
+        for entity in entities:
+            with metrics.stage("pdf_search"):
+                areas = find_areas(page, entity['text'])
+            cleaned_text = preprocess_text(get_page_text(page, ocr_pages))
+            if redact_type == "SyntheticReplacement" and areas and not cleaned_text:
+                # Aborts the whole redaction; callers answer 400
+                raise ValueError("Invalid input data")
+
+            for area in areas:
+                try:
+                    if redact_type == "SyntheticReplacement":
+                        font_size = (area[3] - area[1]) * 0.6
+                        
+                        modified_text = cleaned_text
+                        entity_text = entity["text"]
+                        label = entity["label"]
+                        
+                        context_start = max(0, modified_text.find(entity_text) - 100)
+                        context_end = min(len(modified_text), modified_text.find(entity_text) + len(entity_text) + 100)
+                        context = modified_text[context_start:context_end]
+                        print(context)
+                        with metrics.stage("llm_synthetic_replacement"):
+                            completion = llm_backends.get_backend("synthetic").complete(
+                                [
+                                    {"role": "system", "content": "You are a helpful assistant which generates synthetic replacements for given entities."},
+                                    {"role": "user", "content": f"Context:{context} Entity_TEXT:{entity_text} Label:{label}. Generate ONE synthetic entity similar to the entity without any additional information and text."}
+                                ],
+                                role="synthetic"
+                            )
+                        synthetic_replacement = completion.strip()
+                        synthetic_replacement = synthetic_replacement.split()[0]
+                        print(synthetic_replacement)
+                        annot = page.add_redact_annot(
+                            area, 
+                            text=synthetic_replacement, 
+                            text_color=(0, 0, 0), 
+                            fontsize=font_size
+                        )
+                    else:
+                        if redact_type == "BlackOut":
+                            annot = page.add_redact_annot(area, fill=(0, 0, 0))
+                        elif redact_type == "Vanishing":
+                            annot = page.add_redact_annot(area, fill=(1, 1, 1))
+                        elif redact_type == "CategoryReplacement":
+                            font_size = (area[3]-area[1])*0.6
+                            annot = page.add_redact_annot(area, text=entity['label'], 
+                                            text_color=(0, 0, 0), fontsize=font_size)
+                        annot.update()
+                except Exception as e:
+                    print(f"Error processing redaction on page {page.number}: {str(e)}")
+                    continue
         
-        doc.save(output_path)
-        return output_path
+        with metrics.stage("pdf_apply_redactions"):
+            page.apply_redactions()
+
+@profiling.profiled
+async def process_pdf_redaction(pdf_content, entities, redact_type, pdf_profile=None, in_memory=False,
+                                incremental=False):
+    """
+    Redact a PDF
+
+    With incremental (the prompt execute loop, when INCREMENTAL_REDACTION is
+    on), repeated runs on the same document only redact the pages whose
+    entities changed (see incremental_redaction).
+
+    Returns:
+        Tuple of (output path, encode stats); with in_memory the PDF bytes
+        replace the path and nothing is written to disk
+    """
+    with fitz.open(stream=pdf_content, filetype="pdf") as doc:
+        metrics.record(document_bytes=len(pdf_content), pages=len(doc), entities=len(entities))
+        output_path = None if in_memory else os.path.join(UPLOAD_FOLDER, "redacted_document.pdf")
+        if output_path:
+            release_output_path(output_path)
+
+        if incremental:
+            def encode(output_doc, min_garbage=0):
+                with metrics.stage("pdf_save"):
+                    return output_profiles.encode_pdf(output_doc, pdf_profile, min_garbage)
+
+            redacted_pdf, encode_stats = incremental_redaction.redact(
+                doc, pdf_content, entities, redact_type,
+                redact_page=lambda page, page_entities, ocr_pages, find_areas: redact_pdf_page(
+                    page, page_entities, redact_type, ocr_pages, find_areas),
+                find_areas=find_entity_areas,
+                ocr_scan=lambda: ocr_scanned_pdf_pages(pdf_content, doc),
+                encode=encode)
+            if output_path:
+                with open(output_path, "wb") as f:
+                    f.write(redacted_pdf)
+        else:
+            ocr_pages = ocr_scanned_pdf_pages(pdf_content, doc)
+            for page in doc:
+                redact_pdf_page(page, entities, redact_type, ocr_pages,
+                                lambda page, text: find_entity_areas(page, text, ocr_pages))
+            with metrics.stage("pdf_save"):
+                if in_memory:
+                    redacted_pdf, encode_stats = output_profiles.encode_pdf(doc, pdf_profile)
+                else:
+                    encode_stats = output_profiles.save_pdf(doc, output_path, pdf_profile)
+
+        metrics.record(output_bytes=encode_stats["output_bytes"], output_profile=encode_stats["profile"])
+        return (redacted_pdf if in_memory else output_path), encode_stats
     
-# Add this new endpoint
-@app.route('/api/undoRedaction', methods=['POST'])
-def undo_redaction():
+def requested_output_options():
+    """Per-request output encoding overrides from the query string or form"""
+    def param(name):
+        return request.args.get(name) or request.form.get(name)
+    quality = param('image_quality')
+    return {
+        "pdf_profile": param('pdf_profile'),
+        "image_format": param('image_format'),
+        "image_quality": int(quality) if quality and quality.isdigit() else None,
+        "multipage_format": param('multipage_format'),
+    }
+
+
+def stream_redacted_file(data, mimetype, filename, metadata):
+    """
+    Return redacted bytes as the response body, streamed in chunks
+
+    JSON-style metadata travels in X-Redaction-* headers instead of a body.
+    """
+    def chunks():
+        view = memoryview(data)
+        for offset in range(0, len(view), STREAM_CHUNK_SIZE):
+            yield bytes(view[offset:offset + STREAM_CHUNK_SIZE])
+
+    response = Response(chunks(), mimetype=mimetype)
+    response.headers['Content-Length'] = str(len(data))
+    response.headers['Content-Disposition'] = f'inline; filename="{quote(filename)}"'
+    for key, value in metadata.items():
+        header = 'X-Redaction-' + '-'.join(part.capitalize() for part in key.split('_'))
+        response.headers[header] = quote(str(value))
+    return response
+
+
+def resolve_document_id():
+    """Document id from the request, or the id of the uploaded original's history for this owner"""
+    document_id = request.form.get('document_id') or (request.get_json(silent=True) or {}).get('document_id')
+    if document_id:
+        return document_id
     file = request.files.get('file')
-    if not file:
-        return jsonify({"error": "File not provided"}), 400
+    if file:
+        return history.document_id_for(document_store.blob_id(file.read()), request_owner())
+    return None
 
-    OTHER_FOLDER = './upload'
 
-  
+def publish_version(version):
+    """Expose a version at its document's own output path under UPLOAD_FOLDER"""
+    filename = 'redacted_document.pdf' if version['kind'] == 'pdf' else 'redacted_image.jpg'
+    path = history.publish(version['document_id'], version['blob'], filename)
+    return {
+        "document_id": version['document_id'],
+        "version_id": version['version_id'],
+        "description": version['description'],
+        "redacted_file_url": '/' + os.path.relpath(path, UPLOAD_FOLDER).replace(os.sep, '/'),
+        "version_url": f"/api/documents/{version['document_id']}/versions/{version['version_id']}"
+    }
 
-    # For images
-    if is_image_file(file.filename):
-        redacted_path = os.path.join(UPLOAD_FOLDER, 'redacted_image.jpg')
-        new_file_path = os.path.join(OTHER_FOLDER, 'new_image.jpg')  # Source file
 
-        if os.path.exists(redacted_path):
-            os.remove(redacted_path)  # Remove existing file
+@app.route('/api/undoRedaction', methods=['POST'])
+def undo_redaction():
+    document_id = resolve_document_id()
+    if not document_id:
+        return jsonify({"error": "File not provided"}), 400
 
-        if os.path.exists(new_file_path):
-            shutil.copy2(new_file_path, redacted_path)
+    if history.get_version(document_id, owner=request_owner()) is None:
+        return jsonify({"error": "No redaction history for this document"}), 404
 
-    # For PDFs
-    elif is_pdf_file(file.filename):
-        # Define the path for the redacted file (redacted_document.pdf)
-        redacted_path = os.path.join(UPLOAD_FOLDER, 'redacted_document.pdf')
-
-        # Get all files in the upload directory
-        files_in_upload = [f for f in os.listdir(OTHER_FOLDER) if os.path.isfile(os.path.join(OTHER_FOLDER, f))]
-
-        # Find the latest non-redacted file (does not contain "redacted" in the name)
-        non_redacted_files = [f for f in files_in_upload if "redacted" not in f.lower() and f.lower().endswith('.pdf')]
-        if not non_redacted_files:
-            return jsonify({"error": "No non-redacted PDF file found"}), 404
-
-        def extract_timestamp(filename):
-            match = re.match(r'(\d+)', filename)
-            if match:
-                return int(match.group(1))
-            return 0  # Fallback in case no numeric prefix is found
-        # Sort non-redacted files by timestamp (descending order to get the latest)
-        non_redacted_files.sort(key=extract_timestamp, reverse=True)
-        latest_non_redacted_file = non_redacted_files[0]  # Get the latest file based on timestamp
-
-        new_file_path = os.path.join(OTHER_FOLDER, latest_non_redacted_file)
-        print(new_file_path)
-        
-        if os.path.exists(redacted_path):
-            print("hhi")
-            os.remove(redacted_path)  # Remove existing redacted file
+    version = history.undo(document_id, request_owner())
+    if version is None:
+        return jsonify({"error": "Nothing to undo"}), 409
 
-        
-        if os.path.exists(new_file_path):
-            print("ji")
-            shutil.copy2(new_file_path, redacted_path)
+    return jsonify({
+        "message": "Redaction undone successfully",
+        **publish_version(history.get_version(document_id, version['version_id']))
+    }), 200
 
-    else:
-        return jsonify({"error": "Unsupported file type"}), 400
+
+@app.route('/api/redoRedaction', methods=['POST'])
+def redo_redaction():
+    document_id = resolve_document_id()
+    if not document_id:
+        return jsonify({"error": "File not provided"}), 400
+
+    version = history.redo(document_id, request_owner())
+    if version is None:
+        return jsonify({"error": "Nothing to redo"}), 409
 
     return jsonify({
-        "message": "Redaction undone successfully"
-    }),200
+        "message": "Redaction redone successfully",
+        **publish_version(history.get_version(document_id, version['version_id']))
+    }), 200
+
+
+@app.route('/api/documents/<document_id>/versions/<version_id>', methods=['GET'])
+def get_document_version(document_id, version_id):
+    """Serve one stored version of a document"""
+    version = history.get_version(document_id, version_id, owner=request_owner())
+    if version is None:
+        return jsonify({"error": "Version not found"}), 404
+    if version['kind'] == 'pdf':
+        mimetype = 'application/pdf'
+    else:
+        mimetype = redacted_image_mimetype(document_store.blob_path(version['blob']))
+    return send_from_directory(
+        os.path.abspath(os.path.dirname(document_store.blob_path(version['blob']))),
+        version['blob'],
+        mimetype=mimetype
+    )
  
 
 @app.route('/api/redactEntity', methods=['POST'])
@@ -724,24 +942,43 @@ async def redact_entity():
     entities = json.loads(request.form.get('entities', '[]'))
    
     redact_type = request.args.get('type', 'BlackOut')
+    document_id = request.form.get('document_id')
+    description = f"{redact_type}: {len(entities)} entities"
+    output_options = requested_output_options()
     print(redact_type)
     if is_image_file(file.filename):
-        output_path =process_image_redaction(file, entities,redact_type)
+        original_content = file.read()
+        file.seek(0)
+        output_path, encode_stats = process_image_redaction(
+            file, entities, redact_type, output_options['image_format'], output_options['image_quality'],
+            multipage_format=output_options['multipage_format'], pdf_profile=output_options['pdf_profile'])
+        version = record_redaction_version(original_content, output_path, "image", description, document_id)
         redacted_url = url_for('static', 
                                 filename=f"../public/redacted_image.jpg", 
                                 _external=True)
         return jsonify({
             "message": "Image redacted successfully",
-            "redacted_file_url": redacted_url
+            "redacted_file_url": redacted_url,
+            "document_id": version['document_id'],
+            "version_id": version['version_id'],
+            "encoding": encode_stats
         }), 200
         
     elif is_pdf_file(file.filename):
         pdf_content = file.read()
-        output_path =await  process_pdf_redaction(pdf_content, entities, redact_type)
+        try:
+            output_path, encode_stats = await process_pdf_redaction(
+                pdf_content, entities, redact_type, output_options['pdf_profile'])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        version = record_redaction_version(pdf_content, output_path, "pdf", description, document_id)
         print("hiiii")
         return jsonify({
             "message": "PDF redacted successfully",
-            "output_file": os.path.basename(output_path)
+            "output_file": os.path.basename(output_path),
+            "document_id": version['document_id'],
+            "version_id": version['version_id'],
+            "encoding": encode_stats
         }), 200
 
 
@@ -820,6 +1057,114 @@ def save_manual_pdf_redaction():
         }), 500
 
 
+# Fill colours for manual PDF redaction styles. Blur and pixelate have no
+# vector equivalent, and the content is removed either way, so they get grey.
+MANUAL_PDF_FILLS = {
+    "blackout": (0, 0, 0),
+    "whiteout": (1, 1, 1),
+    "blur": (0.5, 0.5, 0.5),
+    "pixelate": (0.5, 0.5, 0.5),
+}
+
+
+def manual_redaction_rect(page, redaction):
+    """
+    Convert a page-relative redaction into a rect in PDF page space
+
+    x, y, width and height are fractions (0-1) of the page as displayed,
+    so they do not depend on the scale the browser rendered it at.
+    Freehand shapes may send points instead; their bounding box is used.
+    """
+    points = redaction.get('points')
+    if points:
+        xs = [float(p['x']) for p in points]
+        ys = [float(p['y']) for p in points]
+        x0, y0, x1, y1 = min(xs), min(ys), max(xs), max(ys)
+    else:
+        x0, y0 = float(redaction['x']), float(redaction['y'])
+        x1, y1 = x0 + float(redaction['width']), y0 + float(redaction['height'])
+    width, height = page.rect.width, page.rect.height
+    rect = fitz.Rect(x0 * width, y0 * height, x1 * width, y1 * height)
+    # Displayed coordinates include page rotation; annotations use unrotated space
+    return rect * page.derotation_matrix
+
+
+def apply_manual_pdf_redactions(pdf_content, redactions, pdf_profile=None):
+    """
+    Apply page-relative rectangles as true redactions
+
+    Returns:
+        Tuple of (PDF bytes encoded with the output profile, encode stats)
+    """
+    by_page = {}
+    for redaction in redactions:
+        by_page.setdefault(int(redaction['page']), []).append(redaction)
+
+    with fitz.open(stream=pdf_content, filetype="pdf") as doc:
+        for page_number, page_redactions in sorted(by_page.items()):
+            if not 1 <= page_number <= len(doc):
+                raise ValueError(f"Page {page_number} is out of range (1-{len(doc)})")
+            page = doc[page_number - 1]
+            for redaction in page_redactions:
+                fill = MANUAL_PDF_FILLS.get(redaction.get('style', 'blackout'), (0, 0, 0))
+                page.add_redact_annot(manual_redaction_rect(page, redaction), fill=fill)
+            with metrics.stage("pdf_apply_redactions"):
+                page.apply_redactions()
+        with metrics.stage("pdf_save"):
+            return output_profiles.encode_pdf(doc, pdf_profile)
+
+
+@app.route('/api/manualPDFRedaction', methods=['POST'])
+def manual_pdf_redaction():
+    """
+    Apply manual redactions to a PDF server-side and return the redacted PDF
+
+    Expects either the original PDF as 'file' or a 'document_id' from an
+    earlier upload, plus 'redactions': a JSON list of
+    {"page", "x", "y", "width", "height", "style"} with page-relative
+    coordinates. The response body is the PDF itself.
+    """
+    try:
+        file = request.files.get('file')
+        if file and file.filename:
+            if not is_pdf_file(file.filename):
+                return jsonify({"error": "Unsupported file type"}), 400
+            pdf_content = file.read()
+            document_id = document_store.put_blob(pdf_content)
+            history.maybe_collect_garbage()
+        else:
+            document_id = request.form.get('document_id', '')
+            pdf_content = document_store.get_blob(document_id)
+            if pdf_content is None:
+                return jsonify({"error": "Provide a PDF file or a known document_id"}), 400
+
+        redactions = json.loads(request.form.get('redactions', '[]'))
+        if not isinstance(redactions, list) or not redactions:
+            return jsonify({"error": "No redactions provided"}), 400
+
+        metrics.record(document_bytes=len(pdf_content), entities=len(redactions))
+        try:
+            redacted_pdf, encode_stats = apply_manual_pdf_redactions(
+                pdf_content, redactions, requested_output_options()['pdf_profile'])
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid redactions: {str(e)}"}), 400
+        metrics.record(output_bytes=encode_stats["output_bytes"], output_profile=encode_stats["profile"])
+
+        original_filename = file.filename if file else 'document.pdf'
+        response = Response(redacted_pdf, mimetype='application/pdf')
+        response.headers['Content-Disposition'] = f'attachment; filename="redacted_{os.path.basename(original_filename)}"'
+        response.headers['X-Document-Id'] = document_id
+        response.headers['X-Redaction-Count'] = str(len(redactions))
+        response.headers['X-Redaction-Encode-Ms'] = str(encode_stats['encode_ms'])
+        response.headers['X-Redaction-Output-Bytes'] = str(encode_stats['output_bytes'])
+        return response
+
+    except Exception as e:
+        return jsonify({
+            "error": f"Error applying manual PDF redaction: {str(e)}"
+        }), 500
+
+
 # ==================== PROMPT-BASED REDACTION ENDPOINTS ====================
 
 @app.route('/api/promptRedaction/analyze', methods=['POST'])
@@ -841,9 +1186,15 @@ def prompt_redaction_analyze():
         if not user_intent:
             return jsonify({"error": "No redaction intent provided"}), 400
 
+        # Not "profile": that query parameter requests a profiler run (profiling.py)
+        profile_override = request.args.get('label_profile') or request.form.get('label_profile')
+        if profile_override and profile_override not in document_router.profile_names():
+            return jsonify({"error": f"Unknown label_profile '{profile_override}'. Use one of: {', '.join(document_router.profile_names())}"}), 400
+
         # Save and extract text from file
         temp_path = os.path.join(UPLOAD_FOLDER, file.filename)
         file.save(temp_path)
+        metrics.record(document_bytes=os.path.getsize(temp_path))
 
         if is_image_file(file.filename):
             extracted_text = extract_text_from_image(temp_path)
@@ -859,14 +1210,17 @@ def prompt_redaction_analyze():
             os.remove(temp_path)
             return jsonify({"error": "No text could be extracted from the file"}), 400
 
-        cleaned_text = preprocess_text(extracted_text)
+        normalized = normalization.preprocess(extracted_text)
+        cleaned_text = normalized.text
 
         # Step 1: Analyze with LLM based on user intent
         print(f"Analyzing intent: {user_intent}")
         redaction_plan = analyze_intent(user_intent, cleaned_text)
         
-        # Step 2: Also run GLiNER for additional entity detection
-        gliner_entities = model.predict_entities(cleaned_text, labels, threshold=0.5)
+        # Step 2: Also run GLiNER for additional entity detection, with the
+        # same label profile /api/entities picks for this document
+        profile, profile_labels = document_router.route(cleaned_text, labels, profile_override)
+        gliner_entities = predict_entities(cleaned_text, profile_labels, normalized=normalized)
         
         # Step 3: Refine the plan by combining both approaches
         refined_plan = refine_with_gliner(redaction_plan, gliner_entities)
@@ -885,6 +1239,7 @@ def prompt_redaction_analyze():
             }
             for entity in final_plan.entities
         ]
+        metrics.record(entities=len(entities_response))
 
         # Keep the file for redaction
         return jsonify({
@@ -894,6 +1249,7 @@ def prompt_redaction_analyze():
             "redaction_strategy": final_plan.redaction_strategy,
             "summary": final_plan.summary,
             "extractedText": cleaned_text,
+            "label_profile": profile,
             "total_entities": len(entities_response)
         }), 200
 
@@ -964,27 +1320,29 @@ def prompt_redaction_preview():
         if not text or not entities:
             return jsonify({"error": "Missing text or entities"}), 400
 
-        # Create HTML preview with highlighted entities
-        highlighted_text = text
-        offset = 0
-        
-        # Sort entities by position in text
+        # Entities are located after normalization (case, whitespace, date
+        # separators) and highlighted on the matching span of the original text
+        normalized = normalization.normalize_for_matching(text)
         entities_with_pos = []
         for entity in entities:
-            pos = text.find(entity['text'])
-            if pos != -1:
+            match = next(normalized.find_all(normalize_text(entity['text'])), None)
+            if match is not None:
+                start, end = normalized.to_original(*match)
                 entities_with_pos.append({
                     'entity': entity,
-                    'position': pos
+                    'start': start,
+                    'end': end
                 })
         
-        entities_with_pos.sort(key=lambda x: x['position'])
+        entities_with_pos.sort(key=lambda x: x['start'])
         
-        # Add HTML spans around each entity
+        # Add HTML spans around each entity, skipping overlaps
+        parts = []
+        position = 0
         for item in entities_with_pos:
             entity = item['entity']
-            pos = item['position'] + offset
-            entity_text = entity['text']
+            if item['start'] < position:
+                continue
             
             # Color code by confidence
             if entity['confidence'] >= 0.9:
@@ -994,19 +1352,15 @@ def prompt_redaction_preview():
             else:
                 color = 'rgba(234, 179, 8, 0.3)'  # yellow-500
             
-            replacement = (
+            parts.append(text[position:item['start']])
+            parts.append(
                 f'<span style="background-color: {color}; padding: 2px 4px; border-radius: 3px; '
                 f'cursor: help;" title="{entity["label"]} - {entity["reason"]} (Confidence: {entity["confidence"]:.0%})">'
-                f'{entity_text}</span>'
+                f'{text[item["start"]:item["end"]]}</span>'
             )
-            
-            highlighted_text = (
-                highlighted_text[:pos] + 
-                replacement + 
-                highlighted_text[pos + len(entity_text):]
-            )
-            
-            offset += len(replacement) - len(entity_text)
+            position = item['end']
+        parts.append(text[position:])
+        highlighted_text = "".join(parts)
 
         return jsonify({
             "message": "Preview generated successfully",
@@ -1025,6 +1379,8 @@ async def prompt_redaction_execute():
     """
     Execute the redaction based on the finalized plan
     Returns the redacted file in the same format as input (PDF->PDF, Image->Image)
+    With mode=stream the file is the response body (nothing is written to
+    ../public) and the metadata is sent as X-Redaction-* headers
     """
     try:
         file = request.files.get('file')
@@ -1034,10 +1390,36 @@ async def prompt_redaction_execute():
         entities = json.loads(request.form.get('entities', '[]'))
         redact_type = request.form.get('type', 'BlackOut')
         original_filename = file.filename
+        output_options = requested_output_options()
+        # mode=stream returns the redacted file itself, with metadata in headers
+        stream = request.form.get('mode') == 'stream'
+
+        if stream and (is_image_file(file.filename) or is_pdf_file(file.filename)):
+            if is_image_file(file.filename):
+                redacted, encode_stats = process_image_redaction(
+                    file, entities, redact_type, output_options['image_format'],
+                    output_options['image_quality'], in_memory=True,
+                    multipage_format=output_options['multipage_format'], pdf_profile=output_options['pdf_profile'])
+                file_type, mimetype = "image", encode_stats['mimetype']
+                filename = f"redacted_image{encode_stats['extension']}"
+            else:
+                redacted, encode_stats = await process_pdf_redaction(
+                    file.read(), entities, redact_type, output_options['pdf_profile'], in_memory=True,
+                    incremental=incremental_redaction.INCREMENTAL_REDACTION)
+                file_type, mimetype, filename = "pdf", 'application/pdf', 'redacted_document.pdf'
+            return stream_redacted_file(redacted, mimetype, filename, {
+                "file_type": file_type,
+                "total_redactions": len(entities),
+                "original_filename": original_filename,
+                "encode_ms": encode_stats['encode_ms'],
+                "output_bytes": encode_stats['output_bytes'],
+            })
         
         # Use existing redaction logic
         if is_image_file(file.filename):
-            output_path = process_image_redaction(file, entities, redact_type)
+            output_path, encode_stats = process_image_redaction(
+                file, entities, redact_type, output_options['image_format'], output_options['image_quality'],
+                multipage_format=output_options['multipage_format'], pdf_profile=output_options['pdf_profile'])
             # For images, provide the direct file path endpoint
             redacted_url = "/redacted_image.jpg"
             return jsonify({
@@ -1046,12 +1428,15 @@ async def prompt_redaction_execute():
                 "output_path": output_path,
                 "file_type": "image",
                 "total_redactions": len(entities),
-                "original_filename": original_filename
+                "original_filename": original_filename,
+                "encoding": encode_stats
             }), 200
             
         elif is_pdf_file(file.filename):
             pdf_content = file.read()
-            output_path = await process_pdf_redaction(pdf_content, entities, redact_type)
+            output_path, encode_stats = await process_pdf_redaction(
+                pdf_content, entities, redact_type, output_options['pdf_profile'],
+                incremental=incremental_redaction.INCREMENTAL_REDACTION)
             
             # For PDF, provide the direct file path endpoint
             redacted_url = "/redacted_document.pdf"
@@ -1063,12 +1448,15 @@ async def prompt_redaction_execute():
                 "output_path": output_path,
                 "file_type": "pdf",
                 "total_redactions": len(entities),
-                "original_filename": original_filename
+                "original_filename": original_filename,
+                "encoding": encode_stats
             }), 200
         
         else:
             return jsonify({"error": "Unsupported file type"}), 400
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error executing redaction: {str(e)}")
         import traceback
@@ -1099,12 +1487,14 @@ def download_prompt_redacted_file(file_type):
             file_path = os.path.join(UPLOAD_FOLDER, 'redacted_image.jpg')
             if not os.path.exists(file_path):
                 return jsonify({"error": "Redacted image not found"}), 404
+            mimetype = redacted_image_mimetype(file_path)
+            extension = mimetypes.guess_extension(mimetype) or '.jpg'
             return send_from_directory(
                 UPLOAD_FOLDER,
                 'redacted_image.jpg',
                 as_attachment=True,
-                download_name='redacted_image.jpg',
-                mimetype='image/jpeg'
+                download_name=f'redacted_image{extension}',
+                mimetype=mimetype
             )
         else:
             return jsonify({"error": "Invalid file type"}), 400
@@ -1141,7 +1531,7 @@ def serve_redacted_image():
         return send_from_directory(
             UPLOAD_FOLDER,
             'redacted_image.jpg',
-            mimetype='image/jpeg'
+            mimetype=redacted_image_mimetype(file_path)
         )
     except Exception as e:
         print(f"Error serving image: {str(e)}")
@@ -1151,6 +1541,29 @@ def serve_redacted_image():
 # ==================== END PROMPT-BASED REDACTION ====================
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose pipeline metrics in Prometheus text format"""
+    return Response(metrics.render_prometheus(), mimetype=metrics.CONTENT_TYPE)
+
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """Download a saved request profile (.pstats or collapsed stacks)"""
+    if not profiling.is_authorized(request.headers.get('X-Admin-Token')):
+        return jsonify({"error": "Unauthorized"}), 403
+
+    path = profiling.find_artifact(profile_id)
+    if not path:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_from_directory(
+        os.path.abspath(profiling.PROFILE_DIR),
+        os.path.basename(path),
+        as_attachment=True,
+        mimetype='application/octet-stream'
+    )
+
+
 
 
 
@@ -0,0 +1,119 @@
+"""
+Measure per-worker memory of the GLiNER model
+Starts N worker processes the way the server would, has each run a few
+inferences so the weights are actually touched, and reports every worker's
+resident, shared, private and proportional (PSS) memory while all of them
+are alive. Comparing runs with and without memory-mapped weights, or with
+and without a preloading parent, shows how many workers fit on a node.
+
+    python measure_memory.py --workers 4
+    python measure_memory.py --workers 4 --no-mmap
+    python measure_memory.py --workers 4 --start independent --node-memory-gb 16
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+
+SAMPLE_TEXT = (
+    "John Smith (john.smith@example.com) joined Acme Corp in Hyderabad on 12 March 2021 "
+    "as a Senior Engineer. His employee id is EMP-20391 and his manager is Priya Sharma."
+)
+SAMPLE_LABELS = ["PERSON_NAME", "ORGANIZATION_NAME", "CITY", "JOB_TITLE", "ID_NUMBER", "DATE"]
+
+_model = None
+
+
+def _load(model_name):
+    import model_loading
+    return model_loading.load_gliner(model_name)
+
+
+def _worker(index, model_name, inferences, results, done):
+    import memory_usage
+
+    model = _model if _model is not None else _load(model_name)
+    for _ in range(inferences):
+        model.predict_entities(SAMPLE_TEXT, SAMPLE_LABELS, threshold=0.5)
+    results.put({"worker": index, "pid": os.getpid(), **(memory_usage.read_memory() or {})})
+    # Stay alive until every worker has reported so shared pages are counted together
+    done.wait()
+
+
+def run(workers, model_name, start, inferences):
+    """Start workers, collect their memory readings and return them with the parent's"""
+    global _model
+    import memory_usage
+
+    if start == "fork":
+        _model = _load(model_name)
+        context = mp.get_context("fork")
+    else:
+        context = mp.get_context("spawn")
+
+    results, done = context.Queue(), context.Event()
+    processes = [context.Process(target=_worker, args=(i, model_name, inferences, results, done))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    readings = sorted((results.get() for _ in processes), key=lambda r: r["worker"])
+    parent = memory_usage.read_memory()
+    done.set()
+    for process in processes:
+        process.join()
+    return parent, readings
+
+
+def summarize(parent, readings, node_memory_gb=None):
+    mib = 1024
+    avg_private = sum(r["private_kb"] for r in readings) / len(readings) / mib
+    max_shared = max(r["shared_kb"] for r in readings) / mib
+    total_pss = sum(r["pss_kb"] for r in readings) / mib + (parent or {}).get("pss_kb", 0) / mib
+    summary = {
+        "workers": len(readings),
+        "avg_private_mib": round(avg_private, 1),
+        "max_shared_mib": round(max_shared, 1),
+        "total_pss_mib": round(total_pss, 1),
+    }
+    if node_memory_gb:
+        # Shared pages are paid once; every additional worker costs its private memory
+        budget = node_memory_gb * 1024 - max_shared
+        summary["max_workers_per_node"] = int(budget // avg_private) if avg_private else None
+    return summary
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Per-worker private vs shared memory of the GLiNER model")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--model", default=os.getenv("GLINER_MODEL", "knowledgator/gliner-multitask-large-v0.5"))
+    parser.add_argument("--start", choices=("fork", "independent"), default="fork",
+                        help="fork from a parent that preloaded the model (gunicorn preload) "
+                             "or load the model in every worker (separate batch processes)")
+    parser.add_argument("--no-mmap", action="store_true", help="Load weights into private memory")
+    parser.add_argument("--inferences", type=int, default=3, help="Inferences per worker before measuring")
+    parser.add_argument("--node-memory-gb", type=float, help="Estimate how many workers fit in this much memory")
+    parser.add_argument("--output", help="Write the readings as JSON to this file")
+    args = parser.parse_args(argv)
+
+    # Read by model_loading at import, in this process and in spawned workers
+    os.environ["GLINER_MMAP_WEIGHTS"] = "0" if args.no_mmap else os.getenv("GLINER_MMAP_WEIGHTS", "auto")
+
+    parent, readings = run(args.workers, args.model, args.start, args.inferences)
+    summary = summarize(parent, readings, args.node_memory_gb)
+
+    print(f"{'worker':>6} {'pid':>8} {'rss MiB':>9} {'shared MiB':>11} {'private MiB':>12} {'pss MiB':>9}")
+    for r in readings:
+        print(f"{r['worker']:>6} {r['pid']:>8} {r['rss_kb'] / 1024:>9.1f} {r['shared_kb'] / 1024:>11.1f} "
+              f"{r['private_kb'] / 1024:>12.1f} {r['pss_kb'] / 1024:>9.1f}")
+    print(json.dumps(summary, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "parent": parent, "workers": readings, "summary": summary}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,60 @@
+"""
+Per-process memory accounting
+Reads resident, shared, private and proportional set sizes from /proc so
+the serving entry point and measurement scripts can show how much of each
+worker's memory is shared copy-on-write with its parent.
+"""
+
+import os
+from typing import Dict, Optional, Union
+
+Pid = Union[int, str]
+
+
+def _read_kb_fields(path: str) -> Dict[str, int]:
+    fields = {}
+    with open(path) as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            parts = rest.split()
+            if len(parts) == 2 and parts[1] == "kB":
+                fields[name] = int(parts[0])
+    return fields
+
+
+def read_memory(pid: Pid = "self") -> Optional[Dict[str, int]]:
+    """
+    Memory of a process in KiB
+
+    Returns:
+        Dict with rss_kb, shared_kb, private_kb and pss_kb (pss is only
+        available with smaps_rollup), or None where /proc is unavailable
+    """
+    try:
+        fields = _read_kb_fields(f"/proc/{pid}/smaps_rollup")
+        shared = fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)
+        private = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+        return {"rss_kb": fields.get("Rss", 0), "shared_kb": shared,
+                "private_kb": private, "pss_kb": fields.get("Pss", 0)}
+    except OSError:
+        pass
+    try:
+        fields = _read_kb_fields(f"/proc/{pid}/status")
+    except OSError:
+        return None
+    # Older kernels: file-backed and shmem pages approximate sharing
+    shared = fields.get("RssFile", 0) + fields.get("RssShmem", 0)
+    rss = fields.get("VmRSS", 0)
+    return {"rss_kb": rss, "shared_kb": shared, "private_kb": rss - shared, "pss_kb": 0}
+
+
+def format_memory(memory: Optional[Dict[str, int]]) -> str:
+    if memory is None:
+        return "memory unavailable"
+    return " ".join(f"{key[:-3]}={value / 1024:.1f}MiB" for key, value in memory.items())
+
+
+def report(label: str, pid: Pid = "self"):
+    """Print one memory line for a process"""
+    pid_text = os.getpid() if pid == "self" else pid
+    print(f"[memory] {label} pid={pid_text} {format_memory(read_memory(pid))}", flush=True)
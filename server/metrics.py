@@ -0,0 +1,298 @@
+"""
+Lightweight instrumentation for the redaction pipeline
+Times pipeline stages, counts events and exposes everything in Prometheus
+text format. Each Flask request also gets a request id and a structured
+JSON log line summarising its stages and document attributes.
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+NAMESPACE = "secureflow"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (10_000, 100_000, 500_000, 1_000_000, 5_000_000, 20_000_000, 100_000_000)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+logger = logging.getLogger("secureflow.requests")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                yield f"{self.name}{_format_labels(key)} {value}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [bucket counts..., sum, count]
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    yield f"{self.name}_bucket{_format_labels(key, ('le', repr(float(bound))))} {count}"
+                yield f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {series[-1]}"
+                yield f"{self.name}_sum{_format_labels(key)} {series[-2]}"
+                yield f"{self.name}_count{_format_labels(key)} {series[-1]}"
+
+
+# ==================== METRIC REGISTRY ====================
+
+REQUEST_DURATION = Histogram(f"{NAMESPACE}_request_duration_seconds",
+                             "End-to-end HTTP request latency", DURATION_BUCKETS)
+REQUESTS_TOTAL = Counter(f"{NAMESPACE}_requests_total", "HTTP requests by endpoint and status")
+STAGE_DURATION = Histogram(f"{NAMESPACE}_stage_duration_seconds",
+                           "Time spent per pipeline stage (summed within a request)", DURATION_BUCKETS)
+STAGE_CALLS = Counter(f"{NAMESPACE}_stage_calls_total", "Number of times each pipeline stage ran")
+DOCUMENT_BYTES = Histogram(f"{NAMESPACE}_document_bytes", "Size of uploaded documents", BYTES_BUCKETS)
+DOCUMENT_PAGES = Histogram(f"{NAMESPACE}_document_pages", "Pages per processed document", COUNT_BUCKETS)
+ENTITIES = Histogram(f"{NAMESPACE}_entities", "Entities detected or redacted per request", COUNT_BUCKETS)
+CACHE_REQUESTS = Counter(f"{NAMESPACE}_cache_requests_total", "Cache lookups by cache and result")
+
+REGISTRY = [
+    REQUEST_DURATION, REQUESTS_TOTAL, STAGE_DURATION, STAGE_CALLS,
+    DOCUMENT_BYTES, DOCUMENT_PAGES, ENTITIES, CACHE_REQUESTS,
+]
+
+
+def register(metric):
+    """Add a metric defined elsewhere to the /metrics output"""
+    REGISTRY.append(metric)
+    return metric
+
+
+def render_prometheus() -> str:
+    """Render every registered metric in Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ==================== PER-REQUEST CONTEXT ====================
+
+class RequestContext:
+    """Stage timings and attributes accumulated during one request"""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.stage_calls: Dict[str, int] = {}
+        self.attributes: Dict[str, object] = {}
+
+
+_current: ContextVar[Optional[RequestContext]] = ContextVar("secureflow_request", default=None)
+
+
+def current_request_id() -> Optional[str]:
+    ctx = _current.get()
+    return ctx.request_id if ctx else None
+
+
+# Extra observer of stage timings in the current context (see stage_hook)
+_stage_hook: ContextVar[Optional[Callable[[str, float], None]]] = ContextVar(
+    "secureflow_stage_hook", default=None)
+
+
+def _record_stage(name: str, elapsed: float):
+    STAGE_CALLS.inc(stage=name)
+    hook = _stage_hook.get()
+    if hook is not None:
+        hook(name, elapsed)
+    ctx = _current.get()
+    if ctx is None:
+        STAGE_DURATION.observe(elapsed, stage=name)
+        return
+    ctx.stages[name] = ctx.stages.get(name, 0.0) + elapsed
+    ctx.stage_calls[name] = ctx.stage_calls.get(name, 0) + 1
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a block of pipeline work
+
+    Inside a request, repeated calls of the same stage are summed and
+    observed once when the request finishes, so per-page loops do not
+    flood the histogram.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_stage(name, time.perf_counter() - start)
+
+
+@contextmanager
+def stage_hook(callback: Callable[[str, float], None]):
+    """
+    Also pass every stage timed in this context to callback(name, seconds)
+
+    Used by benchmark.py to time the stages of the real pipeline functions.
+    The hook is context-local, so concurrent threads do not see each
+    other's stages.
+    """
+    token = _stage_hook.set(callback)
+    try:
+        yield
+    finally:
+        _stage_hook.reset(token)
+
+
+def timed(name: str):
+    """Decorator form of stage()"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(**attributes):
+    """
+    Attach document attributes to the current request
+
+    Known numeric attributes (document_bytes, pages, entities) also feed
+    their histograms.
+    """
+    if "document_bytes" in attributes:
+        DOCUMENT_BYTES.observe(attributes["document_bytes"])
+    if "pages" in attributes:
+        DOCUMENT_PAGES.observe(attributes["pages"])
+    if "entities" in attributes:
+        ENTITIES.observe(attributes["entities"])
+    ctx = _current.get()
+    if ctx is not None:
+        ctx.attributes.update(attributes)
+
+
+def cache_lookup(cache: str, hit: bool):
+    """Count a cache hit or miss, also tallied on the current request"""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+    ctx = _current.get()
+    if ctx is not None:
+        key = "cache_hits" if hit else "cache_misses"
+        ctx.attributes[key] = ctx.attributes.get(key, 0) + 1
+
+
+# ==================== FLASK INTEGRATION ====================
+
+def init_app(app):
+    """Install request-id handling, per-request timing and structured logging"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request():
+        request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+        ctx = RequestContext(request_id)
+        g.metrics_ctx = ctx
+        g.metrics_token = _current.set(ctx)
+
+    @app.after_request
+    def _finish_request(response):
+        ctx = g.pop("metrics_ctx", None)
+        if ctx is None:
+            return response
+        elapsed = time.perf_counter() - ctx.started
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        if endpoint != "/metrics":
+            REQUEST_DURATION.observe(elapsed, endpoint=endpoint)
+            REQUESTS_TOTAL.inc(endpoint=endpoint, status=response.status_code)
+            for name, total in ctx.stages.items():
+                STAGE_DURATION.observe(total, stage=name)
+            logger.info(json.dumps({
+                "event": "request",
+                "request_id": ctx.request_id,
+                "method": request.method,
+                "endpoint": endpoint,
+                "status": response.status_code,
+                "duration_ms": round(elapsed * 1000, 2),
+                "stages_ms": {k: round(v * 1000, 2) for k, v in ctx.stages.items()},
+                "stage_calls": ctx.stage_calls,
+                **ctx.attributes,
+            }, default=str))
+        response.headers["X-Request-ID"] = ctx.request_id
+        return response
+
+    @app.teardown_request
+    def _reset_context(_exc):
+        token = g.pop("metrics_token", None)
+        if token is not None:
+            try:
+                _current.reset(token)
+            except ValueError:
+                # Async views run in a different context; nothing to reset there
+                _current.set(None)
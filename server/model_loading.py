@@ -0,0 +1,203 @@
+"""
+GLiNER loading with memory-mapped weights
+When a local safetensors checkpoint is available, the model's parameters are
+replaced by read-only views of a shared memory map of that file. Every
+worker or batch process on the node then reads the same page-cache copy of
+the weights instead of holding a private one, whether or not it was forked
+from a preloaded parent.
+
+Checkpoints that only ship pytorch_model.bin can be converted once:
+
+    python model_loading.py --export ./models/gliner
+"""
+
+import argparse
+import ctypes
+import gc
+import json
+import os
+import struct
+import warnings
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# "auto" maps when a safetensors file is found, "1" requires it, "0" disables
+GLINER_MMAP_WEIGHTS = os.getenv("GLINER_MMAP_WEIGHTS", "auto").lower()
+# Explicit checkpoint path; otherwise looked up next to the model or in the HF cache
+GLINER_WEIGHTS_FILE = os.getenv("GLINER_WEIGHTS_FILE", "")
+WEIGHTS_FILENAME = "model.safetensors"
+# Below this share of the model's tensors found in the checkpoint (e.g. a
+# different key prefix), mapping is refused rather than half-applied
+MIN_MAPPED_FRACTION = 0.5
+
+# safetensors dtype -> (numpy dtype used to map the bytes, torch dtype name to view as)
+_DTYPES = {
+    "F64": (np.float64, None),
+    "F32": (np.float32, None),
+    "F16": (np.float16, None),
+    "BF16": (np.int16, "bfloat16"),
+    "I64": (np.int64, None),
+    "I32": (np.int32, None),
+    "I16": (np.int16, None),
+    "I8": (np.int8, None),
+    "U8": (np.uint8, None),
+    "BOOL": (np.bool_, None),
+}
+
+
+def read_safetensors_header(path: str) -> Tuple[Dict, int]:
+    """
+    Parse a safetensors header
+
+    Returns:
+        Tuple of (header dict, byte offset where tensor data starts)
+    """
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    return header, 8 + header_size
+
+
+def mmap_safetensors(path: str) -> Dict[str, "torch.Tensor"]:
+    """
+    Map every tensor of a safetensors file as a read-only, zero-copy tensor
+
+    The file is mapped once with PROT_READ/MAP_SHARED, so its pages live in
+    the page cache and are shared by all processes mapping the same file.
+    """
+    import torch
+
+    header, data_start = read_safetensors_header(path)
+    metadata = header.pop("__metadata__", None) or {}
+    mapped = np.memmap(path, dtype=np.uint8, mode="r")
+
+    tensors = {}
+    with warnings.catch_warnings():
+        # torch warns that the buffer is not writable; that is the point
+        warnings.simplefilter("ignore", UserWarning)
+        for name, info in header.items():
+            np_dtype, torch_view = _DTYPES[info["dtype"]]
+            begin, end = info["data_offsets"]
+            array = mapped[data_start + begin:data_start + end].view(np_dtype).reshape(info["shape"])
+            tensor = torch.from_numpy(array)
+            if torch_view:
+                tensor = tensor.view(getattr(torch, torch_view))
+            tensors[name] = tensor
+
+    # save_model stores tied tensors once, recording omitted names in metadata
+    for omitted_name, saved_name in metadata.items():
+        if omitted_name not in tensors and saved_name in tensors:
+            tensors[omitted_name] = tensors[saved_name]
+    return tensors
+
+
+def find_weights_file(model_name: str) -> Optional[str]:
+    """Local safetensors checkpoint for a model name or directory, if any"""
+    if GLINER_WEIGHTS_FILE:
+        return GLINER_WEIGHTS_FILE
+    local = os.path.join(model_name, WEIGHTS_FILENAME)
+    if os.path.isfile(local):
+        return local
+    try:
+        from huggingface_hub import try_to_load_from_cache
+    except ImportError:
+        return None
+    cached = try_to_load_from_cache(model_name, WEIGHTS_FILENAME)
+    return cached if isinstance(cached, str) and os.path.isfile(cached) else None
+
+
+def _release_freed_memory():
+    """Return heap pages freed by the replaced parameters to the OS (glibc only)"""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def load_gliner(model_name: str):
+    """
+    Load a GLiNER model, memory-mapping its weights when possible
+
+    Args:
+        model_name: Hugging Face model id or local directory
+
+    Returns:
+        The GLiNER model in eval mode
+    """
+    from gliner import GLiNER
+
+    model = GLiNER.from_pretrained(model_name)
+    model.eval()
+    if GLINER_MMAP_WEIGHTS == "0":
+        return model
+
+    weights_file = find_weights_file(model_name)
+    if weights_file is None:
+        if GLINER_MMAP_WEIGHTS == "1":
+            raise FileNotFoundError(
+                f"GLINER_MMAP_WEIGHTS=1 but no {WEIGHTS_FILENAME} found for {model_name}; "
+                f"export one with: python model_loading.py --export <dir>")
+        print(f"No local {WEIGHTS_FILENAME} for {model_name}; weights are not memory-mapped")
+        return model
+
+    state_dict = mmap_safetensors(weights_file)
+    expected = model.model.state_dict().keys()
+    matched = [name for name in expected if name in state_dict]
+    if len(matched) < MIN_MAPPED_FRACTION * len(expected):
+        unexpected = [name for name in state_dict if name not in expected]
+        message = (f"{weights_file} holds {len(matched)} of the {len(expected)} tensors of {model_name} "
+                   f"(checkpoint keys look like {', '.join(unexpected[:3]) or 'nothing'}); "
+                   f"re-export it with: python model_loading.py --export <dir>")
+        if GLINER_MMAP_WEIGHTS == "1":
+            raise RuntimeError(f"GLINER_MMAP_WEIGHTS=1 but {message}")
+        print(f"Weights are not memory-mapped: {message}")
+        return model
+
+    # assign=True keeps the mapped tensors instead of copying into the existing ones
+    incompatible = model.model.load_state_dict(state_dict, assign=True, strict=False)
+    if incompatible.missing_keys:
+        print(f"Not memory-mapped (absent from {weights_file}): {', '.join(incompatible.missing_keys)}")
+    if incompatible.unexpected_keys:
+        print(f"Ignored (not in the model): {', '.join(incompatible.unexpected_keys)}")
+    _release_freed_memory()
+    print(f"Memory-mapped {len(matched)} of {len(expected)} GLiNER tensors from {weights_file}")
+    return model
+
+
+def export_safetensors(model_name: str, output_dir: str):
+    """
+    Save a model as a local directory with a safetensors checkpoint
+
+    gliner 0.2.x writes model.safetensors from save_pretrained(...,
+    safe_serialization=True), keyed like model.model.state_dict(). Older
+    releases ignore the flag and write pytorch_model.bin; the checkpoint is
+    then written here instead, so the result never depends on the installed
+    version. Either way its keys are checked against the model.
+    """
+    from gliner import GLiNER
+
+    model = GLiNER.from_pretrained(model_name)
+    model.save_pretrained(output_dir, safe_serialization=True)
+    weights_file = os.path.join(output_dir, WEIGHTS_FILENAME)
+    if not os.path.isfile(weights_file):
+        from safetensors.torch import save_model
+
+        # save_model stores tied tensors once and records the others in metadata
+        save_model(model.model, weights_file)
+
+    header, _ = read_safetensors_header(weights_file)
+    saved = set(header) | set((header.get("__metadata__") or {}).keys())
+    missing = [name for name in model.model.state_dict() if name not in saved]
+    if missing:
+        raise RuntimeError(f"{weights_file} is missing {len(missing)} tensors, e.g. {', '.join(missing[:3])}")
+    print(f"Saved {model_name} to {output_dir}; set GLINER_MODEL={output_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prepare GLiNER weights for memory-mapped loading")
+    parser.add_argument("--model", default=os.getenv("GLINER_MODEL", "knowledgator/gliner-multitask-large-v0.5"))
+    parser.add_argument("--export", metavar="DIR", required=True, help="Directory to write the model to")
+    args = parser.parse_args()
+    export_safetensors(args.model, args.export)
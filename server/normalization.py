@@ -0,0 +1,169 @@
+"""
+Offset-preserving text normalization
+Cleaning text (collapsing whitespace, stripping characters, lowercasing,
+rewriting dates) normally loses the link back to the source. Here every
+normalization step also carries an array of original character indices, so a
+span found on the cleaned text resolves to original characters in O(1), and
+from there to words and boxes in O(log n) through a WordLayout.
+"""
+
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+DISALLOWED_CHARS = re.compile(r'[^\w\s.,!?@#$%^&*()-]')
+WHITESPACE = re.compile(r'\s+')
+DATE_PATTERN = re.compile(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b')
+
+
+class NormalizedText:
+    """
+    Normalized text plus the original index of each of its characters
+
+    index[i] is the position in the original text of character i of text.
+    """
+
+    __slots__ = ("text", "index", "original")
+
+    def __init__(self, text: str, index: array, original: str):
+        self.text = text
+        self.index = index
+        self.original = original
+
+    @classmethod
+    def of(cls, text: str) -> "NormalizedText":
+        return cls(text, array("l", range(len(text))), text)
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    def substitute(self, pattern: re.Pattern, repl) -> "NormalizedText":
+        """
+        re.sub that keeps the index map
+
+        Replacements of the same length as the match map character by
+        character; otherwise every replacement character maps to the start
+        of the match. repl is a string or a function of the match.
+        """
+        parts: List[str] = []
+        index = array("l")
+        last = 0
+        for match in pattern.finditer(self.text):
+            start, end = match.span()
+            replacement = repl(match) if callable(repl) else repl
+            parts.append(self.text[last:start])
+            index.extend(self.index[last:start])
+            parts.append(replacement)
+            if len(replacement) == end - start:
+                index.extend(self.index[start:end])
+            elif replacement:
+                index.extend([self.index[start]] * len(replacement))
+            last = end
+        if not parts:
+            return self
+        parts.append(self.text[last:])
+        index.extend(self.index[last:])
+        return NormalizedText("".join(parts), index, self.original)
+
+    def strip(self) -> "NormalizedText":
+        left = len(self.text) - len(self.text.lstrip())
+        right = len(self.text.rstrip())
+        if left == 0 and right == len(self.text):
+            return self
+        return NormalizedText(self.text[left:right], self.index[left:right], self.original)
+
+    def lower(self) -> "NormalizedText":
+        lowered = self.text.lower()
+        if len(lowered) == len(self.text):
+            return NormalizedText(lowered, self.index, self.original)
+        # A few characters (e.g. U+0130) lowercase to more than one character
+        return self.substitute(re.compile(r"[^\W\d_a-z]", re.UNICODE), lambda m: m.group().lower())
+
+    def to_original(self, start: int, end: int) -> Tuple[int, int]:
+        """Original (start, end) covered by normalized span [start, end)"""
+        if start >= end:
+            position = self.index[start] if start < len(self.index) else len(self.original)
+            return position, position
+        return self.index[start], self.index[end - 1] + 1
+
+    def from_original(self, start: int, end: int) -> Tuple[int, int]:
+        """Normalized (start, end) of the characters kept from original span [start, end)"""
+        return bisect_left(self.index, start), bisect_left(self.index, end)
+
+    def find_all(self, target: str) -> Iterator[Tuple[int, int]]:
+        """Every occurrence of target in the normalized text, as normalized spans"""
+        if not target:
+            return
+        position = self.text.find(target)
+        while position != -1:
+            yield position, position + len(target)
+            position = self.text.find(target, position + 1)
+
+
+def preprocess(text: str) -> NormalizedText:
+    """Collapse whitespace and strip unsupported characters (preprocess_text)"""
+    normalized = NormalizedText.of(text).substitute(WHITESPACE, " ")
+    return normalized.substitute(DISALLOWED_CHARS, "").strip()
+
+
+def normalize_for_matching(text: str) -> NormalizedText:
+    """Canonical dates, collapsed whitespace and lowercase (normalize_text)"""
+    normalized = NormalizedText.of(text).substitute(DATE_PATTERN, lambda m: m.group().replace('/', '-'))
+    return normalized.substitute(WHITESPACE, " ").strip().lower()
+
+
+class WordLayout:
+    """
+    Words joined by single spaces, with sorted start/end offset arrays
+
+    Resolving a span of the joined text to the words it overlaps is two
+    binary searches.
+    """
+
+    def __init__(self, words: Sequence[str]):
+        self.starts = array("l")
+        self.ends = array("l")
+        parts = []
+        position = 0
+        for word in words:
+            self.starts.append(position)
+            self.ends.append(position + len(word))
+            parts.append(word)
+            position += len(word) + 1
+        self.text = " ".join(parts)
+
+    def words_in_span(self, start: int, end: int) -> range:
+        """Indices of the words overlapping [start, end) of the joined text"""
+        first = bisect_right(self.ends, start)
+        last = bisect_left(self.starts, end)
+        return range(first, last)
+
+
+def find_spans(layout: WordLayout, target: str, normalized: Optional[NormalizedText] = None,
+               normalize=None) -> List[range]:
+    """
+    Word index ranges for every occurrence of target in a layout
+
+    Args:
+        layout: Words to search
+        target: Text to find
+        normalized: Precomputed normalization of layout.text
+        normalize: Function producing a NormalizedText, applied to both sides
+            (None matches the raw joined text)
+
+    Returns:
+        One range of word indices per occurrence
+    """
+    if normalize is None:
+        haystack = normalized or NormalizedText.of(layout.text)
+        needle = target
+    else:
+        haystack = normalized or normalize(layout.text)
+        needle = normalize(target).text
+    spans = []
+    for start, end in haystack.find_all(needle):
+        original_start, original_end = haystack.to_original(start, end)
+        spans.append(layout.words_in_span(original_start, original_end))
+    return spans
+
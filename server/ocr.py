@@ -0,0 +1,560 @@
+"""
+OCR helpers for scanned documents and images
+Chooses preprocessing per image instead of a fixed 2x upscale: a quick
+connected-components pass estimates the text height, and the image is only
+upscaled when text is small, downscaled when it is oversized, binarized when
+the background is uneven and deskewed when it is rotated. The applied
+transform is recorded so OCR boxes can be mapped back to the original image.
+
+Tall pages can be OCR'd in tiled mode: the page is cut into overlapping
+horizontal bands at whitespace rows, the bands are recognised in parallel in
+a process pool, and words are merged back in page coordinates.
+
+Recognition runs either through pytesseract (a tesseract subprocess per
+call) or, when tesserocr is installed, through engines kept alive in-process
+(one per thread) via the Tesseract C API bindings. Those take numpy buffers
+directly and skip process start-up and model loading on every call.
+OCR_BACKEND=pytesseract forces the subprocess path.
+
+PDF pages without a text layer are detected individually; only those pages
+are rasterized and OCR'd (in parallel), and the words are mapped back into
+PDF coordinates so they can be searched and redacted like native text.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import fitz
+import numpy as np
+import pytesseract
+from pytesseract import Output
+
+import normalization
+
+try:
+    import tesserocr
+    from tesserocr import PSM, RIL, PyTessBaseAPI, iterate_level
+except ImportError:
+    tesserocr = None
+
+TESSERACT_CONFIG = r'--oem 3 --psm 6'
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+# "pytesseract", "tesserocr", or "auto" (tesserocr when installed)
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto").lower()
+
+OCR_ADAPTIVE_PREPROCESS = os.getenv("OCR_ADAPTIVE_PREPROCESS", "1") == "1"
+OCR_DESKEW = os.getenv("OCR_DESKEW", "1") == "1"
+# Median glyph height (px, roughly the x-height) Tesseract recognises most reliably
+OCR_TARGET_TEXT_HEIGHT = float(os.getenv("OCR_TARGET_TEXT_HEIGHT", "20"))
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "5000"))
+
+# Scale factors inside this band are not worth a resize
+NO_RESIZE_BAND = (0.6, 1.6)
+MIN_SCALE, MAX_SCALE = 0.25, 3.0
+PROBE_MAX_SIDE = 1200
+MIN_DESKEW_ANGLE, MAX_DESKEW_ANGLE = 0.5, 10.0
+
+# Tiled OCR: "auto" tiles pages taller than OCR_TILE_MIN_HEIGHT, "1" always, "0" never
+OCR_TILED = os.getenv("OCR_TILED", "auto").lower()
+OCR_TILE_MIN_HEIGHT = int(os.getenv("OCR_TILE_MIN_HEIGHT", "3000"))
+OCR_TILE_HEIGHT = int(os.getenv("OCR_TILE_HEIGHT", "1200"))
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", "64"))
+OCR_TILE_WORKERS = int(os.getenv("OCR_TILE_WORKERS", str(os.cpu_count() or 1)))
+
+# Scanned PDF pages: rasterization DPI and the text-layer size below which a page is OCR'd
+OCR_PDF_DPI = int(os.getenv("OCR_PDF_DPI", "300"))
+OCR_PDF_MIN_CHARS = int(os.getenv("OCR_PDF_MIN_CHARS", "10"))
+
+WORD_FIELDS = ("left", "top", "width", "height", "conf", "block_num", "par_num", "line_num", "word_num")
+
+
+@dataclass
+class OCRTransform:
+    """Geometry applied to an image before OCR"""
+    scale: float = 1.0
+    # Counter-clockwise rotation (degrees) applied to level the text
+    angle: float = 0.0
+    binarization: str = "none"
+    text_height: Optional[float] = None
+    # 2x3 affine matrix mapping original pixels to preprocessed pixels
+    matrix: np.ndarray = field(default_factory=lambda: np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]))
+
+    def to_original(self, bbox: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+        """Map an (x, y, w, h) box from preprocessed to original image coordinates"""
+        if self.scale == 1.0 and self.angle == 0.0:
+            return bbox
+        x, y, w, h = bbox
+        inverse = cv2.invertAffineTransform(self.matrix)
+        corners = np.array([[x, y, 1], [x + w, y, 1], [x, y + h, 1], [x + w, y + h, 1]], dtype=np.float64)
+        mapped = corners @ inverse.T
+        x0, y0 = np.floor(mapped.min(axis=0)).astype(int)
+        x1, y1 = np.ceil(mapped.max(axis=0)).astype(int)
+        return int(x0), int(y0), int(x1 - x0), int(y1 - y0)
+
+    def describe(self) -> dict:
+        return {
+            "scale": round(self.scale, 4),
+            "angle": round(self.angle, 3),
+            "binarization": self.binarization,
+            "text_height": None if self.text_height is None else round(self.text_height, 2),
+        }
+
+
+def to_gray(image: np.ndarray) -> np.ndarray:
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def _probe(gray: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Small binarized copy used for the measurements"""
+    height, width = gray.shape
+    probe_scale = min(1.0, PROBE_MAX_SIDE / max(height, width))
+    small = gray
+    if probe_scale < 1.0:
+        small = cv2.resize(gray, (max(1, int(width * probe_scale)), max(1, int(height * probe_scale))),
+                           interpolation=cv2.INTER_AREA)
+    _, binary = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return binary, probe_scale
+
+
+def estimate_text_height(binary: np.ndarray, probe_scale: float) -> Optional[float]:
+    """Median height of character-like connected components, in original pixels"""
+    count, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    if count <= 1:
+        return None
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    glyphs = (
+        (heights >= 2)
+        & (heights < binary.shape[0] * 0.1)
+        & (widths < heights * 4)
+        & (areas >= 3)
+    )
+    if glyphs.sum() < 10:
+        return None
+    return float(np.median(heights[glyphs])) / probe_scale
+
+
+def estimate_skew(binary: np.ndarray) -> float:
+    """Dominant text-line skew in degrees (positive = rotated counter-clockwise)"""
+    # Merge glyphs into line blobs so the fit follows text lines, not letters
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 1))
+    lines = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    angles, weights = [], []
+    for contour in contours:
+        (_, _), (w, h), angle = cv2.minAreaRect(contour)
+        if w < h:
+            w, h = h, w
+            angle += 90
+        if w < 40 or w < 4 * h:
+            continue
+        if angle > 45:
+            angle -= 180 if angle > 135 else 90
+        angles.append(-angle)
+        weights.append(w)
+    if not angles:
+        return 0.0
+    return float(np.average(angles, weights=weights))
+
+
+def is_uneven_background(gray_small: np.ndarray) -> bool:
+    """True when illumination varies enough that a global threshold would fail"""
+    background = cv2.medianBlur(cv2.dilate(gray_small, np.ones((7, 7), np.uint8)), 21)
+    return float(np.std(background)) > 18.0
+
+
+def preprocess_for_ocr(image: np.ndarray) -> Tuple[np.ndarray, OCRTransform]:
+    """
+    Prepare an image for Tesseract based on its measured text size
+
+    Args:
+        image: BGR, BGRA or grayscale image
+
+    Returns:
+        Tuple of (preprocessed grayscale image, OCRTransform to map boxes back)
+    """
+    if not OCR_ADAPTIVE_PREPROCESS:
+        return legacy_preprocess(image)
+    gray = to_gray(image)
+    transform = OCRTransform()
+
+    binary, probe_scale = _probe(gray)
+    transform.text_height = estimate_text_height(binary, probe_scale)
+
+    scale = 1.0
+    if transform.text_height:
+        scale = min(MAX_SCALE, max(MIN_SCALE, OCR_TARGET_TEXT_HEIGHT / transform.text_height))
+        if NO_RESIZE_BAND[0] <= scale <= NO_RESIZE_BAND[1]:
+            scale = 1.0
+    height, width = gray.shape
+    if max(height, width) * scale > OCR_MAX_SIDE:
+        scale = OCR_MAX_SIDE / max(height, width)
+
+    angle = -estimate_skew(binary) if OCR_DESKEW else 0.0
+    if not (MIN_DESKEW_ANGLE <= abs(angle) <= MAX_DESKEW_ANGLE):
+        angle = 0.0
+
+    transform.scale = scale
+    transform.angle = angle
+    if scale != 1.0 or angle != 0.0:
+        center = (width / 2.0, height / 2.0)
+        matrix = cv2.getRotationMatrix2D(center, angle, scale)
+        # Keep the whole rotated/scaled page inside the output canvas
+        cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+        out_w = int(np.ceil(height * sin + width * cos))
+        out_h = int(np.ceil(height * cos + width * sin))
+        matrix[0, 2] += out_w / 2.0 - center[0]
+        matrix[1, 2] += out_h / 2.0 - center[1]
+        interpolation = cv2.INTER_CUBIC if scale > 1.0 else cv2.INTER_AREA
+        if angle == 0.0:
+            gray = cv2.resize(gray, (out_w, out_h), interpolation=interpolation)
+        else:
+            # warpAffine has no INTER_AREA, use bilinear when shrinking
+            flags = cv2.INTER_CUBIC if scale > 1.0 else cv2.INTER_LINEAR
+            gray = cv2.warpAffine(gray, matrix, (out_w, out_h), flags=flags,
+                                  borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+        transform.matrix = matrix
+
+    if scale > 1.0:
+        # Upscaling leaves interpolation ringing around glyph edges
+        gray = cv2.GaussianBlur(gray, (3, 3), 0)
+
+    small_gray = gray if max(gray.shape) <= PROBE_MAX_SIDE else cv2.resize(
+        gray, None, fx=PROBE_MAX_SIDE / max(gray.shape), fy=PROBE_MAX_SIDE / max(gray.shape),
+        interpolation=cv2.INTER_AREA)
+    if is_uneven_background(small_gray):
+        block = int(max(15, (transform.text_height or 20) * scale * 2)) | 1
+        gray = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                     cv2.THRESH_BINARY, block, 10)
+        transform.binarization = "adaptive"
+
+    return gray, transform
+
+
+def legacy_preprocess(image: np.ndarray) -> Tuple[np.ndarray, OCRTransform]:
+    """Fixed 2x cubic upscale plus blur, kept for OCR_ADAPTIVE_PREPROCESS=0"""
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    elif image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
+    else:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    image = cv2.resize(image, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+    image = cv2.GaussianBlur(image, (3, 3), 0)
+    return image, OCRTransform(scale=2.0, matrix=np.array([[2.0, 0.0, 0.0], [0.0, 2.0, 0.0]]))
+
+
+# ==================== TILED OCR ====================
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _init_tile_worker():
+    # One core per band; the pool provides the parallelism
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=OCR_TILE_WORKERS, initializer=_init_tile_worker)
+    return _executor
+
+
+def tile_executor() -> ProcessPoolExecutor:
+    """The OCR process pool, shared with tiled image redaction"""
+    return _get_executor()
+
+
+def should_tile(image: np.ndarray) -> bool:
+    if OCR_TILED == "1":
+        return True
+    if OCR_TILED == "auto":
+        return image.shape[0] > OCR_TILE_MIN_HEIGHT and OCR_TILE_WORKERS > 1
+    return False
+
+
+def find_bands(gray: np.ndarray, band_height: int = OCR_TILE_HEIGHT) -> List[Tuple[int, int]]:
+    """
+    Split a page into horizontal bands whose boundaries fall on whitespace rows
+
+    Args:
+        gray: Grayscale page image
+        band_height: Target band height in pixels
+
+    Returns:
+        List of (start, end) row ranges covering the page without overlap
+    """
+    height = gray.shape[0]
+    if height <= band_height:
+        return [(0, height)]
+    _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    row_ink = ink.sum(axis=1)
+
+    window = max(1, band_height // 4)
+    cuts = [0]
+    target = band_height
+    while target < height - window:
+        lo, hi = target - window, min(height, target + window)
+        segment = row_ink[lo:hi]
+        # Emptiest row in the window, preferring the one closest to the target
+        candidates = np.flatnonzero(segment == segment.min()) + lo
+        cut = int(candidates[np.argmin(np.abs(candidates - target))])
+        cuts.append(cut)
+        target = cut + band_height
+    cuts.append(height)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def _ocr_band(job) -> List[Dict]:
+    """Process-pool worker: OCR one band and shift its words into page coordinates"""
+    band, y_offset, config = job
+    return image_to_words_single(band, config, y_offset)
+
+
+def image_to_words_single(image: np.ndarray, config: str = TESSERACT_CONFIG, y_offset: int = 0) -> List[Dict]:
+    """One Tesseract pass returning a list of word dicts"""
+    if active_backend() == "tesserocr":
+        return _tesserocr_words(image, y_offset)
+    data = pytesseract.image_to_data(image, output_type=Output.DICT, config=config)
+    words = []
+    for i, text in enumerate(data['text']):
+        if int(float(data['conf'][i])) < 0 or not text.strip():
+            continue
+        word = {name: data[name][i] for name in WORD_FIELDS}
+        word['text'] = text
+        word['top'] += y_offset
+        words.append(word)
+    return words
+
+
+def image_to_words_tiled(gray: np.ndarray, config: str = TESSERACT_CONFIG) -> List[Dict]:
+    """
+    OCR overlapping bands in parallel and merge the words
+
+    Each word is kept only by the band whose core (non-overlap) range
+    contains its vertical centre, so words in overlap zones are not
+    duplicated and words cut by a band edge are still read whole by the
+    neighbouring band.
+    """
+    height = gray.shape[0]
+    bands = find_bands(gray)
+    jobs = []
+    for start, end in bands:
+        top = max(0, start - OCR_TILE_OVERLAP)
+        bottom = min(height, end + OCR_TILE_OVERLAP)
+        jobs.append((np.ascontiguousarray(gray[top:bottom]), top, config))
+
+    words = []
+    for band_index, ((start, end), band_words) in enumerate(zip(bands, _get_executor().map(_ocr_band, jobs))):
+        for word in band_words:
+            center = word['top'] + word['height'] / 2
+            if start <= center < end:
+                word['band'] = band_index
+                words.append(word)
+    return words
+
+
+def image_to_words(image: np.ndarray, config: str = TESSERACT_CONFIG) -> List[Dict]:
+    """Word boxes for a preprocessed image, tiled when the page is large"""
+    if should_tile(image):
+        return image_to_words_tiled(image, config)
+    return image_to_words_single(image, config)
+
+
+def words_to_text(words: List[Dict]) -> str:
+    """Rebuild plain text from word dicts, one output line per OCR line"""
+    lines = []
+    current_key = None
+    for word in words:
+        key = (word.get('band', 0), word['block_num'], word['par_num'], word['line_num'])
+        if key != current_key:
+            lines.append([])
+            current_key = key
+        lines[-1].append(word['text'])
+    return "\n".join(" ".join(line) for line in lines)
+
+
+def image_to_text(image: np.ndarray, config: str = TESSERACT_CONFIG) -> str:
+    """Plain text for a preprocessed image, tiled when the page is large"""
+    if should_tile(image):
+        return words_to_text(image_to_words_tiled(image, config))
+    if active_backend() == "tesserocr":
+        api = _set_engine_image(image)
+        return api.GetUTF8Text()
+    return pytesseract.image_to_string(image, config=config)
+
+
+# ==================== IN-PROCESS ENGINE ====================
+
+_engines = threading.local()
+
+
+def active_backend() -> str:
+    """Resolve OCR_BACKEND, falling back to pytesseract when tesserocr is missing"""
+    if OCR_BACKEND in ("tesserocr", "auto") and tesserocr is not None:
+        return "tesserocr"
+    return "pytesseract"
+
+
+def _engine():
+    """Initialised engine for the calling thread, created on first use"""
+    api = getattr(_engines, "api", None)
+    if api is None:
+        # Mirrors TESSERACT_CONFIG: default (LSTM) engine, single uniform block
+        api = PyTessBaseAPI(lang=OCR_LANG, psm=PSM.SINGLE_BLOCK)
+        _engines.api = api
+    return api
+
+
+def _set_engine_image(image: np.ndarray):
+    image = np.ascontiguousarray(image)
+    height, width = image.shape[:2]
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    if channels == 3:
+        # Tesseract expects RGB byte order
+        image = np.ascontiguousarray(image[:, :, ::-1])
+    elif channels == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
+        channels = 3
+    api = _engine()
+    api.SetImageBytes(image.tobytes(), width, height, channels, width * channels)
+    return api
+
+
+def _tesserocr_words(image: np.ndarray, y_offset: int = 0) -> List[Dict]:
+    """Word dicts in the same shape as pytesseract.image_to_data rows"""
+    api = _set_engine_image(image)
+    api.Recognize()
+    iterator = api.GetIterator()
+    if iterator is None:
+        return []
+
+    words = []
+    block = par = line = word_num = 0
+    for result in iterate_level(iterator, RIL.WORD):
+        if result.IsAtBeginningOf(RIL.BLOCK):
+            block, par, line = block + 1, 0, 0
+        if result.IsAtBeginningOf(RIL.PARA):
+            par, line = par + 1, 0
+        if result.IsAtBeginningOf(RIL.TEXTLINE):
+            line, word_num = line + 1, 0
+        word_num += 1
+
+        text = result.GetUTF8Text(RIL.WORD)
+        box = result.BoundingBox(RIL.WORD)
+        if not text or not text.strip() or box is None:
+            continue
+        x1, y1, x2, y2 = box
+        words.append({
+            'text': text,
+            'left': x1,
+            'top': y1 + y_offset,
+            'width': x2 - x1,
+            'height': y2 - y1,
+            'conf': result.Confidence(RIL.WORD),
+            'block_num': block,
+            'par_num': par,
+            'line_num': line,
+            'word_num': word_num,
+        })
+    return words
+
+
+# ==================== SCANNED PDF PAGES ====================
+
+def page_needs_ocr(page) -> bool:
+    """True for pages that show images but have (almost) no text layer"""
+    if len(page.get_text("text").strip()) >= OCR_PDF_MIN_CHARS:
+        return False
+    return bool(page.get_images(full=False))
+
+
+def _ocr_pdf_pages(job) -> Dict[int, List[Dict]]:
+    """Process-pool worker: rasterize and OCR a chunk of pages of one PDF"""
+    pdf_content, page_numbers, dpi = job
+    results = {}
+    with fitz.open(stream=pdf_content, filetype="pdf") as doc:
+        for page_number in page_numbers:
+            results[page_number] = ocr_pdf_page(doc[page_number], dpi)
+    return results
+
+
+def ocr_pdf_page(page, dpi: int = OCR_PDF_DPI) -> List[Dict]:
+    """
+    OCR one PDF page and return words with a ``rect`` in PDF coordinates
+
+    The pixmap is rendered in rotated (display) space, so pixel boxes are
+    scaled to points and then de-rotated into the unrotated page space that
+    page.search_for and add_redact_annot use.
+    """
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    image = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+    processed, transform = preprocess_for_ocr(image)
+    words = image_to_words_single(processed)
+
+    to_points = 72.0 / dpi
+    derotate = page.derotation_matrix
+    for word in words:
+        x, y, w, h = transform.to_original((word['left'], word['top'], word['width'], word['height']))
+        word['rect'] = fitz.Rect(x * to_points, y * to_points, (x + w) * to_points, (y + h) * to_points) * derotate
+    return words
+
+
+def ocr_scanned_pages(pdf_content: bytes, doc, dpi: int = OCR_PDF_DPI) -> Dict[int, List[Dict]]:
+    """
+    OCR only the pages of a PDF that have no text layer
+
+    Args:
+        pdf_content: Raw PDF bytes (re-opened inside worker processes)
+        doc: The already-open fitz document, used to pick the pages
+        dpi: Rasterization resolution
+
+    Returns:
+        Mapping of page number to OCR words (each with a PDF-space ``rect``)
+    """
+    page_numbers = [page.number for page in doc if page_needs_ocr(page)]
+    if not page_numbers:
+        return {}
+    if len(page_numbers) == 1 or OCR_TILE_WORKERS <= 1:
+        return {number: ocr_pdf_page(doc[number], dpi) for number in page_numbers}
+
+    # One job per worker so each process opens the document only once
+    chunk_count = min(OCR_TILE_WORKERS, len(page_numbers))
+    chunks = [page_numbers[i::chunk_count] for i in range(chunk_count)]
+    results = {}
+    for chunk_result in _get_executor().map(_ocr_pdf_pages, [(pdf_content, chunk, dpi) for chunk in chunks]):
+        results.update(chunk_result)
+    return results
+
+
+def search_words(words: List[Dict], target_text: str) -> List:
+    """
+    Find target_text in OCR words, like page.search_for on a text layer
+
+    Matching is case-insensitive and whitespace-normalised. Each hit returns
+    one rectangle per OCR line it spans.
+    """
+    target = " ".join(target_text.split()).lower()
+    if not target or not words:
+        return []
+
+    layout = normalization.WordLayout([word['text'].strip().lower() for word in words])
+    areas = []
+    for span in normalization.find_spans(layout, target):
+        line_rects = {}
+        for word in (words[i] for i in span):
+            key = (word.get('band', 0), word['block_num'], word['par_num'], word['line_num'])
+            rect = line_rects.get(key)
+            line_rects[key] = fitz.Rect(word['rect']) if rect is None else rect | word['rect']
+        areas.extend(line_rects.values())
+    return areas
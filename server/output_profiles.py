@@ -0,0 +1,223 @@
+"""
+Output encoding profiles for redacted documents
+Lets each deployment trade CPU for bandwidth: PDFs can be saved with
+garbage collection, deflate compression, object streams and (where the
+PyMuPDF build still supports it) linearization; images can be encoded as
+JPEG, PNG or WebP at a chosen quality. Every encode reports its time and
+output size. Very large images can be written as PNG strip by strip
+(write_png_strips), without an encoded copy of the whole frame in memory.
+"""
+
+import os
+import struct
+import time
+import zlib
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# save() keyword arguments per PDF profile
+PDF_PROFILES = {
+    # Fastest save: only drop unused objects
+    "fast": {"garbage": 1},
+    # Compact without heavy CPU: compact xref, deflate streams, object streams
+    "balanced": {"garbage": 3, "deflate": True, "use_objstms": 1},
+    # Smallest output: also merge duplicate objects and recompress images/fonts
+    "smallest": {"garbage": 4, "deflate": True, "deflate_images": True,
+                 "deflate_fonts": True, "use_objstms": 1, "clean": True},
+    # Balanced plus linearization for fast web view
+    "web": {"garbage": 3, "deflate": True, "linear": True},
+}
+
+IMAGE_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg"),
+    "png": (".png", "image/png"),
+    "webp": (".webp", "image/webp"),
+}
+
+PDF_OUTPUT_PROFILE = os.getenv("PDF_OUTPUT_PROFILE", "balanced")
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "jpeg").lower()
+# JPEG/WebP quality (1-100); PNG uses it as compression level 0-9 scaled from it
+IMAGE_OUTPUT_QUALITY = int(os.getenv("IMAGE_OUTPUT_QUALITY", "90"))
+
+
+def resolve_pdf_profile(name: Optional[str]) -> str:
+    return name if name in PDF_PROFILES else PDF_OUTPUT_PROFILE
+
+
+def resolve_image_format(name: Optional[str]) -> str:
+    name = (name or "").lower()
+    if name == "jpg":
+        name = "jpeg"
+    return name if name in IMAGE_FORMATS else IMAGE_OUTPUT_FORMAT
+
+
+def _write_pdf(write, profile: str, min_garbage: int = 0):
+    """Call write(**options) for a profile, retrying without linearization if unsupported"""
+    options = dict(PDF_PROFILES[profile])
+    if options.get("garbage", 0) < min_garbage:
+        options["garbage"] = min_garbage
+    try:
+        result = write(**options)
+    except Exception as e:
+        if not options.pop("linear", False):
+            raise
+        # Newer MuPDF releases dropped linearization; save without it
+        print(f"Linearization unavailable ({str(e)}), saving without it")
+        result = write(**options)
+    return result, options
+
+
+def save_pdf(doc, output_path: str, profile: Optional[str] = None) -> Dict:
+    """
+    Save a fitz document with the options of a PDF profile
+
+    Returns:
+        Encode stats: profile, encode_ms, output_bytes, linearized
+    """
+    profile = resolve_pdf_profile(profile)
+    start = time.perf_counter()
+    _, options = _write_pdf(lambda **options: doc.save(output_path, **options), profile)
+    return {
+        "profile": profile,
+        "encode_ms": round((time.perf_counter() - start) * 1000, 2),
+        "output_bytes": os.path.getsize(output_path),
+        "linearized": bool(options.get("linear")),
+    }
+
+
+def encode_pdf(doc, profile: Optional[str] = None, min_garbage: int = 0) -> Tuple[bytes, Dict]:
+    """
+    Serialize a fitz document in memory with the options of a PDF profile
+
+    Args:
+        min_garbage: Lowest garbage collection level to use, whatever the
+            profile says (e.g. 3 to drop objects orphaned by page edits)
+
+    Returns:
+        Tuple of (PDF bytes, encode stats as for save_pdf)
+    """
+    profile = resolve_pdf_profile(profile)
+    start = time.perf_counter()
+    data, options = _write_pdf(lambda **options: doc.tobytes(**options), profile, min_garbage)
+    return data, {
+        "profile": profile,
+        "encode_ms": round((time.perf_counter() - start) * 1000, 2),
+        "output_bytes": len(data),
+        "linearized": bool(options.get("linear")),
+    }
+
+
+def png_compression_level(quality: int) -> int:
+    # Higher "quality" means less CPU spent on compression for lossless PNG
+    return max(0, min(9, round((100 - quality) / 11)))
+
+
+def image_params(image_format: str, quality: int):
+    if image_format == "jpeg":
+        return [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    if image_format == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    return [cv2.IMWRITE_PNG_COMPRESSION, png_compression_level(quality)]
+
+
+def encode_image(image: np.ndarray, image_format: Optional[str] = None,
+                 quality: Optional[int] = None) -> Tuple[bytes, Dict]:
+    """
+    Encode an image in memory
+
+    Returns:
+        Tuple of (encoded bytes, stats with format, extension, mimetype,
+        quality, encode_ms and output_bytes)
+    """
+    image_format = resolve_image_format(image_format)
+    quality = IMAGE_OUTPUT_QUALITY if quality is None else max(1, min(100, int(quality)))
+    extension, mimetype = IMAGE_FORMATS[image_format]
+
+    start = time.perf_counter()
+    ok, buffer = cv2.imencode(extension, image, image_params(image_format, quality))
+    if not ok:
+        raise ValueError(f"Failed to encode image as {image_format}")
+    data = buffer.tobytes()
+    return data, {
+        "format": image_format,
+        "extension": extension,
+        "mimetype": mimetype,
+        "quality": quality,
+        "encode_ms": round((time.perf_counter() - start) * 1000, 2),
+        "output_bytes": len(data),
+    }
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def write_png_strips(image: np.ndarray, output, quality: Optional[int] = None, strip_rows: int = 256) -> Dict:
+    """
+    Encode an 8-bit BGR or grayscale image as PNG, strip by strip
+
+    Rows are filtered with the PNG "Up" filter (good for scans and drawings)
+    and deflated incrementally, so only one strip of raw rows and the
+    compressor state are in memory. Works on np.memmap images without
+    reading them in full.
+
+    Args:
+        image: uint8 array of shape (h, w) or (h, w, 3)
+        output: Writable binary file object
+        quality: Mapped to the zlib level as for cv2 PNG encoding
+
+    Returns:
+        Encode stats as for encode_image
+    """
+    quality = IMAGE_OUTPUT_QUALITY if quality is None else max(1, min(100, int(quality)))
+    height, width = image.shape[:2]
+    color_type = 0 if image.ndim == 2 else 2
+
+    start = time.perf_counter()
+    written = output.write(b"\x89PNG\r\n\x1a\n")
+    written += output.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)))
+    compressor = zlib.compressobj(png_compression_level(quality))
+    previous = None
+    for top in range(0, height, strip_rows):
+        strip = np.asarray(image[top:top + strip_rows])
+        if strip.ndim == 3:
+            strip = strip[..., ::-1]  # BGR -> RGB
+        rows = strip.reshape(strip.shape[0], -1)
+        above = np.empty_like(rows)
+        above[0] = 0 if previous is None else previous
+        above[1:] = rows[:-1]
+        previous = rows[-1].copy()
+        filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 2  # Up
+        np.subtract(rows, above, out=filtered[:, 1:])
+        data = compressor.compress(filtered.tobytes())
+        if data:
+            written += output.write(_png_chunk(b"IDAT", data))
+    written += output.write(_png_chunk(b"IDAT", compressor.flush()))
+    written += output.write(_png_chunk(b"IEND", b""))
+
+    extension, mimetype = IMAGE_FORMATS["png"]
+    return {
+        "format": "png",
+        "extension": extension,
+        "mimetype": mimetype,
+        "quality": quality,
+        "encode_ms": round((time.perf_counter() - start) * 1000, 2),
+        "output_bytes": written,
+    }
+
+
+def sniff_image_mimetype(data: bytes) -> str:
+    """Mimetype of encoded image output from its magic number"""
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    # Multi-page scans are written as TIFF or PDF (see image_pages)
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    if data.startswith(b"%PDF"):
+        return "application/pdf"
+    return "image/jpeg"
@@ -0,0 +1,249 @@
+"""
+Opt-in per-request profiling
+A single request can be run under a profiler by sending ``X-Profile`` (or
+``?profile=``) together with an ``X-Admin-Token`` that matches
+PROFILE_ADMIN_TOKEN. Two modes are supported:
+
+- ``cprofile``: deterministic profile saved as a ``.pstats`` file
+- ``sampling``: periodic stack sampling saved as a flamegraph-compatible
+  collapsed-stack ``.collapsed`` file
+
+The artifact id is returned in the ``X-Profile-Id`` response header and the
+file can be fetched from the admin profile endpoint. When no session is
+active the only cost is one context variable lookup per covered call.
+"""
+
+import cProfile
+import hmac
+import inspect
+import os
+import pstats
+import re
+import sys
+import threading
+import uuid
+from collections import Counter as StackCounter
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Optional
+
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+MODES = ("cprofile", "sampling")
+EXTENSIONS = {"cprofile": ".pstats", "sampling": ".collapsed"}
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class StackSampler:
+    """Samples the Python stacks of a set of threads on a background thread"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.thread_ids = set()
+        self.stacks = StackCounter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[_collapse(frame)] += 1
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _collapse(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class ProfileSession:
+    """Profiler state for one request, possibly spanning several threads"""
+
+    def __init__(self, mode: str):
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.profiles: List[cProfile.Profile] = []
+        self.active_threads: Dict[int, cProfile.Profile] = {}
+        self.sampler = StackSampler(SAMPLE_INTERVAL) if mode == "sampling" else None
+        self._lock = threading.Lock()
+
+    def enter_thread(self) -> bool:
+        """Start profiling the calling thread; False if it is already covered"""
+        thread_id = threading.get_ident()
+        with self._lock:
+            if thread_id in self.active_threads or (self.sampler and thread_id in self.sampler.thread_ids):
+                return False
+            if self.sampler:
+                self.sampler.thread_ids.add(thread_id)
+                return True
+            profile = cProfile.Profile()
+            self.active_threads[thread_id] = profile
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler already owns this thread
+            with self._lock:
+                del self.active_threads[thread_id]
+            return False
+        return True
+
+    def exit_thread(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            if self.sampler:
+                self.sampler.thread_ids.discard(thread_id)
+                return
+            profile = self.active_threads.pop(thread_id, None)
+        if profile is not None:
+            profile.disable()
+            with self._lock:
+                self.profiles.append(profile)
+
+    def start(self):
+        if self.sampler:
+            self.sampler.start()
+        self.enter_thread()
+
+    def finish(self) -> Optional[str]:
+        """Stop profiling and write the artifact, returning its path"""
+        self.exit_thread()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = artifact_path(self.id, self.mode)
+        if self.sampler:
+            self.sampler.stop()
+            self.sampler.write(path)
+            return path
+        if not self.profiles:
+            return None
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+        return path
+
+
+_session: ContextVar[Optional[ProfileSession]] = ContextVar("secureflow_profile", default=None)
+
+
+def artifact_path(profile_id: str, mode: str) -> str:
+    return os.path.join(PROFILE_DIR, profile_id + EXTENSIONS[mode])
+
+
+def find_artifact(profile_id: str) -> Optional[str]:
+    """Locate a saved profile by id, rejecting anything that is not a profile id"""
+    if not PROFILE_ID_PATTERN.match(profile_id or ""):
+        return None
+    for mode in MODES:
+        path = artifact_path(profile_id, mode)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    """Constant-time admin token check; profiling is off when no token is configured"""
+    if not PROFILE_ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token, PROFILE_ADMIN_TOKEN)
+
+
+def requested_mode(headers, args) -> Optional[str]:
+    """Return the requested profiler mode, or None when profiling was not asked for"""
+    value = headers.get("X-Profile") or args.get("profile")
+    if not value:
+        return None
+    value = value.lower()
+    return value if value in MODES else "cprofile"
+
+
+def profiled(func):
+    """
+    Extend an active request profile into the thread running func
+
+    Flask executes async views on a separate event-loop thread, so the
+    handler-level profiler alone would miss work such as
+    process_pdf_redaction. Without an active session this is a no-op.
+    """
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            session = _session.get()
+            if session is None or not session.enter_thread():
+                return await func(*args, **kwargs)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                session.exit_thread()
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        session = _session.get()
+        if session is None or not session.enter_thread():
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            session.exit_thread()
+    return wrapper
+
+
+def init_app(app):
+    """Install the request hooks that start and stop opt-in profiles"""
+    from flask import g, request
+
+    @app.before_request
+    def _maybe_start_profile():
+        if not PROFILE_ADMIN_TOKEN:
+            return
+        mode = requested_mode(request.headers, request.args)
+        if mode is None or not is_authorized(request.headers.get("X-Admin-Token")):
+            return
+        session = ProfileSession(mode)
+        g.profile_session = session
+        g.profile_token = _session.set(session)
+        session.start()
+
+    @app.after_request
+    def _finish_profile(response):
+        session = g.pop("profile_session", None)
+        if session is None:
+            return response
+        path = session.finish()
+        if path:
+            response.headers["X-Profile-Id"] = session.id
+            print(f"Saved {session.mode} profile {session.id} to {path}")
+        return response
+
+    @app.teardown_request
+    def _reset_profile(_exc):
+        session = g.pop("profile_session", None)
+        if session is not None:
+            # after_request was skipped; still stop the sampler and keep the artifact
+            session.finish()
+        token = g.pop("profile_token", None)
+        if token is not None:
+            try:
+                _session.reset(token)
+            except ValueError:
+                _session.set(None)
@@ -5,24 +5,18 @@ This module implements intelligent, intent-based redaction using LLMs
 
 from langchain_core.prompts import ChatPromptTemplate, FewShotChatMessagePromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
-from langchain_google_genai import ChatGoogleGenerativeAI
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
 import re
 import os
 
-# Initialize Gemini LLM
+import llm_backends
+import metrics
+import profiling
+
 def get_llm():
-    """Initialize and return the LLM"""
-    api_key = os.getenv('GOOGLE_API_KEY')
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY not found in environment variables")
-    
-    return ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash",
-        temperature=0.1,  # Low temperature for consistent results
-        google_api_key=api_key
-    )
+    """Return the LLM for redaction plans (LLM_BACKEND, see llm_backends)"""
+    return llm_backends.get_backend("plan").runnable(RedactionPlan)
 
 # Pydantic models for structured output
 class RedactionEntity(BaseModel):
@@ -140,6 +134,7 @@ ENTITY_TYPES = [
     "CONFIDENTIAL_INFO", "TRADE_SECRET", "INTERNAL_CODE", "PASSWORD"
 ]
 
+@profiling.profiled
 def analyze_intent(user_intent: str, document_text: str) -> RedactionPlan:
     """
     Main function to analyze user intent and generate redaction plan
@@ -164,17 +159,19 @@ def analyze_intent(user_intent: str, document_text: str) -> RedactionPlan:
     
     # Execute
     try:
-        result = chain.invoke({
-            "user_intent": user_intent,
-            "document_text": document_text,
-            "entity_types": ", ".join(ENTITY_TYPES),
-            "format_instructions": parser.get_format_instructions()
-        })
+        with metrics.stage("llm_analyze_intent"):
+            result = chain.invoke({
+                "user_intent": user_intent,
+                "document_text": document_text,
+                "entity_types": ", ".join(ENTITY_TYPES),
+                "format_instructions": parser.get_format_instructions()
+            })
         return result
     except Exception as e:
         print(f"Error in intent analysis: {str(e)}")
         raise
 
+@metrics.timed("plan_merge")
 def refine_with_gliner(redaction_plan: RedactionPlan, gliner_entities: List[Dict]) -> RedactionPlan:
     """
     Refine the LLM-generated plan with GLiNER results for better accuracy
@@ -242,10 +239,11 @@ Update the redaction plan accordingly. Return only the modified JSON.""")
     chain = prompt | llm | parser
     
     try:
-        result = chain.invoke({
-            "current_plan": redaction_plan.model_dump_json(indent=2),
-            "user_feedback": user_feedback
-        })
+        with metrics.stage("llm_refinement"):
+            result = chain.invoke({
+                "current_plan": redaction_plan.model_dump_json(indent=2),
+                "user_feedback": user_feedback
+            })
         return result
     except Exception as e:
         print(f"Error in refinement: {str(e)}")
@@ -0,0 +1,117 @@
+"""
+Mask-based redaction rendering for images
+Instead of one rectangle / blur / font-fitting loop per box, all target
+boxes are rasterized into a single mask and the redaction style is applied
+in one composite operation. Replacement labels are drawn in a final pass
+with font scales computed once per distinct label.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+THICKNESS = 1
+BLUR_KERNEL = (15, 15)
+MIN_FONT_SCALE = 0.3
+
+# (x, y, w, h) box plus the label drawn for replacement styles
+Target = Tuple[Tuple[int, int, int, int], str]
+
+FILL_STYLES = {
+    "BlackOut": 0,
+    "RedactObjects": 0,
+    "Vanishing": 255,
+    "CategoryReplacement": 255,
+    "SyntheticReplacement": 255,
+}
+LABEL_STYLES = ("CategoryReplacement", "SyntheticReplacement")
+
+
+def padded_box(bbox: Tuple[int, int, int, int], shape) -> Tuple[int, int, int, int]:
+    """Box grown by 10% of its height and clipped to the image, as (x1, y1, x2, y2)"""
+    x, y, w, h = bbox
+    padding = int(h * 0.1)
+    return (
+        max(0, x - padding),
+        max(0, y - padding),
+        min(shape[1], x + w + padding),
+        min(shape[0], y + h + padding),
+    )
+
+
+def build_mask(boxes: List[Tuple[int, int, int, int]], shape) -> Tuple[Optional[np.ndarray], Tuple[int, int, int, int]]:
+    """
+    Rasterize boxes into a boolean mask covering only their union area
+
+    Returns:
+        Tuple of (mask or None when there is nothing to draw, union (x1, y1, x2, y2))
+    """
+    boxes = [b for b in boxes if b[2] > b[0] and b[3] > b[1]]
+    if not boxes:
+        return None, (0, 0, 0, 0)
+    coords = np.array(boxes)
+    ux1, uy1 = coords[:, 0].min(), coords[:, 1].min()
+    ux2, uy2 = coords[:, 2].max(), coords[:, 3].max()
+    mask = np.zeros((uy2 - uy1, ux2 - ux1), dtype=bool)
+    for x1, y1, x2, y2 in coords - [ux1, uy1, ux1, uy1]:
+        mask[y1:y2, x1:x2] = True
+    return mask, (int(ux1), int(uy1), int(ux2), int(uy2))
+
+
+def _label_scales(labels) -> Dict[str, Tuple[int, int]]:
+    """Text size of each distinct label at font scale 1.0"""
+    return {label: cv2.getTextSize(label, FONT, 1.0, THICKNESS)[0] for label in set(labels)}
+
+
+def draw_labels(image: np.ndarray, targets: List[Target]):
+    """Centre each label in its box, shrinking it to fit the box width"""
+    base_sizes = _label_scales(label for _, label in targets)
+    for (x, y, w, h), label in targets:
+        base_w, base_h = base_sizes[label]
+        font_scale = h / 30
+        if base_w * font_scale > w:
+            font_scale = max(MIN_FONT_SCALE, w / base_w) if base_w else font_scale
+        text_w, text_h = int(base_w * font_scale), int(base_h * font_scale)
+        text_x = x + (w - text_w) // 2
+        text_y = y + (h + text_h) // 2
+        cv2.putText(image, label, (text_x, text_y), FONT, font_scale, (0, 0, 0), THICKNESS)
+
+
+def render_redactions(image: np.ndarray, targets: List[Target], redact_type: str) -> np.ndarray:
+    """
+    Apply one redaction style to every target box in a single composite pass
+
+    Args:
+        image: Image to modify in place
+        targets: List of ((x, y, w, h), label) pairs
+        redact_type: BlackOut, RedactObjects, Vanishing, Blurring,
+            CategoryReplacement or SyntheticReplacement
+
+    Returns:
+        The modified image
+    """
+    if not targets:
+        return image
+    boxes = [padded_box(bbox, image.shape) for bbox, _ in targets]
+    mask, (ux1, uy1, ux2, uy2) = build_mask(boxes, image.shape)
+    if mask is None:
+        return image
+    region = image[uy1:uy2, ux1:ux2]
+    region_mask = mask if region.ndim == 2 else mask[..., None]
+
+    if redact_type in FILL_STYLES:
+        np.copyto(region, np.array(FILL_STYLES[redact_type], dtype=image.dtype), where=region_mask)
+    elif redact_type == "Blurring":
+        # Blur the union area once, with a margin so box edges see real context
+        margin = BLUR_KERNEL[0] // 2
+        bx1, by1 = max(0, ux1 - margin), max(0, uy1 - margin)
+        bx2, by2 = min(image.shape[1], ux2 + margin), min(image.shape[0], uy2 + margin)
+        blurred = cv2.GaussianBlur(image[by1:by2, bx1:bx2], BLUR_KERNEL, 0)
+        blurred = blurred[uy1 - by1:uy2 - by1, ux1 - bx1:ux2 - bx1]
+        np.copyto(region, blurred, where=region_mask)
+
+    if redact_type in LABEL_STYLES:
+        draw_labels(image, targets)
+    return image
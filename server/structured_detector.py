@@ -0,0 +1,281 @@
+"""
+Deterministic detection of structured identifiers
+Emails, phone numbers, PAN and IFSC codes, IP and MAC addresses, URLs,
+credit card numbers and dates follow fixed formats, so they are found with
+precompiled patterns (validated with checksums or range checks where the
+format allows) instead of the GLiNER model. Each pattern is scanned on its
+own; when a validator rejects a match, shorter matches ending at earlier word
+boundaries are tried, so "9876543210 1234" still yields the phone number
+after failing the card checksum. Overlaps are resolved by start position,
+then pattern priority. The labels this module covers are then removed from
+the GLiNER label set for the call, except IP_ADDRESS: a dotted quad is only
+reported with address context (e.g. "IP", "host"), since version numbers
+look the same, so the model still sees that label.
+
+preprocess_text removes ':', '/', '+' and apostrophes, which URLs, MAC and
+IPv6 addresses, slash dates and international phone numbers are made of, so
+detect_in_source scans the text before cleaning and maps the spans onto the
+cleaned text through its normalization index map.
+"""
+
+import ipaddress
+import os
+import re
+from datetime import date
+from typing import Callable, Dict, List, Optional, Tuple
+
+STRUCTURED_DETECTION = os.getenv("STRUCTURED_DETECTION", "1") == "1"
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+_MONTH = (r"(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?"
+          r"|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)")
+
+# (group name, label, pattern) in priority order: earlier patterns win when
+# several match at the same position
+PATTERNS: List[Tuple[str, str, str]] = [
+    ("email", "EMAIL_ADDRESS", r"\b[\w.%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b"),
+    ("url", "URL", r"\b(?:https?://|www\.)[^\s<>\"']+[^\s<>\"'.,!?)]"),
+    ("mac", "MAC_ADDRESS",
+     r"\b[0-9A-Fa-f]{2}(?P<mac_sep>[:-])(?:[0-9A-Fa-f]{2}(?P=mac_sep)){4}[0-9A-Fa-f]{2}\b"
+     r"|\b[0-9A-Fa-f]{4}\.[0-9A-Fa-f]{4}\.[0-9A-Fa-f]{4}\b"),
+    # The lookahead requires at least one hex group, so a bare "::" is not an address
+    ("ipv6", "IP_ADDRESS",
+     r"(?<![\w:])(?=[0-9A-Fa-f:]*[0-9A-Fa-f])(?:[0-9A-Fa-f]{0,4}:){2,7}[0-9A-Fa-f]{0,4}(?![\w:])"),
+    ("ipv4", "IP_ADDRESS", r"\b(?:\d{1,3}\.){3}\d{1,3}\b"),
+    ("card", "CREDIT_CARD_NUMBER", r"\b\d(?:[ -]?\d){12,18}\b"),
+    ("iso_date", "DATE", r"\b\d{4}[-/.]\d{1,2}[-/.]\d{1,2}\b"),
+    ("dmy_date", "DATE", r"\b\d{1,2}[-/.]\d{1,2}[-/.](?:\d{4}|\d{2})\b"),
+    ("text_date", "DATE",
+     rf"\b\d{{1,2}}(?:st|nd|rd|th)?\s+{_MONTH}\.?,?\s+\d{{4}}\b"
+     rf"|\b{_MONTH}\.?\s+\d{{1,2}}(?:st|nd|rd|th)?,?\s+\d{{4}}\b"),
+    ("pan", "PAN_NUMBER", r"\b[A-Za-z]{3}[PCHFATBLJGpchfatbljg][A-Za-z]\d{4}[A-Za-z]\b"),
+    ("ifsc", "IFSC_CODE", r"\b[A-Za-z]{4}0[A-Za-z0-9]{6}\b"),
+    ("phone", "PHONE_NUMBER", r"(?<![\w+])\+?\d[\d ()-]{8,16}\d\b"),
+]
+
+LABEL_BY_GROUP = {group: label for group, label, _ in PATTERNS}
+STRUCTURED_LABELS = frozenset(LABEL_BY_GROUP.values())
+# Detected here only in part, so still sent to GLiNER as well
+SHARED_LABELS = frozenset({"IP_ADDRESS"})
+
+_COMPILED = [(group, label, re.compile(pattern, re.IGNORECASE)) for group, label, pattern in PATTERNS]
+
+# Words before a dotted quad that make it an address rather than a version
+IPV4_CONTEXT = re.compile(r"\b(?:ip|ipv4|address|addr|host|server|gateway|dns|subnet|netmask|router"
+                          r"|client|proxy|inet|ping|connected|login|logged)\b", re.IGNORECASE)
+IPV4_CONTEXT_CHARS = 40
+
+
+def luhn_valid(digits: str) -> bool:
+    total = 0
+    for i, ch in enumerate(reversed(digits)):
+        n = int(ch)
+        if i % 2:
+            n = n * 2 - 9 if n > 4 else n * 2
+        total += n
+    return total % 10 == 0
+
+
+def _valid_date(year: int, month: int, day: int) -> bool:
+    if year < 100:
+        year += 2000 if year < 50 else 1900
+    try:
+        date(year, month, day)
+    except ValueError:
+        return False
+    return 1900 <= year <= 2100
+
+
+def _valid_card(text: str) -> bool:
+    digits = re.sub(r"\D", "", text)
+    return 13 <= len(digits) <= 19 and luhn_valid(digits)
+
+
+def _valid_ipv4(text: str) -> bool:
+    return all(int(part) <= 255 for part in text.split("."))
+
+
+def _valid_ipv6(text: str) -> bool:
+    try:
+        address = ipaddress.IPv6Address(text)
+    except ValueError:
+        return False
+    return not address.is_unspecified
+
+
+def _ipv4_in_context(text: str, start: int, end: int) -> bool:
+    """A dotted quad counts as an address after an address word, or with a /prefix or :port"""
+    if re.match(r"[/:]\d", text[end:end + 2]):
+        return True
+    return IPV4_CONTEXT.search(text[max(0, start - IPV4_CONTEXT_CHARS):start]) is not None
+
+
+def _valid_iso_date(text: str) -> bool:
+    year, month, day = map(int, re.split(r"[-/.]", text))
+    return _valid_date(year, month, day)
+
+
+def _valid_dmy_date(text: str) -> bool:
+    first, second, year = map(int, re.split(r"[-/.]", text))
+    # Accept either day-month or month-day ordering
+    return _valid_date(year, second, first) or _valid_date(year, first, second)
+
+
+def _valid_text_date(text: str) -> bool:
+    numbers = [int(n) for n in re.findall(r"\d+", text)]
+    month = MONTHS[re.search(_MONTH, text, re.IGNORECASE).group()[:3].lower()]
+    return _valid_date(numbers[-1], month, numbers[0])
+
+
+def _valid_phone(text: str) -> bool:
+    digits = re.sub(r"\D", "", text)
+    if text.startswith("+"):
+        return 10 <= len(digits) <= 13
+    # Without a '+', require a plain 10-digit number or a trunk/country
+    # prefix, so runs of years like "2020-2023 2024" are not phones
+    return (len(digits) == 10
+            or (len(digits) == 11 and digits.startswith("0"))
+            or (len(digits) == 12 and digits.startswith("91")))
+
+
+VALIDATORS: Dict[str, Callable[[str], bool]] = {
+    "card": _valid_card,
+    "ipv4": _valid_ipv4,
+    "ipv6": _valid_ipv6,
+    "iso_date": _valid_iso_date,
+    "dmy_date": _valid_dmy_date,
+    "text_date": _valid_text_date,
+    "phone": _valid_phone,
+}
+# Checks that need the surrounding text: (text, start, end) -> bool
+CONTEXT_VALIDATORS: Dict[str, Callable[[str, int, int], bool]] = {
+    "ipv4": _ipv4_in_context,
+}
+
+
+def _accepted(group: str, text: str, start: int, end: int) -> bool:
+    validator = VALIDATORS.get(group)
+    if validator and not validator(text[start:end]):
+        return False
+    context_validator = CONTEXT_VALIDATORS.get(group)
+    return not context_validator or context_validator(text, start, end)
+
+
+def _validated_end(group: str, pattern: re.Pattern, text: str, match: re.Match) -> Optional[int]:
+    """
+    End of the longest valid match at match.start()
+
+    The regex only returns its greedy match; when that one fails validation,
+    matches ending at earlier word boundaries are tried (e.g. the 10-digit
+    phone inside a 14-digit run that failed the card checksum).
+    """
+    start = match.start()
+    if _accepted(group, text, start, match.end()):
+        return match.end()
+    for end in range(match.end() - 1, start, -1):
+        if not (text[end - 1].isalnum() and not text[end].isalnum()):
+            continue
+        shorter = pattern.match(text, start, end)
+        if shorter and shorter.end() == end and _accepted(group, text, start, end):
+            return end
+    return None
+
+
+def _candidates(text: str, wanted) -> List[Tuple[int, int, int, str]]:
+    """(start, end, priority, group) of every validated match of every wanted pattern"""
+    candidates = []
+    for priority, (group, label, pattern) in enumerate(_COMPILED):
+        if label not in wanted:
+            continue
+        position = 0
+        while position < len(text):
+            match = pattern.search(text, position)
+            if match is None:
+                break
+            end = _validated_end(group, pattern, text, match)
+            if end is None:
+                # A valid match may still start inside the rejected one
+                position = match.start() + 1
+                continue
+            candidates.append((match.start(), end, priority, group))
+            position = max(end, match.start() + 1)
+    return candidates
+
+
+def detect(text: str, entity_labels: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Find structured identifiers
+
+    Args:
+        text: Text to scan
+        entity_labels: Only report these labels (all structured labels when None)
+
+    Returns:
+        Spans in GLiNER's format: start, end, text, label and score (1.0)
+    """
+    wanted = STRUCTURED_LABELS if entity_labels is None else STRUCTURED_LABELS.intersection(entity_labels)
+    if not text or not wanted:
+        return []
+
+    spans = []
+    covered = 0
+    # Leftmost first, then by priority; a span overlapping an accepted one is dropped
+    for start, end, _, group in sorted(_candidates(text, wanted)):
+        if start < covered:
+            continue
+        spans.append({
+            "start": start,
+            "end": end,
+            "text": text[start:end],
+            "label": LABEL_BY_GROUP[group],
+            "score": 1.0,
+        })
+        covered = end
+    return spans
+
+
+def detect_in_source(normalized, entity_labels: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Find structured identifiers in the text before normalization
+
+    Args:
+        normalized: normalization.NormalizedText of the cleaned text
+        entity_labels: As for detect
+
+    Returns:
+        Spans whose start and end index normalized.text, so they merge with
+        model spans on the cleaned text, and whose text is the identifier as
+        written in the source (what the redaction paths search for)
+    """
+    spans = []
+    for span in detect(normalized.original, entity_labels):
+        start, end = normalized.from_original(span["start"], span["end"])
+        if start < end:
+            spans.append(dict(span, start=start, end=end))
+    return spans
+
+
+def split_labels(entity_labels: List[str]) -> Tuple[List[str], List[str]]:
+    """Partition labels into (handled here, left for GLiNER)"""
+    if not STRUCTURED_DETECTION:
+        return [], list(entity_labels)
+    structured = [label for label in entity_labels if label in STRUCTURED_LABELS]
+    remaining = [label for label in entity_labels
+                 if label not in STRUCTURED_LABELS or label in SHARED_LABELS]
+    return structured, remaining
+
+
+def merge(structured: List[Dict], model_entities: List[Dict]) -> List[Dict]:
+    """Combine both detectors; model spans overlapping a structured span are dropped"""
+    if not structured:
+        return model_entities
+    merged = list(structured)
+    for entity in model_entities:
+        start, end = entity.get("start"), entity.get("end")
+        if start is not None and any(s["start"] < end and start < s["end"] for s in structured):
+            continue
+        merged.append(entity)
+    return sorted(merged, key=lambda e: e.get("start", 0))
@@ -0,0 +1,42 @@
+"""
+Regression tests for structured_detector
+Run with: python -m pytest server/test_structured_detector.py
+"""
+
+import structured_detector
+
+
+def found(text, labels=None):
+    return [(span["label"], span["text"]) for span in structured_detector.detect(text, labels)]
+
+
+def test_phone_survives_failed_card_checksum():
+    assert found("Call 9876543210 1234 now") == [("PHONE_NUMBER", "9876543210")]
+
+
+def test_phone_survives_trailing_year():
+    assert found("Call 98765 43210 2023") == [("PHONE_NUMBER", "98765 43210")]
+
+
+def test_valid_card_still_wins_over_phone():
+    assert found("Card 4111 1111 1111 1111") == [("CREDIT_CARD_NUMBER", "4111 1111 1111 1111")]
+
+
+def test_double_colon_is_not_ipv6():
+    assert found("Name :: John") == []
+
+
+def test_unspecified_ipv6_is_rejected():
+    assert found("Listening on :: and fe80::1") == [("IP_ADDRESS", "fe80::1")]
+
+
+def test_dotted_quad_needs_address_context():
+    assert found("Version 1.2.3.4") == []
+    assert found("Server IP 10.0.0.1") == [("IP_ADDRESS", "10.0.0.1")]
+    assert found("Route 10.0.0.0/8") == [("IP_ADDRESS", "10.0.0.0")]
+
+
+def test_ip_address_is_still_sent_to_model():
+    structured, remaining = structured_detector.split_labels(["IP_ADDRESS", "PHONE_NUMBER", "PERSON"])
+    assert structured == ["IP_ADDRESS", "PHONE_NUMBER"]
+    assert remaining == ["IP_ADDRESS", "PERSON"]
@@ -0,0 +1,314 @@
+"""
+Tile-based redaction for very large images
+A 600-DPI drawing is hundreds of megabytes decoded, and the regular path
+keeps several full-size copies alive (the decoded frame, the redaction copy,
+grayscale and resized OCR copies, the encoded output). Here the decoded
+frame is moved once into a memory-mapped working file and dropped, and
+every later step only touches tiles of it:
+
+- OCR runs per tile (blank tiles are skipped) with a bounded number of
+  tiles in flight in the OCR process pool
+- face detection reads a downscaled copy (see face_detection)
+- redaction renders only the tiles that intersect target boxes, in place
+- PNG output is encoded strip by strip (output_profiles.write_png_strips);
+  other formats are encoded from the mapped file
+
+Pages of the working file are file-backed, so the kernel can evict them
+under pressure; private memory is bounded by the tile size, with two
+exceptions that need sizing for the largest accepted image:
+
+- decoding: OpenCV decodes the whole frame before it is copied into the
+  working file, so the peak during image_decode is one full decoded frame
+  (width x height x 3 bytes)
+- JPEG and WebP output: the encoder reads the mapped file row by row, but
+  the encoded result is held in memory before it is written; choose PNG
+  (image_format=png or IMAGE_OUTPUT_FORMAT) for fully streamed output
+"""
+
+import io
+import os
+import tempfile
+import warnings
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import face_detection
+import metrics
+import normalization
+import ocr
+import output_profiles
+import redaction_render
+
+# "auto" tiles images above TILED_REDACTION_MIN_PIXELS, "1" always, "0" never
+TILED_REDACTION = os.getenv("TILED_REDACTION", "auto").lower()
+TILED_REDACTION_MIN_PIXELS = int(os.getenv("TILED_REDACTION_MIN_PIXELS", str(40_000_000)))
+TILE_SIZE = int(os.getenv("TILED_REDACTION_TILE", "2048"))
+# Tiles are OCR'd with this margin so words cut by a tile edge are read whole
+TILE_OVERLAP = int(os.getenv("TILED_REDACTION_OVERLAP", "128"))
+# Directory for the memory-mapped working image (default: system temp dir)
+TILED_WORK_DIR = os.getenv("TILED_WORK_DIR") or None
+# Tiles whose gray range is below this are treated as blank and not OCR'd
+BLANK_TILE_RANGE = 32
+MIN_WORD_CONFIDENCE = 60
+
+Box = Tuple[int, int, int, int]
+
+
+def image_size(source) -> Optional[Tuple[int, int]]:
+    """
+    (width, height) from the image header, without decoding pixels
+
+    Returns:
+        The size; None when Pillow refuses the image as too large (treated
+        as very large), (0, 0) when the header cannot be read
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+        try:
+            with Image.open(source) as image:
+                return image.size
+        except Image.DecompressionBombError:
+            return None
+        except Exception:
+            return (0, 0)
+
+
+def should_tile(size: Optional[Tuple[int, int]]) -> bool:
+    if TILED_REDACTION == "1":
+        return True
+    if TILED_REDACTION == "auto":
+        return size is None or size[0] * size[1] > TILED_REDACTION_MIN_PIXELS
+    return False
+
+
+def tile_grid(height: int, width: int, tile: int = TILE_SIZE) -> List[Box]:
+    """Non-overlapping (x1, y1, x2, y2) tiles covering the image, row-major"""
+    return [(x, y, min(width, x + tile), min(height, y + tile))
+            for y in range(0, height, tile) for x in range(0, width, tile)]
+
+
+class WorkingImage:
+    """Decoded image held in a memory-mapped temporary file"""
+
+    def __init__(self, decoded: np.ndarray):
+        self._file = tempfile.TemporaryFile(dir=TILED_WORK_DIR, prefix="redact-tiles-")
+        self.array = np.memmap(self._file, dtype=np.uint8, mode="w+", shape=decoded.shape)
+        # Copy in strips so the conversion never needs a second full-size buffer
+        for top in range(0, decoded.shape[0], TILE_SIZE):
+            self.array[top:top + TILE_SIZE] = decoded[top:top + TILE_SIZE]
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def close(self):
+        # The file is already unlinked; the mapping goes away with the last view
+        self.array = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def decode_to_working_image(source) -> WorkingImage:
+    """
+    Decode an image file or bytes into a WorkingImage
+
+    The decoder still produces the frame in one piece; it is released as
+    soon as it has been copied into the mapped file.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        decoded = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_COLOR)
+    else:
+        decoded = cv2.imread(source, cv2.IMREAD_COLOR)
+    if decoded is None:
+        raise ValueError("Failed to load image for redaction")
+    return WorkingImage(decoded)
+
+
+def _ocr_tile(job) -> List[Dict]:
+    """OCR one tile and return its words in image coordinates (process-pool worker)"""
+    tile, (x_offset, y_offset), core = job
+    processed, transform = ocr.preprocess_for_ocr(tile)
+    boxes = []
+    for word in ocr.image_to_words_single(processed):
+        text = word['text'].strip()
+        if not text or int(float(word['conf'])) <= MIN_WORD_CONFIDENCE:
+            continue
+        x, y, w, h = transform.to_original((word['left'], word['top'], word['width'], word['height']))
+        x, y = x + x_offset, y + y_offset
+        # Keep a word only in the tile whose core holds its centre
+        cx, cy = x + w / 2, y + h / 2
+        if core[0] <= cx < core[2] and core[1] <= cy < core[3]:
+            boxes.append({'text': text, 'bbox': (x, y, w, h), 'conf': word['conf']})
+    return boxes
+
+
+def _tile_jobs(image: np.ndarray):
+    height, width = image.shape[:2]
+    for core in tile_grid(height, width):
+        x1, y1 = max(0, core[0] - TILE_OVERLAP), max(0, core[1] - TILE_OVERLAP)
+        x2, y2 = min(width, core[2] + TILE_OVERLAP), min(height, core[3] + TILE_OVERLAP)
+        tile = np.ascontiguousarray(image[y1:y2, x1:x2])
+        low, high, _, _ = cv2.minMaxLoc(ocr.to_gray(tile))
+        if high - low < BLANK_TILE_RANGE:
+            continue
+        yield tile, (x1, y1), core
+
+
+def reading_order(boxes: List[Dict]) -> List[Dict]:
+    """Sort word boxes into lines (top to bottom) and words (left to right)"""
+    lines: List[List[Dict]] = []
+    for box in sorted(boxes, key=lambda b: b['bbox'][1] + b['bbox'][3] / 2):
+        x, y, w, h = box['bbox']
+        if lines:
+            _, ly, _, lh = lines[-1][0]['bbox']
+            # Same line when the vertical centre falls inside the line's first word
+            if ly <= y + h / 2 <= ly + lh:
+                lines[-1].append(box)
+                continue
+        lines.append([box])
+    return [box for line in lines for box in sorted(line, key=lambda b: b['bbox'][0])]
+
+
+@metrics.timed("ocr_boxes")
+def get_text_boxes(image: np.ndarray) -> List[Dict]:
+    """
+    OCR word boxes of a large image, tile by tile
+
+    At most OCR_TILE_WORKERS tiles are copied out and in flight at once.
+    """
+    window = max(1, ocr.OCR_TILE_WORKERS)
+    executor = ocr.tile_executor() if window > 1 else None
+    pending, boxes = deque(), []
+    for job in _tile_jobs(image):
+        if executor is None:
+            boxes.extend(_ocr_tile(job))
+            continue
+        pending.append(executor.submit(_ocr_tile, job))
+        if len(pending) >= window:
+            boxes.extend(pending.popleft().result())
+    while pending:
+        boxes.extend(pending.popleft().result())
+    return reading_order(boxes)
+
+
+def _intersects(a: Box, b: Box) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _ring(image: np.ndarray, window: Box, core: Box) -> List[Tuple[Box, np.ndarray]]:
+    """Copies of the parts of window outside core, as (box, pixels)"""
+    wx1, wy1, wx2, wy2 = window
+    x1, y1, x2, y2 = core
+    parts = [(wx1, wy1, wx2, y1), (wx1, y2, wx2, wy2), (wx1, y1, x1, y2), (x2, y1, wx2, y2)]
+    return [((px1, py1, px2, py2), np.array(image[py1:py2, px1:px2]))
+            for px1, py1, px2, py2 in parts if px2 > px1 and py2 > py1]
+
+
+@metrics.timed("image_redaction_rendering")
+def render_tiles(image: np.ndarray, targets: List[redaction_render.Target], redact_type: str) -> int:
+    """
+    Render redactions into the tiles they intersect, in place
+
+    Boxes crossing a tile edge are drawn in every tile they touch, with
+    coordinates relative to that tile, so the pieces line up. For Blurring
+    each tile is rendered on a copy padded by the blur kernel radius, with
+    the padding taken from the pixels as they were before any tile was
+    written, so the blur near a tile edge sees the same neighbours as an
+    untiled blur and leaves no seam. Only the tile itself is written back.
+
+    Returns:
+        Number of tiles touched
+    """
+    height, width = image.shape[:2]
+    margin = redaction_render.BLUR_KERNEL[0] // 2 if redact_type == "Blurring" else 0
+    padded = [redaction_render.padded_box(bbox, image.shape) for bbox, _ in targets]
+    jobs = []
+    for tile in tile_grid(height, width):
+        local = [target for target, box in zip(targets, padded) if _intersects(box, tile)]
+        if not local:
+            continue
+        x1, y1, x2, y2 = tile
+        window = (max(0, x1 - margin), max(0, y1 - margin), min(width, x2 + margin), min(height, y2 + margin))
+        # Neighbouring tiles may be rendered first; keep this tile's padding as it is now
+        jobs.append((tile, window, local, _ring(image, window, tile) if margin else []))
+
+    for (x1, y1, x2, y2), (wx1, wy1, wx2, wy2), local, ring in jobs:
+        pixels = np.array(image[wy1:wy2, wx1:wx2])
+        for (px1, py1, px2, py2), saved in ring:
+            pixels[py1 - wy1:py2 - wy1, px1 - wx1:px2 - wx1] = saved
+        shifted = [((bx - wx1, by - wy1, bw, bh), label) for (bx, by, bw, bh), label in local]
+        redaction_render.render_redactions(pixels, shifted, redact_type)
+        image[y1:y2, x1:x2] = pixels[y1 - wy1:y2 - wy1, x1 - wx1:x2 - wx1]
+    return len(jobs)
+
+
+def redact_image(source, entities: List[Dict], redact_type: str, image_format: Optional[str] = None,
+                 image_quality: Optional[int] = None, output_path: Optional[str] = None) -> Tuple[Optional[bytes], Dict]:
+    """
+    Redact a very large image with bounded memory
+
+    Args:
+        source: Image path or encoded bytes
+        entities: Entities to redact ({"text", "label"})
+        redact_type: Redaction style, as for redact_matching_text
+        image_format / image_quality: Output encoding (see output_profiles)
+        output_path: Write here; None returns the encoded bytes instead
+
+    Returns:
+        Tuple of (encoded bytes or None when written to output_path, encode stats)
+    """
+    with metrics.stage("image_decode"):
+        working = decode_to_working_image(source)
+    with working:
+        image = working.array
+        height, width = image.shape[:2]
+        text_boxes = get_text_boxes(image)
+
+        targets = []
+        if redact_type == "RedactObjects":
+            with metrics.stage("face_detection"):
+                faces = face_detection.detect_faces(image)
+            targets.extend(((x, y, w, h), "FACE") for (x, y, w, h) in faces)
+
+        layout = normalization.WordLayout([box['text'] for box in text_boxes])
+        # Same matching as redact_matching_text: entity texts are preprocess_text output
+        normalized = normalization.preprocess(layout.text)
+        selected = {}
+        for entity in entities:
+            for span in normalization.find_spans(layout, entity['text'], normalized, normalization.preprocess):
+                for i in span:
+                    selected[i] = entity.get('label', 'REDACTED')
+        targets.extend((text_boxes[i]['bbox'], label) for i, label in selected.items())
+        tiles = render_tiles(image, targets, redact_type)
+        if redact_type == "RedactObjects":
+            for (x, y, w, h) in faces:
+                # Drawn in place; only the pages under the caption are touched
+                cv2.putText(image, "FACE REDACTED", (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+
+        with metrics.stage("image_save"):
+            image_format = output_profiles.resolve_image_format(image_format)
+            if image_format == "png":
+                target = open(output_path, "wb") if output_path else io.BytesIO()
+                with target:
+                    encode_stats = output_profiles.write_png_strips(image, target, image_quality)
+                    data = None if output_path else target.getvalue()
+            else:
+                data, encode_stats = output_profiles.encode_image(image, image_format, image_quality)
+                if output_path:
+                    with open(output_path, "wb") as f:
+                        f.write(data)
+                    data = None
+
+    encode_stats.update({"tiled": True, "tiles_rendered": tiles, "width": width, "height": height})
+    return data, encode_stats
@@ -0,0 +1,23 @@
+"""
+Production WSGI entry point
+Imports the Flask app and, unless PRELOAD_MODEL=0, loads the GLiNER model
+at import time. Under gunicorn with preload_app (see gunicorn.conf.py) this
+happens once in the master, so forked workers share the weights
+copy-on-write instead of each loading their own copy.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import gc
+import os
+
+import main
+
+app = main.app
+
+if os.getenv("PRELOAD_MODEL", "1") == "1":
+    main.get_model()
+    # Move everything allocated so far out of the collector's generations so
+    # GC passes in the workers do not write to (and so copy) shared pages
+    gc.collect()
+    gc.freeze()
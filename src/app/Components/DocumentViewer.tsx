@@ -13,7 +13,7 @@ interface DocumentViewerProps {
 const DocumentViewer = React.memo(
   ({ file, isPDF, progressNum }: DocumentViewerProps) => {
     const documentUrl = useMemo(() => URL.createObjectURL(file), [file]);
-    const { redactStatus } = useSelector(
+    const { redactStatus, redactedUrl } = useSelector(
       (state: RootState) => state.ProgressSlice
     );
 
@@ -22,7 +22,7 @@ const DocumentViewer = React.memo(
       if (redactStatus) {
         setTimestamp(Date.now());
       }
-    }, [redactStatus]);
+    }, [redactStatus, redactedUrl]);
 
     const getRedactedUrl = (path: string) => {
       return `${path}?t=${timestamp}`;
@@ -39,7 +39,7 @@ const DocumentViewer = React.memo(
             <iframe
               src={
                 redactStatus
-                  ? getRedactedUrl("/redacted_document.pdf")
+                  ? getRedactedUrl(redactedUrl ?? "/redacted_document.pdf")
                   : documentUrl
               }
               className="w-full h-full"
@@ -48,7 +48,7 @@ const DocumentViewer = React.memo(
             <img
               src={
                 redactStatus
-                  ? getRedactedUrl("/redacted_image.jpg")
+                  ? getRedactedUrl(redactedUrl ?? "/redacted_image.jpg")
                   : documentUrl
               }
               alt="Preview"
@@ -10,6 +10,7 @@ import { useDispatch, useSelector } from "react-redux";
 import {
   setProgressNum,
   setRedactStatus,
+  setRedactedUrl,
 } from "@/features/progress/ProgressSlice";
 import { motion } from "framer-motion";
 import axios from "axios";
@@ -66,6 +67,7 @@ function EntitySelect(props: Props) {
           }
         );
         console.log(result);
+        dispatch(setRedactedUrl(null));
         dispatch(setRedactStatus(true));
         if (data.redacted_file_url) {
           console.log("Redacted image URL:", data.redacted_file_url);
@@ -128,8 +130,9 @@ function EntitySelect(props: Props) {
         throw new Error("Failed to undo redaction");
       }
 
-      // Fetch the updated document after undoing redaction
-      const redacted = await fetch("/redacted_document.pdf");
+      // Undo publishes the restored version under its own document's path
+      const data = await response.json();
+      const redacted = await fetch(data.redacted_file_url);
       const pdfBlob = await redacted.blob();
       formData.append("redacted", pdfBlob, "redacted.pdf");
 
@@ -146,6 +149,7 @@ function EntitySelect(props: Props) {
       console.log("Undo result:", result);
 
       // Update the Redux state to reflect the undone state
+      dispatch(setRedactedUrl(data.redacted_file_url));
       dispatch(setRedactStatus(true));
       dispatch(setProgressNum(100));
     } catch (error) {
@@ -5,10 +5,13 @@ import { createSlice } from "@reduxjs/toolkit";
 interface num{
   progressNum:number
   redactStatus:boolean
+  // Per-document output published by undo; null means the shared output path
+  redactedUrl:string|null
 }
 const initialState:num={
   progressNum:0,
-  redactStatus:false
+  redactStatus:false,
+  redactedUrl:null
 }
 
 export const ProgressSlice=createSlice({
@@ -20,9 +23,12 @@ export const ProgressSlice=createSlice({
     },
     setRedactStatus:(state,action)=>{
       state.redactStatus=action.payload
+    },
+    setRedactedUrl:(state,action)=>{
+      state.redactedUrl=action.payload
     }
   }
 })
 
-export const {setProgressNum,setRedactStatus}=ProgressSlice.actions
+export const {setProgressNum,setRedactStatus,setRedactedUrl}=ProgressSlice.actions
 export default ProgressSlice.reducer